@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Benchmark de generate_complete contra um servidor LLM falso local
+Compara a execução sequencial das chamadas com a execução concorrente
+"""
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAKE_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0.5"))  # segundos por chamada
+ROUNDS = int(os.getenv("BENCH_ROUNDS", "3"))
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    """Imita POST /v1/chat/completions da OpenAI com latência fixa"""
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        system_prompt = body["messages"][0]["content"]
+        if "emoções" in system_prompt:
+            content = json.dumps({
+                "primary_emotion": "alegria",
+                "confidence": 0.9,
+                "emotions_breakdown": {"alegria": 0.9, "neutro": 0.1},
+                "suggestions": ["Mostre o resultado final logo no início"]
+            })
+        else:
+            content = json.dumps(["#fake 1", "#fake 2", "#fake 3"])
+
+        time.sleep(FAKE_LATENCY)
+
+        payload = json.dumps({
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # aguenta rajadas de conexões simultâneas
+
+def start_fake_server() -> str:
+    server = FakeLLMServer(("127.0.0.1", 0), FakeLLMHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+async def run_sequential(ai):
+    hooks = await ai.generate_hooks("fitness", "perder barriga", "direto", "tiktok", variants=3)
+    captions = await ai.generate_captions("fitness", "perder barriga", "direto", variants=3)
+    await ai.generate_hashtags("fitness", "perder barriga", "tiktok", count=10)
+    await ai.analyze_emotion(f"{hooks[0]} {captions[0]}", context="Vídeo sobre perder barriga em fitness")
+
+async def run_concurrent(ai):
+    await ai.generate_complete("fitness", "perder barriga", "direto", "tiktok", analyze_emotion_flag=True)
+
+async def measure(fn, ai) -> float:
+    timings = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        await fn(ai)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+async def run_benchmark():
+    import ai_generation as ai
+
+    sequential = await measure(run_sequential, ai)
+    concurrent = await measure(run_concurrent, ai)
+
+    print(f"Latência simulada por chamada: {FAKE_LATENCY:.2f}s")
+    print(f"Sequencial (4 chamadas):  {sequential:.3f}s")
+    print(f"generate_complete:        {concurrent:.3f}s")
+    print(f"Speedup:                  {sequential / concurrent:.2f}x")
+
+def main():
+    os.environ["OPENAI_BASE_URL"] = start_fake_server()
+    os.environ.setdefault("OPENAI_API_KEY", "fake-key")
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "hookify-api"))
+    asyncio.run(run_benchmark())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""
+Configuração comum dos testes da Hookify API (pytest)
+Todos os módulos de teste compartilham um banco SQLite temporário, fixado
+aqui antes que qualquer teste importe a API
+"""
+
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hookify-api")
+
+_tmp = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, _tmp, ignore_errors=True)
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp, 'tests.db')}"
+os.environ.setdefault("OPENAI_API_KEY", "test")
+sys.path.insert(0, API_DIR)
+
+import db  # noqa: E402  (engines criados já com o banco temporário)
+import models  # noqa: E402
+
+db.Base.metadata.create_all(db.engine)
+
+def create_user(email: str, plan: models.PlanType = models.PlanType.FREE) -> int:
+    """Cria usuário com assinatura no plano (quota cheia) e retorna o id"""
+    with db.SessionLocal() as session:
+        user = models.User(email=email, password_hash="x")
+        session.add(user)
+        session.flush()
+        session.add(models.Subscription(
+            user_id=user.id, plan_type=plan, monthly_quota=models.PLAN_QUOTAS[plan], used_quota=0
+        ))
+        session.commit()
+        return user.id
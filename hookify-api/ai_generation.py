@@ -3,17 +3,84 @@ Módulo de geração de conteúdo usando IA (OpenAI API)
 Suporta: hooks, legendas, hashtags e análise de emoção
 """
 
-from openai import OpenAI
-from typing import List, Dict, Tuple
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, RateLimitError
+from typing import AsyncIterator, Callable, List, Dict, Tuple, Optional
+from cache import TieredCache, build_response_cache, make_key
+from scheduler import model_scheduler
+from utils import JsonArrayStream
+from contextlib import contextmanager
+from collections import defaultdict
+from contextvars import ContextVar
+import asyncio
+import httpx
 import json
 import os
 
-# Cliente OpenAI já configurado via variáveis de ambiente
-client = OpenAI()
+# Máximo de conexões HTTP abertas com a API do modelo por processo
+AI_MAX_CONNECTIONS = int(os.getenv("AI_MAX_CONNECTIONS", "1000"))
+# Tópicos por chamada no modo empacotado (lotes); 1 = uma chamada por tópico
+AI_PACK_SIZE = int(os.getenv("AI_PACK_SIZE", "8"))
+
+# Cliente OpenAI assíncrono já configurado via variáveis de ambiente
+client = AsyncOpenAI(
+    http_client=DefaultAsyncHttpxClient(
+        limits=httpx.Limits(max_connections=AI_MAX_CONNECTIONS, max_keepalive_connections=100)
+    )
+)
 
 # Modelo padrão (pode ser alterado via env)
 DEFAULT_MODEL = os.getenv("AI_MODEL", "gpt-4.1-mini")
 
+# Cache de respostas do modelo (None = desativado)
+response_cache: Optional[TieredCache] = build_response_cache()
+
+# Chamadas ao modelo em andamento, por chave canônica (single-flight)
+_inflight: Dict[str, asyncio.Future] = {}
+_singleflight_counters = {"leaders": 0, "followers": 0}
+_pack_counters = {"calls": 0, "topics": 0, "missing": 0, "failed_calls": 0}
+
+# Gerações que caíram no fallback de templates dentro de track_fallbacks()
+_fallbacks: ContextVar[Optional[List[str]]] = ContextVar("ai_fallbacks", default=None)
+
+@contextmanager
+def track_fallbacks():
+    """
+    Coleta os tipos de geração que caíram no fallback dentro do bloco.
+    A lista é compartilhada com as tasks criadas dentro dele (generate_complete).
+    """
+    events: List[str] = []
+    token = _fallbacks.set(events)
+    try:
+        yield events
+    finally:
+        _fallbacks.reset(token)
+
+# Plano de quem originou a chamada, usado pelo model_scheduler (None = FREE)
+_model_plan: ContextVar[Optional[str]] = ContextVar("ai_model_plan", default=None)
+
+@contextmanager
+def model_plan(plan: Optional[str]):
+    """Chamadas ao modelo dentro do bloco entram na fila do plano informado"""
+    token = _model_plan.set(plan)
+    try:
+        yield
+    finally:
+        _model_plan.reset(token)
+
+def _estimate_tokens(system_prompt: str, user_prompt: str, max_tokens: int) -> int:
+    # ~4 caracteres por token no prompt, mais o máximo da resposta
+    return (len(system_prompt) + len(user_prompt)) // 4 + max_tokens
+
+def _record_fallback(kind: str):
+    events = _fallbacks.get()
+    if events is not None:
+        events.append(kind)
+
+def set_response_cache(cache: Optional[TieredCache]):
+    """Substitui o cache de respostas (ex.: outro backend compartilhado)"""
+    global response_cache
+    response_cache = cache
+
 # ==================== PROMPTS ESPECIALIZADOS ====================
 
 HOOK_SYSTEM_PROMPT = """Você é um especialista em criar hooks virais para vídeos curtos (TikTok, Reels, Shorts).
@@ -55,17 +122,144 @@ Analise o texto/descrição e identifique:
 
 Retorne APENAS um JSON com: primary_emotion, confidence, emotions_breakdown (dict), suggestions (array)."""
 
+# ==================== CHAMADA AO MODELO ====================
+
+async def _complete(
+    system_prompt: str,
+    user_prompt: str,
+    temperature: float,
+    max_tokens: int,
+    use_cache: bool = True
+) -> str:
+    """
+    Retorna o conteúdo da resposta do modelo sem o bloco ```json.
+    Consulta o cache e agrupa chamadas idênticas simultâneas em uma única
+    chamada ao modelo (single-flight), a menos que use_cache seja False.
+    """
+    
+    key = make_key(
+        model=DEFAULT_MODEL,
+        system=system_prompt,
+        prompt=user_prompt,
+        temperature=temperature,
+        max_tokens=max_tokens
+    )
+    
+    if not use_cache:
+        if response_cache:
+            response_cache.record_bypass()
+        return await _call_model_and_store(key, system_prompt, user_prompt, temperature, max_tokens)
+    
+    if response_cache:
+        cached = await response_cache.get(key)
+        if cached is not None:
+            return cached
+    
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(
+            _call_model_and_store(key, system_prompt, user_prompt, temperature, max_tokens)
+        )
+        _inflight[key] = task
+        task.add_done_callback(lambda t: _forget_inflight(key, t))
+        _singleflight_counters["leaders"] += 1
+    else:
+        _singleflight_counters["followers"] += 1
+    
+    # shield: se um cliente desconectar, a chamada continua para os demais
+    return await asyncio.shield(task)
+
+def _forget_inflight(key: str, task: asyncio.Future):
+    _inflight.pop(key, None)
+    # Marca a exceção como lida caso todos os clientes tenham desistido
+    if not task.cancelled():
+        task.exception()
+
+async def _call_model_and_store(
+    key: str,
+    system_prompt: str,
+    user_prompt: str,
+    temperature: float,
+    max_tokens: int
+) -> str:
+    """Faz a chamada ao modelo (com vaga do model_scheduler) e guarda a resposta no cache"""
+    ticket = await model_scheduler.acquire(_model_plan.get(), _estimate_tokens(system_prompt, user_prompt, max_tokens))
+    used_tokens = headers = None
+    try:
+        raw = await client.chat.completions.with_raw_response.create(
+            model=DEFAULT_MODEL,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        headers = raw.headers
+        response = raw.parse()
+        used_tokens = response.usage.total_tokens if response.usage else None
+    except RateLimitError as e:
+        model_scheduler.rate_limited(e.response.headers)
+        raise
+    finally:
+        model_scheduler.release(ticket, used_tokens, headers)
+    
+    content = _strip_fence(response.choices[0].message.content)
+    
+    # Só guarda respostas que parseiam, para não servir lixo do cache
+    if response_cache and _is_json(content):
+        await response_cache.set(key, content)
+    return content
+
+def _strip_fence(content: str) -> str:
+    content = content.strip()
+    if content.startswith("```json"):
+        content = content.replace("```json", "").replace("```", "").strip()
+    return content
+
+def _is_json(content: str) -> bool:
+    try:
+        json.loads(content)
+        return True
+    except ValueError:
+        return False
+
+def cache_stats() -> Dict:
+    """Métricas de hit/miss do cache de respostas"""
+    return response_cache.stats() if response_cache else {"enabled": False}
+
+def singleflight_stats() -> Dict:
+    """Métricas do agrupamento de chamadas simultâneas"""
+    return {**_singleflight_counters, "in_flight": len(_inflight)}
+
+def pack_stats() -> Dict:
+    """Métricas do modo empacotado: chamadas, tópicos atendidos e tópicos que voltaram para a chamada individual"""
+    return {**_pack_counters, "pack_size": AI_PACK_SIZE}
+
 # ==================== FUNÇÕES DE GERAÇÃO ====================
 
-def generate_hooks(
+async def generate_hooks(
     niche: str,
     topic: str,
     tone: str,
     platform: str,
-    variants: int = 3
+    variants: int = 3,
+    use_cache: bool = True
 ) -> List[str]:
     """Gera hooks virais usando IA"""
     
+    user_prompt = _hook_prompt(niche, topic, tone, platform, variants)
+    try:
+        content = await _complete(HOOK_SYSTEM_PROMPT, user_prompt, temperature=0.9, max_tokens=500, use_cache=use_cache)
+        hooks = json.loads(content)
+        return hooks if isinstance(hooks, list) else [content]
+    
+    except Exception as e:
+        print(f"Erro ao gerar hooks: {e}")
+        _record_fallback("hooks")
+        return _hook_fallback(niche, topic, variants)
+
+def _hook_prompt(niche: str, topic: str, tone: str, platform: str, variants: int) -> str:
     tone_map = {
         "direto": "direto e objetivo",
         "motivacional": "inspirador e motivacional",
@@ -73,53 +267,54 @@ def generate_hooks(
         "storytelling": "narrativo e envolvente"
     }
     
-    user_prompt = f"""Crie {variants} hooks virais para um vídeo de {platform} sobre:
+    return f"""Crie {variants} hooks virais para um vídeo de {platform} sobre:
 Nicho: {niche}
 Tópico: {topic}
 Tom: {tone_map.get(tone, tone)}
 
 Retorne um array JSON: ["hook 1", "hook 2", ...]"""
 
-    try:
-        response = client.chat.completions.create(
-            model=DEFAULT_MODEL,
-            messages=[
-                {"role": "system", "content": HOOK_SYSTEM_PROMPT},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.9,
-            max_tokens=500
-        )
-        
-        content = response.choices[0].message.content.strip()
-        # Tenta parsear JSON
-        if content.startswith("```json"):
-            content = content.replace("```json", "").replace("```", "").strip()
-        
-        hooks = json.loads(content)
-        return hooks if isinstance(hooks, list) else [content]
-    
-    except Exception as e:
-        print(f"Erro ao gerar hooks: {e}")
-        # Fallback para templates
-        return [
-            f"Ninguém te conta isso sobre {topic}…",
-            f"Pare de errar em {topic} — faça isso 👇",
-            f"Se eu começasse do zero em {niche} hoje, faria isso:"
-        ][:variants]
-
-def generate_captions(
+def _hook_fallback(niche: str, topic: str, variants: int) -> List[str]:
+    # Fallback para templates
+    return [
+        f"Ninguém te conta isso sobre {topic}…",
+        f"Pare de errar em {topic} — faça isso 👇",
+        f"Se eu começasse do zero em {niche} hoje, faria isso:"
+    ][:variants]
+
+async def generate_captions(
     niche: str,
     topic: str,
     tone: str,
     product_name: str = None,
     call_to_action: str = None,
     max_length: int = 150,
-    variants: int = 3
+    variants: int = 3,
+    use_cache: bool = True
 ) -> List[str]:
     """Gera legendas persuasivas usando IA"""
     
-    user_prompt = f"""Crie {variants} legendas para um vídeo sobre:
+    user_prompt = _caption_prompt(niche, topic, tone, product_name, call_to_action, max_length, variants)
+    try:
+        content = await _complete(CAPTION_SYSTEM_PROMPT, user_prompt, temperature=0.8, max_tokens=800, use_cache=use_cache)
+        captions = json.loads(content)
+        return captions if isinstance(captions, list) else [content]
+    
+    except Exception as e:
+        print(f"Erro ao gerar legendas: {e}")
+        _record_fallback("captions")
+        return _caption_fallback(niche, topic, call_to_action, variants)
+
+def _caption_prompt(
+    niche: str,
+    topic: str,
+    tone: str,
+    product_name: Optional[str],
+    call_to_action: Optional[str],
+    max_length: int,
+    variants: int
+) -> str:
+    return f"""Crie {variants} legendas para um vídeo sobre:
 Nicho: {niche}
 Tópico: {topic}
 Tom: {tone}
@@ -129,78 +324,56 @@ Tamanho máximo: {max_length} palavras
 
 Retorne um array JSON: ["legenda 1", "legenda 2", ...]"""
 
-    try:
-        response = client.chat.completions.create(
-            model=DEFAULT_MODEL,
-            messages=[
-                {"role": "system", "content": CAPTION_SYSTEM_PROMPT},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.8,
-            max_tokens=800
-        )
-        
-        content = response.choices[0].message.content.strip()
-        if content.startswith("```json"):
-            content = content.replace("```json", "").replace("```", "").strip()
-        
-        captions = json.loads(content)
-        return captions if isinstance(captions, list) else [content]
-    
-    except Exception as e:
-        print(f"Erro ao gerar legendas: {e}")
-        return [
-            f"Aprenda sobre {topic} de forma simples e prática. {call_to_action or 'Salva esse vídeo!'}",
-            f"Se você quer resultados em {niche}, precisa saber isso. {call_to_action or 'Comenta aqui embaixo!'}",
-            f"O segredo para {topic} que ninguém te conta. {call_to_action or 'Compartilha com quem precisa!'}"
-        ][:variants]
+def _caption_fallback(niche: str, topic: str, call_to_action: Optional[str], variants: int) -> List[str]:
+    return [
+        f"Aprenda sobre {topic} de forma simples e prática. {call_to_action or 'Salva esse vídeo!'}",
+        f"Se você quer resultados em {niche}, precisa saber isso. {call_to_action or 'Comenta aqui embaixo!'}",
+        f"O segredo para {topic} que ninguém te conta. {call_to_action or 'Compartilha com quem precisa!'}"
+    ][:variants]
 
-def generate_hashtags(
+async def generate_hashtags(
     niche: str,
     topic: str,
     platform: str,
     count: int = 10,
-    include_trending: bool = True
+    include_trending: bool = True,
+    use_cache: bool = True
 ) -> List[str]:
     """Gera hashtags relevantes usando IA"""
     
-    user_prompt = f"""Crie {count} hashtags para um vídeo de {platform} sobre:
-Nicho: {niche}
-Tópico: {topic}
-{'Incluir hashtags em alta/trending' if include_trending else 'Focar em hashtags de nicho'}
-
-Retorne um array JSON: ["#hashtag1", "#hashtag2", ...]"""
-
+    user_prompt = _hashtag_prompt(niche, topic, platform, count, include_trending)
     try:
-        response = client.chat.completions.create(
-            model=DEFAULT_MODEL,
-            messages=[
-                {"role": "system", "content": HASHTAG_SYSTEM_PROMPT},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.7,
-            max_tokens=400
-        )
-        
-        content = response.choices[0].message.content.strip()
-        if content.startswith("```json"):
-            content = content.replace("```json", "").replace("```", "").strip()
-        
+        content = await _complete(HASHTAG_SYSTEM_PROMPT, user_prompt, temperature=0.7, max_tokens=400, use_cache=use_cache)
         hashtags = json.loads(content)
         # Garante que todas tenham #
-        hashtags = [h if h.startswith("#") else f"#{h}" for h in hashtags]
+        hashtags = [_as_hashtag(h) for h in hashtags]
         return hashtags if isinstance(hashtags, list) else [content]
     
     except Exception as e:
         print(f"Erro ao gerar hashtags: {e}")
-        niche_tag = niche.replace(" ", "").lower()
-        topic_tag = topic.replace(" ", "").lower()
-        return [
-            f"#{niche_tag}", f"#{topic_tag}", "#viral", "#fyp", "#foryou",
-            "#dicas", "#aprendizado", "#conteudo", "#trending", "#explorepage"
-        ][:count]
-
-def analyze_emotion(text: str, context: str = None) -> Dict:
+        _record_fallback("hashtags")
+        return _hashtag_fallback(niche, topic, count)
+
+def _hashtag_prompt(niche: str, topic: str, platform: str, count: int, include_trending: bool) -> str:
+    return f"""Crie {count} hashtags para um vídeo de {platform} sobre:
+Nicho: {niche}
+Tópico: {topic}
+{'Incluir hashtags em alta/trending' if include_trending else 'Focar em hashtags de nicho'}
+
+Retorne um array JSON: ["#hashtag1", "#hashtag2", ...]"""
+
+def _as_hashtag(tag: str) -> str:
+    return tag if tag.startswith("#") else f"#{tag}"
+
+def _hashtag_fallback(niche: str, topic: str, count: int) -> List[str]:
+    niche_tag = niche.replace(" ", "").lower()
+    topic_tag = topic.replace(" ", "").lower()
+    return [
+        f"#{niche_tag}", f"#{topic_tag}", "#viral", "#fyp", "#foryou",
+        "#dicas", "#aprendizado", "#conteudo", "#trending", "#explorepage"
+    ][:count]
+
+async def analyze_emotion(text: str, context: str = None, use_cache: bool = True) -> Dict:
     """Analisa a emoção predominante no texto usando IA"""
     
     user_prompt = f"""Analise a emoção predominante neste texto/descrição de vídeo:
@@ -217,25 +390,13 @@ Retorne um JSON com:
 }}"""
 
     try:
-        response = client.chat.completions.create(
-            model=DEFAULT_MODEL,
-            messages=[
-                {"role": "system", "content": EMOTION_SYSTEM_PROMPT},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.5,
-            max_tokens=600
-        )
-        
-        content = response.choices[0].message.content.strip()
-        if content.startswith("```json"):
-            content = content.replace("```json", "").replace("```", "").strip()
-        
+        content = await _complete(EMOTION_SYSTEM_PROMPT, user_prompt, temperature=0.5, max_tokens=600, use_cache=use_cache)
         result = json.loads(content)
         return result
     
     except Exception as e:
         print(f"Erro ao analisar emoção: {e}")
+        _record_fallback("emotion")
         return {
             "primary_emotion": "neutro",
             "confidence": 0.5,
@@ -243,25 +404,337 @@ Retorne um JSON com:
             "suggestions": ["Adicione mais elementos emocionais ao conteúdo"]
         }
 
-def generate_complete(
+async def generate_complete(
     niche: str,
     topic: str,
     tone: str,
     platform: str,
     product_name: str = None,
     call_to_action: str = None,
-    analyze_emotion_flag: bool = False
+    analyze_emotion_flag: bool = False,
+    use_cache: bool = True
 ) -> Tuple[List[str], List[str], List[str], Dict]:
-    """Gera hooks, legendas, hashtags e opcionalmente analisa emoção"""
+    """
+    Gera hooks, legendas, hashtags e opcionalmente analisa emoção.
+    As três gerações rodam em paralelo; a análise de emoção começa assim que
+    hooks e legendas ficam prontos, sem esperar pelas hashtags.
+    """
+    
+    hooks_task = asyncio.create_task(generate_hooks(niche, topic, tone, platform, variants=3, use_cache=use_cache))
+    captions_task = asyncio.create_task(generate_captions(niche, topic, tone, product_name, call_to_action, variants=3, use_cache=use_cache))
+    hashtags_task = asyncio.create_task(generate_hashtags(niche, topic, platform, count=10, use_cache=use_cache))
     
-    hooks = generate_hooks(niche, topic, tone, platform, variants=3)
-    captions = generate_captions(niche, topic, tone, product_name, call_to_action, variants=3)
-    hashtags = generate_hashtags(niche, topic, platform, count=10)
+    hooks, captions = await asyncio.gather(hooks_task, captions_task)
     
-    emotion_result = None
+    emotion_task = None
     if analyze_emotion_flag:
         # Analisa a emoção do primeiro hook + primeira legenda
         combined_text = f"{hooks[0]} {captions[0]}"
-        emotion_result = analyze_emotion(combined_text, context=f"Vídeo sobre {topic} em {niche}")
+        emotion_task = asyncio.create_task(analyze_emotion(combined_text, context=f"Vídeo sobre {topic} em {niche}", use_cache=use_cache))
+    
+    hashtags = await hashtags_task
+    emotion_result = await emotion_task if emotion_task else None
     
     return hooks, captions, hashtags, emotion_result
+
+# ==================== STREAMING ====================
+
+async def _stream_items(
+    system_prompt: str,
+    user_prompt: str,
+    temperature: float,
+    max_tokens: int,
+    use_cache: bool = True
+) -> AsyncIterator[str]:
+    """
+    Versão em streaming de _complete para respostas em array JSON: emite cada
+    item assim que a string dele fecha. Uma resposta em cache sai de uma vez;
+    a resposta nova vai para o cache ao final, se parsear. Sem single-flight.
+    """
+    
+    key = make_key(
+        model=DEFAULT_MODEL,
+        system=system_prompt,
+        prompt=user_prompt,
+        temperature=temperature,
+        max_tokens=max_tokens
+    )
+    
+    if response_cache:
+        if not use_cache:
+            response_cache.record_bypass()
+        else:
+            cached = await response_cache.get(key)
+            if cached is not None:
+                items = json.loads(cached)
+                for item in items if isinstance(items, list) else [cached]:
+                    yield item
+                return
+    
+    # A vaga fica presa até o fim do stream
+    ticket = await model_scheduler.acquire(_model_plan.get(), _estimate_tokens(system_prompt, user_prompt, max_tokens))
+    used_tokens = headers = stream = None
+    parser = JsonArrayStream()
+    chunks = []
+    try:
+        raw = await client.chat.completions.with_raw_response.create(
+            model=DEFAULT_MODEL,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        headers = raw.headers
+        stream = raw.parse()
+        async for chunk in stream:
+            if chunk.usage:
+                used_tokens = chunk.usage.total_tokens
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            chunks.append(delta)
+            for item in parser.feed(delta):
+                yield item
+    except RateLimitError as e:
+        model_scheduler.rate_limited(e.response.headers)
+        raise
+    finally:
+        model_scheduler.release(ticket, used_tokens, headers)
+        if stream is not None:
+            await stream.close()
+    
+    if not parser.items:
+        raise ValueError("resposta sem array JSON")
+    content = _strip_fence("".join(chunks))
+    if response_cache and _is_json(content):
+        await response_cache.set(key, content)
+
+async def _stream_with_fallback(
+    kind: str,
+    items: AsyncIterator[str],
+    fallback: Callable[[], List[str]]
+) -> AsyncIterator[str]:
+    """Repassa os itens; se o modelo falhar, completa com os templates que faltarem"""
+    emitted = 0
+    try:
+        async for item in items:
+            emitted += 1
+            yield item
+    except Exception as e:
+        print(f"Erro no streaming de {kind}: {e}")
+        _record_fallback(kind)
+        for item in fallback()[emitted:]:
+            yield item
+    finally:
+        # Fecha o stream do modelo (e devolve a vaga) mesmo se o consumidor parar no meio
+        await items.aclose()
+
+def stream_hooks(
+    niche: str,
+    topic: str,
+    tone: str,
+    platform: str,
+    variants: int = 3,
+    use_cache: bool = True
+) -> AsyncIterator[str]:
+    """Versão em streaming de generate_hooks"""
+    return _stream_with_fallback(
+        "hooks",
+        _stream_items(HOOK_SYSTEM_PROMPT, _hook_prompt(niche, topic, tone, platform, variants), 0.9, 500, use_cache),
+        lambda: _hook_fallback(niche, topic, variants)
+    )
+
+def stream_captions(
+    niche: str,
+    topic: str,
+    tone: str,
+    product_name: str = None,
+    call_to_action: str = None,
+    max_length: int = 150,
+    variants: int = 3,
+    use_cache: bool = True
+) -> AsyncIterator[str]:
+    """Versão em streaming de generate_captions"""
+    user_prompt = _caption_prompt(niche, topic, tone, product_name, call_to_action, max_length, variants)
+    return _stream_with_fallback(
+        "captions",
+        _stream_items(CAPTION_SYSTEM_PROMPT, user_prompt, 0.8, 800, use_cache),
+        lambda: _caption_fallback(niche, topic, call_to_action, variants)
+    )
+
+async def stream_hashtags(
+    niche: str,
+    topic: str,
+    platform: str,
+    count: int = 10,
+    include_trending: bool = True,
+    use_cache: bool = True
+) -> AsyncIterator[str]:
+    """Versão em streaming de generate_hashtags"""
+    items = _stream_with_fallback(
+        "hashtags",
+        _stream_items(HASHTAG_SYSTEM_PROMPT, _hashtag_prompt(niche, topic, platform, count, include_trending), 0.7, 400, use_cache),
+        lambda: _hashtag_fallback(niche, topic, count)
+    )
+    try:
+        async for tag in items:
+            yield _as_hashtag(tag)
+    finally:
+        await items.aclose()
+
+async def stream_complete(
+    niche: str,
+    topic: str,
+    tone: str,
+    platform: str,
+    product_name: str = None,
+    call_to_action: str = None,
+    analyze_emotion_flag: bool = False,
+    use_cache: bool = True
+) -> AsyncIterator[Tuple[str, object]]:
+    """
+    Versão em streaming de generate_complete: emite ("hooks" | "captions" | "hashtags", item)
+    na ordem em que chegam e, por último, ("emotion", resultado), se pedida.
+    A análise de emoção começa assim que o primeiro hook e a primeira legenda chegam.
+    """
+    
+    streams = {
+        "hooks": stream_hooks(niche, topic, tone, platform, variants=3, use_cache=use_cache),
+        "captions": stream_captions(niche, topic, tone, product_name, call_to_action, variants=3, use_cache=use_cache),
+        "hashtags": stream_hashtags(niche, topic, platform, count=10, use_cache=use_cache),
+    }
+    queue: asyncio.Queue = asyncio.Queue()
+    firsts: Dict[str, str] = {}
+    
+    async def pump(kind: str, items: AsyncIterator[str]):
+        try:
+            async for item in items:
+                await queue.put((kind, item))
+        finally:
+            await queue.put((kind, None))
+    
+    def start_emotion():
+        combined_text = f"{firsts.get('hooks', '')} {firsts.get('captions', '')}".strip()
+        return asyncio.create_task(analyze_emotion(combined_text, context=f"Vídeo sobre {topic} em {niche}", use_cache=use_cache))
+    
+    tasks = [asyncio.create_task(pump(kind, items)) for kind, items in streams.items()]
+    emotion_task = None
+    pending = len(tasks)
+    try:
+        while pending:
+            kind, item = await queue.get()
+            if item is None:
+                pending -= 1
+                continue
+            firsts.setdefault(kind, item)
+            if analyze_emotion_flag and emotion_task is None and "hooks" in firsts and "captions" in firsts:
+                emotion_task = start_emotion()
+            yield kind, item
+        
+        if analyze_emotion_flag:
+            yield "emotion", await (emotion_task or start_emotion())
+    finally:
+        for task in tasks:
+            task.cancel()
+        if emotion_task:
+            emotion_task.cancel()
+
+# ==================== EMPACOTAMENTO ====================
+
+# Tipos que podem ir vários tópicos por chamada -> (system prompt, temperature, max_tokens por tópico)
+PACKABLE = {
+    "hooks": (HOOK_SYSTEM_PROMPT, 0.9, 500),
+    "captions": (CAPTION_SYSTEM_PROMPT, 0.8, 800),
+    "hashtags": (HASHTAG_SYSTEM_PROMPT, 0.7, 400),
+}
+_PACK_MAX_TOKENS = 16000
+
+_PACKED_INSTRUCTIONS = """
+Quando receber vários tópicos numerados, trate cada um separadamente e retorne APENAS
+um objeto JSON com uma chave por número de tópico ("1", "2", ...), cada uma com o array
+pedido para aquele tópico, sem explicações."""
+
+def _pack_group(kind: str, spec: dict) -> tuple:
+    """Tópicos com o mesmo grupo compartilham todo o prompt, exceto o tópico"""
+    if kind == "hooks":
+        return (spec["niche"], spec.get("tone", "direto"), spec.get("platform", "tiktok"), spec.get("variants", 3))
+    if kind == "captions":
+        return (
+            spec["niche"], spec.get("tone", "direto"), spec.get("product_name"), spec.get("call_to_action"),
+            spec.get("max_length", 150), spec.get("variants", 3)
+        )
+    return (spec["niche"], spec.get("platform", "tiktok"), spec.get("count", 10), spec.get("include_trending", True))
+
+def _single_prompt(kind: str, spec: dict, topic: str) -> str:
+    if kind == "hooks":
+        return _hook_prompt(spec["niche"], topic, spec.get("tone", "direto"), spec.get("platform", "tiktok"), spec.get("variants", 3))
+    if kind == "captions":
+        return _caption_prompt(
+            spec["niche"], topic, spec.get("tone", "direto"), spec.get("product_name"), spec.get("call_to_action"),
+            spec.get("max_length", 150), spec.get("variants", 3)
+        )
+    return _hashtag_prompt(spec["niche"], topic, spec.get("platform", "tiktok"), spec.get("count", 10), spec.get("include_trending", True))
+
+def _packed_prompt(kind: str, specs: List[dict]) -> str:
+    # O prompt individual, sem a linha final de formato, com a lista de tópicos no lugar do tópico
+    base = _single_prompt(kind, specs[0], "um por item da lista abaixo").rsplit("Retorne", 1)[0].rstrip()
+    topics = "\n".join(f"{n}. {spec['topic']}" for n, spec in enumerate(specs, 1))
+    keys = ", ".join(f'"{n}": [...]' for n in range(1, min(len(specs), 2) + 1))
+    return f"""{base}
+
+Tópicos:
+{topics}
+
+Faça um conjunto separado para cada tópico.
+Retorne um objeto JSON com uma chave por tópico: {{{keys}, ...}}"""
+
+def _packed_item(kind: str, spec: dict, value) -> Optional[List[str]]:
+    """Valida o array de um tópico na resposta empacotada; None se ausente ou inválido"""
+    if not isinstance(value, list) or not value or not all(isinstance(item, str) for item in value):
+        return None
+    if kind == "hashtags":
+        return [_as_hashtag(tag) for tag in value][:spec.get("count", 10)]
+    return value[:spec.get("variants", 3)]
+
+async def generate_pack(kind: str, specs: List[dict], use_cache: bool = True) -> List[Optional[List[str]]]:
+    """
+    Uma chamada ao modelo para vários tópicos do mesmo grupo (ver pack_groups).
+    Retorna o resultado de cada tópico na ordem de `specs`, ou None para os que
+    faltarem ou vierem inválidos na resposta (a chamada inteira falhando = todos None).
+    """
+    system_prompt, temperature, max_tokens = PACKABLE[kind]
+    _pack_counters["calls"] += 1
+    try:
+        content = await _complete(
+            system_prompt + "\n" + _PACKED_INSTRUCTIONS,
+            _packed_prompt(kind, specs),
+            temperature=temperature,
+            max_tokens=min(max_tokens * len(specs), _PACK_MAX_TOKENS),
+            use_cache=use_cache
+        )
+        by_topic = json.loads(content)
+        if not isinstance(by_topic, dict):
+            raise ValueError("resposta empacotada não é um objeto JSON")
+    except Exception as e:
+        print(f"Erro na geração empacotada de {kind}: {e}")
+        _pack_counters["failed_calls"] += 1
+        _pack_counters["missing"] += len(specs)
+        return [None] * len(specs)
+    
+    results = [_packed_item(kind, spec, by_topic.get(str(n))) for n, spec in enumerate(specs, 1)]
+    missing = results.count(None)
+    _pack_counters["topics"] += len(specs) - missing
+    _pack_counters["missing"] += missing
+    return results
+
+def pack_groups(kind: str, specs: List[dict], pack_size: int = AI_PACK_SIZE) -> List[List[int]]:
+    """Divide os índices de `specs` em pacotes de até pack_size tópicos do mesmo grupo"""
+    groups: Dict[tuple, List[int]] = defaultdict(list)
+    for index, spec in enumerate(specs):
+        groups[_pack_group(kind, spec)].append(index)
+    size = max(1, pack_size)
+    return [indexes[i:i + size] for indexes in groups.values() for i in range(0, len(indexes), size)]
@@ -1,12 +1,19 @@
-from fastapi import FastAPI, Depends, HTTPException, Header
-from fastapi.responses import RedirectResponse
+from fastapi import FastAPI, Depends, HTTPException, Header, Query, Request
+from fastapi.responses import RedirectResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from contextlib import asynccontextmanager
+from datetime import datetime
 from sqlalchemy.orm import Session
-from sqlalchemy import select, func
-from typing import List, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, insert, func, or_, and_
+from typing import AsyncIterator, List, Optional, Tuple
+import asyncio
+import json
 import os
 
-from db import Base, engine, get_db
+from db import Base, engine, get_db, get_read_db, get_async_db, AsyncSessionLocal
 from models import User, Subscription, ApiKey, Link, Generation, PlanType, GenerationType, PLAN_QUOTAS
 from schemas import (
     UserRegister, UserLogin, Token, UserResponse,
@@ -16,30 +23,60 @@ from schemas import (
     HashtagGenerateRequest, HashtagGenerateResponse,
     EmotionAnalyzeRequest, EmotionAnalyzeResponse,
     CompleteGenerateRequest, CompleteGenerateResponse,
-    GenerationHistory, UsageStats,
-    ShortenRequest, ShortenResponse, LinkAnalytics,
+    BatchGenerateRequest, BatchJobResponse, JobSubmitRequest, JobResponse, JobResult, TRANSPORT_FIELDS,
+    GenerationHistory, GenerationHistoryPage, GenerationDetail, UsageStats,
+    ShortenRequest, ShortenResponse, ShortenBatchRequest, ShortenBatchResponse, LinkAnalytics,
+    LinkTimeseries, LinkTimeseriesPoint, LinkAnalyticsPage, CampaignTotals,
     GenerateRequest, GenerateResponse  # V1 legacy
 )
 from auth import (
     get_password_hash, authenticate_user, create_access_token,
-    get_current_user, generate_api_key, get_user_by_api_key
+    get_current_user, generate_api_key, get_user_by_api_key,
+    AuthenticatedUser, get_cached_api_key_user, revoke_api_key,
+    build_token_claims, get_user_by_token, get_cached_token_user
 )
 from ai_generation import (
     generate_hooks, generate_captions, generate_hashtags,
-    analyze_emotion, generate_complete
+    analyze_emotion, generate_complete, cache_stats, singleflight_stats, pack_stats, track_fallbacks, model_plan,
+    stream_hooks, stream_captions, stream_hashtags, stream_complete
+)
+from batch import run_batch, BATCH_MAX_ITEMS
+from scheduler import model_scheduler
+from jobs import submit_job, get_job, cancel_job, plan_priority, JOB_PLAN_PRIORITY, FINISHED
+from lifecycle import start_background, stop_background
+from history import history_writer
+from links import (
+    cache_link, cache_links, resolve_link, record_click,
+    link_stats, list_links, campaign_totals, owns_link, LINK_BATCH_MAX_SIZE
+)
+from clicks import (
+    click_writer, record_click_event, get_click_timeseries
+)
+from quota import (
+    check_and_update_quota, get_quota_info, upgrade_plan,
+    reserve_quota_async, commit_reservation_async, refund_reservation_async, get_user_plan_async
 )
-from quota import check_and_update_quota, get_quota_info, upgrade_plan
 from generation import generate_content  # V1 legacy
-from utils import gen_code
+from migrations import run_migrations
+from usage import get_usage_summary
+from shortcodes import short_codes
+from utils import encode_cursor, decode_cursor
 
 APP_URL = os.getenv("APP_URL", "http://localhost:8000")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    tasks = await start_background()
+    yield
+    await stop_background(tasks)
+
 app = FastAPI(
     title="Hookify API",
     version="2.0.0",
     description="API com IA para geração de hooks, legendas, hashtags e análise de emoção para vídeos",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # CORS
@@ -53,38 +90,160 @@ app.add_middleware(
 
 # Criar tabelas
 Base.metadata.create_all(bind=engine)
+run_migrations(engine)
 
 # ==================== HELPER FUNCTIONS ====================
 
-async def get_current_user_flexible(
-    authorization: Optional[str] = Header(None),
-    x_api_key: Optional[str] = Header(None),
-    db: Session = Depends(get_db)
-) -> User:
-    """Aceita tanto JWT (Bearer token) quanto API Key"""
+def _resolve_user(authorization: Optional[str], x_api_key: Optional[str], db: Session) -> AuthenticatedUser:
+    """Resolve o usuário a partir da API Key ou do token JWT"""
     
     # Tenta API Key primeiro
     if x_api_key:
         user = get_user_by_api_key(x_api_key, db)
-        if user:
+        if user and user.is_active:
             return user
     
     # Tenta JWT
     if authorization and authorization.startswith("Bearer "):
-        from fastapi.security import HTTPAuthorizationCredentials
-        from auth import decode_token
-        
         token = authorization.replace("Bearer ", "")
-        payload = decode_token(token)
-        user_id = payload.get("sub")
-        
-        if user_id:
-            user = db.get(User, user_id)
-            if user and user.is_active:
-                return user
+        user = get_user_by_token(token, db)
+        if user and user.is_active:
+            return user
     
     raise HTTPException(status_code=401, detail="Autenticação necessária")
 
+def _load_user(db: Session, user: AuthenticatedUser) -> User:
+    """Carrega o User do ORM para handlers que precisam de dados além do id"""
+    db_user = db.get(User, user.id)
+    if not db_user:
+        raise HTTPException(status_code=401, detail="Autenticação necessária")
+    return db_user
+
+def get_current_user_flexible(
+    authorization: Optional[str] = Header(None),
+    x_api_key: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+) -> AuthenticatedUser:
+    """Aceita tanto JWT (Bearer token) quanto API Key"""
+    return _resolve_user(authorization, x_api_key, db)
+
+def get_current_user_optional(
+    authorization: Optional[str] = Header(None),
+    x_api_key: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+) -> Optional[AuthenticatedUser]:
+    """Como get_current_user_flexible, mas retorna None quando não há credenciais"""
+    if not authorization and not x_api_key:
+        return None
+    return _resolve_user(authorization, x_api_key, db)
+
+async def get_current_user_async(
+    authorization: Optional[str] = Header(None),
+    x_api_key: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db)
+) -> AuthenticatedUser:
+    """Mesmo que get_current_user_flexible, sobre a sessão assíncrona dos endpoints /v2"""
+    # Caminho rápido: API key ou token já verificados, sem tocar no banco
+    if x_api_key:
+        user = get_cached_api_key_user(x_api_key)
+        if user and user.is_active:
+            return user
+    elif authorization and authorization.startswith("Bearer "):
+        user = get_cached_token_user(authorization.replace("Bearer ", ""))
+        if user and user.is_active:
+            return user
+    
+    user = await db.run_sync(lambda session: _resolve_user(authorization, x_api_key, session))
+    # Encerra a transação de leitura para não segurar a conexão durante a chamada ao modelo
+    await db.commit()
+    return user
+
+@asynccontextmanager
+async def reserved_generation(user: AuthenticatedUser, db: AsyncSession):
+    """
+    Reserva a quota antes da chamada ao modelo e a devolve se a geração
+    lançar exceção ou cair no fallback de templates. As chamadas ao modelo
+    dentro do bloco entram na fila do plano do usuário.
+    """
+    plan = await get_user_plan_async(db, user)
+    reservation = await reserve_quota_async(db, user.id)
+    with track_fallbacks() as fallbacks, model_plan(plan.value):
+        try:
+            yield reservation
+        except BaseException:
+            await refund_reservation_async(db, reservation)
+            raise
+    if fallbacks:
+        await refund_reservation_async(db, reservation)
+
+# Nome do evento SSE de cada campo da saída
+_SSE_EVENTS = {"hooks": "hook", "captions": "caption", "hashtags": "hashtag", "emotion": "emotion"}
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def _refund_detached(reservation):
+    """Devolve a quota em uma sessão própria, protegida do cancelamento do request"""
+    async def refund():
+        async with AsyncSessionLocal() as session:
+            await refund_reservation_async(session, reservation)
+    await asyncio.shield(asyncio.ensure_future(refund()))
+
+async def _sse_generation(
+    reservation,
+    plan: PlanType,
+    generation_type: GenerationType,
+    input_data: dict,
+    items: AsyncIterator[Tuple[str, object]]
+) -> AsyncIterator[str]:
+    """
+    Corpo SSE de uma geração: um evento por item assim que ele chega e, ao fim,
+    `done` com a quota restante. A geração só é registrada quando o stream
+    termina; erro, fallback ou desconexão do cliente devolvem a quota.
+    """
+    output = {}
+    try:
+        with track_fallbacks() as fallbacks, model_plan(plan.value):
+            async for field, value in items:
+                if field == "emotion":
+                    output[field] = value
+                    yield _sse(_SSE_EVENTS[field], value)
+                    continue
+                values = output.setdefault(field, [])
+                yield _sse(_SSE_EVENTS[field], {"index": len(values), "text": value})
+                values.append(value)
+    except Exception as e:
+        print(f"Erro no streaming da geração: {e}")
+        await _refund_detached(reservation)
+        yield _sse("error", {"detail": "Falha na geração"})
+        return
+    except BaseException:
+        await _refund_detached(reservation)
+        raise
+    
+    if fallbacks:
+        await _refund_detached(reservation)
+    remaining = await commit_reservation_async(
+        reservation, generation_type, input_data=input_data, output_data=output
+    )
+    yield _sse("done", {"quota_remaining": remaining})
+
+async def streaming_generation(
+    user: AuthenticatedUser,
+    db: AsyncSession,
+    generation_type: GenerationType,
+    input_data: dict,
+    items: AsyncIterator[Tuple[str, object]]
+) -> StreamingResponse:
+    """Reserva a quota antes de abrir o stream (recusa sai como 429 normal) e responde em SSE"""
+    plan = await get_user_plan_async(db, user)
+    reservation = await reserve_quota_async(db, user.id)
+    return StreamingResponse(
+        _sse_generation(reservation, plan, generation_type, input_data, items),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # ==================== ROOT ====================
 
 @app.get("/")
@@ -95,6 +254,19 @@ def root():
         "version": "2.0.0"
     }
 
+@app.get("/metrics", tags=["Ops"])
+def metrics():
+    """Métricas internas de desempenho"""
+    return {
+        "ai_cache": cache_stats(),
+        "ai_singleflight": singleflight_stats(),
+        "ai_packing": pack_stats(),
+        "ai_scheduler": model_scheduler.stats(),
+        "history_writer": history_writer.stats(),
+        "links": link_stats(),
+        "click_events": click_writer.stats()
+    }
+
 # ==================== AUTH ENDPOINTS ====================
 
 @app.post("/auth/register", response_model=UserResponse, tags=["Auth"])
@@ -145,24 +317,31 @@ def login(credentials: UserLogin, db: Session = Depends(get_db)):
     if not user:
         raise HTTPException(status_code=401, detail="Email ou senha incorretos")
     
-    access_token = create_access_token(data={"sub": user.id})
+    access_token = create_access_token(data=build_token_claims(user))
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/auth/me", response_model=UserResponse, tags=["Auth"])
-def get_me(user: User = Depends(get_current_user_flexible)):
+def get_me(user: AuthenticatedUser = Depends(get_current_user_flexible), db: Session = Depends(get_read_db)):
     """Retorna dados do usuário atual"""
-    return user
+    return _load_user(db, user)
+
+@app.delete("/auth/api-keys/{key_id}", tags=["Auth"])
+def revoke_key(key_id: int, user: AuthenticatedUser = Depends(get_current_user_flexible), db: Session = Depends(get_db)):
+    """Revoga uma API key do usuário atual"""
+    if not revoke_api_key(db, user.id, key_id):
+        raise HTTPException(status_code=404, detail="API key não encontrada")
+    return {"revoked": True}
 
 # ==================== SUBSCRIPTION ENDPOINTS ====================
 
 @app.get("/subscription", response_model=SubscriptionResponse, tags=["Subscription"])
-def get_subscription(user: User = Depends(get_current_user_flexible), db: Session = Depends(get_db)):
+def get_subscription(user: AuthenticatedUser = Depends(get_current_user_flexible), db: Session = Depends(get_read_db)):
     """Retorna assinatura atual do usuário"""
     
-    if not user.subscription:
+    sub = db.scalar(select(Subscription).where(Subscription.user_id == user.id))
+    if not sub:
         raise HTTPException(status_code=404, detail="Assinatura não encontrada")
     
-    sub = user.subscription
     return SubscriptionResponse(
         id=sub.id,
         plan_type=sub.plan_type,
@@ -177,12 +356,12 @@ def get_subscription(user: User = Depends(get_current_user_flexible), db: Sessio
 @app.post("/subscription/upgrade", response_model=SubscriptionResponse, tags=["Subscription"])
 def upgrade_subscription(
     request: UpgradeRequest,
-    user: User = Depends(get_current_user_flexible),
+    user: AuthenticatedUser = Depends(get_current_user_flexible),
     db: Session = Depends(get_db)
 ):
     """Faz upgrade do plano"""
     
-    subscription = upgrade_plan(user, request.plan_type.value, db)
+    subscription = upgrade_plan(_load_user(db, user), request.plan_type.value, db)
     
     return SubscriptionResponse(
         id=subscription.id,
@@ -196,30 +375,13 @@ def upgrade_subscription(
     )
 
 @app.get("/subscription/usage", response_model=UsageStats, tags=["Subscription"])
-def get_usage(user: User = Depends(get_current_user_flexible), db: Session = Depends(get_db)):
+def get_usage(user: AuthenticatedUser = Depends(get_current_user_flexible), db: Session = Depends(get_read_db)):
     """Retorna estatísticas de uso"""
     
-    quota_info = get_quota_info(user)
+    quota_info = get_quota_info(_load_user(db, user))
     
-    # Conta gerações do mês
-    from datetime import datetime, timedelta
-    thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-    
-    generations_count = db.scalar(
-        select(func.count(Generation.id))
-        .where(Generation.user_id == user.id)
-        .where(Generation.created_at >= thirty_days_ago)
-    ) or 0
-    
-    # Tipo mais usado
-    most_used = db.execute(
-        select(Generation.type, func.count(Generation.id).label("count"))
-        .where(Generation.user_id == user.id)
-        .where(Generation.created_at >= thirty_days_ago)
-        .group_by(Generation.type)
-        .order_by(func.count(Generation.id).desc())
-        .limit(1)
-    ).first()
+    # Gerações do mês e tipo mais usado, a partir dos contadores diários
+    generations_count, most_used = get_usage_summary(db, user.id)
     
     return UsageStats(
         current_plan=PlanType(quota_info["plan"]) if quota_info["plan"] != "NONE" else PlanType.FREE,
@@ -227,98 +389,146 @@ def get_usage(user: User = Depends(get_current_user_flexible), db: Session = Dep
         used_quota=quota_info["used_quota"],
         remaining_quota=quota_info["remaining_quota"],
         generations_this_month=generations_count,
-        most_used_type=most_used[0].value if most_used else None
+        most_used_type=most_used.value if most_used else None
     )
 
 # ==================== AI GENERATION ENDPOINTS (V2) ====================
 
 @app.post("/v2/generate/hook", response_model=HookGenerateResponse, tags=["AI Generation"])
-def generate_hook_v2(
+async def generate_hook_v2(
     request: HookGenerateRequest,
-    user: User = Depends(get_current_user_flexible),
-    db: Session = Depends(get_db)
+    user: AuthenticatedUser = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Gera hooks virais com IA"""
-    
-    hooks = generate_hooks(
-        niche=request.niche,
-        topic=request.topic,
-        tone=request.tone,
-        platform=request.platform,
-        variants=request.variants
-    )
+    """Gera hooks virais com IA (stream=true responde em SSE, um evento por hook)"""
+    
+    if request.stream:
+        hooks = stream_hooks(
+            niche=request.niche,
+            topic=request.topic,
+            tone=request.tone,
+            platform=request.platform,
+            variants=request.variants,
+            use_cache=not request.no_cache
+        )
+        return await streaming_generation(
+            user, db, GenerationType.HOOK, request.dict(exclude=TRANSPORT_FIELDS), (("hooks", hook) async for hook in hooks)
+        )
     
-    remaining = check_and_update_quota(
-        user, db, GenerationType.HOOK,
-        input_data=request.dict(),
+    async with reserved_generation(user, db) as reservation:
+        hooks = await generate_hooks(
+            niche=request.niche,
+            topic=request.topic,
+            tone=request.tone,
+            platform=request.platform,
+            variants=request.variants,
+            use_cache=not request.no_cache
+        )
+    
+    remaining = await commit_reservation_async(
+        reservation, GenerationType.HOOK,
+        input_data=request.dict(exclude=TRANSPORT_FIELDS),
         output_data={"hooks": hooks}
     )
     
     return HookGenerateResponse(hooks=hooks, quota_remaining=remaining)
 
 @app.post("/v2/generate/caption", response_model=CaptionGenerateResponse, tags=["AI Generation"])
-def generate_caption_v2(
+async def generate_caption_v2(
     request: CaptionGenerateRequest,
-    user: User = Depends(get_current_user_flexible),
-    db: Session = Depends(get_db)
+    user: AuthenticatedUser = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Gera legendas persuasivas com IA"""
-    
-    captions = generate_captions(
-        niche=request.niche,
-        topic=request.topic,
-        tone=request.tone,
-        product_name=request.product_name,
-        call_to_action=request.call_to_action,
-        max_length=request.max_length,
-        variants=request.variants
-    )
+    """Gera legendas persuasivas com IA (stream=true responde em SSE)"""
+    
+    if request.stream:
+        captions = stream_captions(
+            niche=request.niche,
+            topic=request.topic,
+            tone=request.tone,
+            product_name=request.product_name,
+            call_to_action=request.call_to_action,
+            max_length=request.max_length,
+            variants=request.variants,
+            use_cache=not request.no_cache
+        )
+        return await streaming_generation(
+            user, db, GenerationType.CAPTION, request.dict(exclude=TRANSPORT_FIELDS), (("captions", caption) async for caption in captions)
+        )
+    
+    async with reserved_generation(user, db) as reservation:
+        captions = await generate_captions(
+            niche=request.niche,
+            topic=request.topic,
+            tone=request.tone,
+            product_name=request.product_name,
+            call_to_action=request.call_to_action,
+            max_length=request.max_length,
+            variants=request.variants,
+            use_cache=not request.no_cache
+        )
     
-    remaining = check_and_update_quota(
-        user, db, GenerationType.CAPTION,
-        input_data=request.dict(),
+    remaining = await commit_reservation_async(
+        reservation, GenerationType.CAPTION,
+        input_data=request.dict(exclude=TRANSPORT_FIELDS),
         output_data={"captions": captions}
     )
     
     return CaptionGenerateResponse(captions=captions, quota_remaining=remaining)
 
 @app.post("/v2/generate/hashtags", response_model=HashtagGenerateResponse, tags=["AI Generation"])
-def generate_hashtags_v2(
+async def generate_hashtags_v2(
     request: HashtagGenerateRequest,
-    user: User = Depends(get_current_user_flexible),
-    db: Session = Depends(get_db)
+    user: AuthenticatedUser = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Gera hashtags relevantes com IA"""
-    
-    hashtags = generate_hashtags(
-        niche=request.niche,
-        topic=request.topic,
-        platform=request.platform,
-        count=request.count,
-        include_trending=request.include_trending
-    )
+    """Gera hashtags relevantes com IA (stream=true responde em SSE)"""
+    
+    if request.stream:
+        hashtags = stream_hashtags(
+            niche=request.niche,
+            topic=request.topic,
+            platform=request.platform,
+            count=request.count,
+            include_trending=request.include_trending,
+            use_cache=not request.no_cache
+        )
+        return await streaming_generation(
+            user, db, GenerationType.HASHTAG, request.dict(exclude=TRANSPORT_FIELDS), (("hashtags", tag) async for tag in hashtags)
+        )
     
-    remaining = check_and_update_quota(
-        user, db, GenerationType.HASHTAG,
-        input_data=request.dict(),
+    async with reserved_generation(user, db) as reservation:
+        hashtags = await generate_hashtags(
+            niche=request.niche,
+            topic=request.topic,
+            platform=request.platform,
+            count=request.count,
+            include_trending=request.include_trending,
+            use_cache=not request.no_cache
+        )
+    
+    remaining = await commit_reservation_async(
+        reservation, GenerationType.HASHTAG,
+        input_data=request.dict(exclude=TRANSPORT_FIELDS),
         output_data={"hashtags": hashtags}
     )
     
     return HashtagGenerateResponse(hashtags=hashtags, quota_remaining=remaining)
 
 @app.post("/v2/analyze/emotion", response_model=EmotionAnalyzeResponse, tags=["AI Generation"])
-def analyze_emotion_v2(
+async def analyze_emotion_v2(
     request: EmotionAnalyzeRequest,
-    user: User = Depends(get_current_user_flexible),
-    db: Session = Depends(get_db)
+    user: AuthenticatedUser = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Analisa emoção do texto/vídeo"""
     
-    result = analyze_emotion(request.text, request.context)
+    async with reserved_generation(user, db) as reservation:
+        result = await analyze_emotion(request.text, request.context, use_cache=not request.no_cache)
     
-    remaining = check_and_update_quota(
-        user, db, GenerationType.EMOTION,
-        input_data=request.dict(),
+    remaining = await commit_reservation_async(
+        reservation, GenerationType.EMOTION,
+        input_data=request.dict(exclude=TRANSPORT_FIELDS),
         output_data=result
     )
     
@@ -331,26 +541,41 @@ def analyze_emotion_v2(
     )
 
 @app.post("/v2/generate/complete", response_model=CompleteGenerateResponse, tags=["AI Generation"])
-def generate_complete_v2(
+async def generate_complete_v2(
     request: CompleteGenerateRequest,
-    user: User = Depends(get_current_user_flexible),
-    db: Session = Depends(get_db)
+    user: AuthenticatedUser = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Gera hooks, legendas, hashtags e opcionalmente analisa emoção"""
-    
-    hooks, captions, hashtags, emotion = generate_complete(
-        niche=request.niche,
-        topic=request.topic,
-        tone=request.tone,
-        platform=request.platform,
-        product_name=request.product_name,
-        call_to_action=request.call_to_action,
-        analyze_emotion_flag=request.analyze_emotion
-    )
+    """Gera hooks, legendas, hashtags e opcionalmente analisa emoção (stream=true responde em SSE)"""
+    
+    if request.stream:
+        items = stream_complete(
+            niche=request.niche,
+            topic=request.topic,
+            tone=request.tone,
+            platform=request.platform,
+            product_name=request.product_name,
+            call_to_action=request.call_to_action,
+            analyze_emotion_flag=request.analyze_emotion,
+            use_cache=not request.no_cache
+        )
+        return await streaming_generation(user, db, GenerationType.COMPLETE, request.dict(exclude=TRANSPORT_FIELDS), items)
+    
+    async with reserved_generation(user, db) as reservation:
+        hooks, captions, hashtags, emotion = await generate_complete(
+            niche=request.niche,
+            topic=request.topic,
+            tone=request.tone,
+            platform=request.platform,
+            product_name=request.product_name,
+            call_to_action=request.call_to_action,
+            analyze_emotion_flag=request.analyze_emotion,
+            use_cache=not request.no_cache
+        )
     
-    remaining = check_and_update_quota(
-        user, db, GenerationType.COMPLETE,
-        input_data=request.dict(),
+    remaining = await commit_reservation_async(
+        reservation, GenerationType.COMPLETE,
+        input_data=request.dict(exclude=TRANSPORT_FIELDS),
         output_data={"hooks": hooks, "captions": captions, "hashtags": hashtags, "emotion": emotion}
     )
     
@@ -372,32 +597,240 @@ def generate_complete_v2(
         quota_remaining=remaining
     )
 
+@app.post("/v2/generate/batch", tags=["AI Generation"])
+async def generate_batch_v2(
+    request: BatchGenerateRequest,
+    user: AuthenticatedUser = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Gera vários tópicos em um request: quota reservada uma vez para o lote,
+    concorrência limitada contra o modelo e histórico gravado em uma transação.
+    mode=stream responde em NDJSON (uma linha por item, na ordem em que ficam
+    prontos, e uma linha final com a quota); mode=job retorna um ID para consulta.
+    """
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=422, detail=f"Máximo de {BATCH_MAX_ITEMS} itens por lote")
+    
+    generation_type = GenerationType(request.type)
+    specs = [item.dict() for item in request.items]
+    plan = await get_user_plan_async(db, user)
+    reservation = await reserve_quota_async(db, user.id, len(specs))
+    
+    if request.mode == "job":
+        try:
+            job_id = await submit_job(
+                user.id, "batch", generation_type, {"items": specs, "no_cache": request.no_cache},
+                JOB_PLAN_PRIORITY[plan], reservation, max_attempts=1
+            )
+        except BaseException:
+            await refund_reservation_async(db, reservation)
+            raise
+        return BatchJobResponse(job_id=job_id, status="queued", total=len(specs), completed=0)
+    
+    async def ndjson():
+        with model_plan(plan.value):
+            async for result in run_batch(reservation, generation_type, specs, use_cache=not request.no_cache):
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        yield json.dumps({"done": True, "quota_remaining": reservation.remaining}) + "\n"
+    
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+@app.get("/v2/generate/batch/{job_id}", response_model=BatchJobResponse, tags=["AI Generation"])
+def get_batch_v2(
+    job_id: str,
+    user: AuthenticatedUser = Depends(get_current_user_flexible),
+    db: Session = Depends(get_read_db)
+):
+    """Status e, ao terminar, resultados de um lote enviado com mode=job"""
+    job = get_job(db, job_id, user.id)
+    if not job or job.kind != "batch":
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    result = json.loads(job.result) if job.result else {}
+    return BatchJobResponse(
+        job_id=job.id,
+        status=job.status.value,
+        total=len(json.loads(job.payload)["items"]),
+        completed=job.progress,
+        quota_remaining=job.quota_remaining if job.status in FINISHED else None,
+        results=result.get("results", [])
+    )
+
+# ==================== JOBS ====================
+
+# Tipo do job -> schema do corpo do endpoint /v2 equivalente
+_JOB_REQUESTS = {
+    "hook": HookGenerateRequest,
+    "caption": CaptionGenerateRequest,
+    "hashtag": HashtagGenerateRequest,
+    "emotion": EmotionAnalyzeRequest,
+    "complete": CompleteGenerateRequest,
+}
+
+def _job_response(job) -> JobResponse:
+    return JobResponse(
+        job_id=job.id,
+        kind=job.kind,
+        type=job.type,
+        status=job.status.value,
+        attempts=job.attempts,
+        progress=job.progress,
+        error=job.error,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+        expires_at=job.expires_at
+    )
+
+@app.post("/v2/jobs", response_model=JobResponse, status_code=202, tags=["Jobs"])
+async def submit_job_v2(
+    request: JobSubmitRequest,
+    user: AuthenticatedUser = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Enfileira uma geração de /v2 para rodar em segundo plano e responde na hora.
+    A quota é reservada agora; planos maiores saem antes da fila.
+    """
+    try:
+        body = _JOB_REQUESTS[request.type].model_validate(request.request)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    
+    reservation = await reserve_quota_async(db, user.id)
+    try:
+        job_id = await submit_job(
+            user.id, "generate", GenerationType(request.type), body.dict(), await plan_priority(db, user), reservation
+        )
+    except BaseException:
+        await refund_reservation_async(db, reservation)
+        raise
+    job = await db.run_sync(lambda session: get_job(session, job_id, user.id))
+    return _job_response(job)
+
+@app.get("/v2/jobs/{job_id}", response_model=JobResponse, tags=["Jobs"])
+def get_job_v2(
+    job_id: str,
+    user: AuthenticatedUser = Depends(get_current_user_flexible),
+    db: Session = Depends(get_read_db)
+):
+    """Status do job"""
+    job = get_job(db, job_id, user.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return _job_response(job)
+
+@app.get("/v2/jobs/{job_id}/result", response_model=JobResult, tags=["Jobs"])
+def get_job_result_v2(
+    job_id: str,
+    user: AuthenticatedUser = Depends(get_current_user_flexible),
+    db: Session = Depends(get_read_db)
+):
+    """Resultado do job (409 enquanto ele não terminar)"""
+    job = get_job(db, job_id, user.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    if job.status not in FINISHED:
+        raise HTTPException(status_code=409, detail=f"Job ainda não terminou ({job.status.value})")
+    return JobResult(
+        job_id=job.id,
+        status=job.status.value,
+        result=json.loads(job.result) if job.result else None,
+        error=job.error
+    )
+
+@app.delete("/v2/jobs/{job_id}", response_model=JobResponse, tags=["Jobs"])
+def cancel_job_v2(
+    job_id: str,
+    user: AuthenticatedUser = Depends(get_current_user_flexible),
+    db: Session = Depends(get_db)
+):
+    """Cancela o job; na fila, a quota volta na hora, rodando, quando o worker o interromper"""
+    if cancel_job(job_id, user.id) is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    job = get_job(db, job_id, user.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return _job_response(job)
+
 # ==================== HISTORY ====================
 
-@app.get("/history", response_model=List[GenerationHistory], tags=["History"])
+@app.get("/history", response_model=GenerationHistoryPage, tags=["History"])
 def get_history(
-    limit: int = 50,
-    user: User = Depends(get_current_user_flexible),
-    db: Session = Depends(get_db)
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    user: AuthenticatedUser = Depends(get_current_user_flexible),
+    db: Session = Depends(get_read_db)
 ):
-    """Retorna histórico de gerações"""
-    
-    generations = db.scalars(
-        select(Generation)
+    """Retorna histórico de gerações (paginado por cursor, sem o output_data)"""
+    
+    stmt = (
+        select(
+            Generation.id,
+            Generation.type,
+            Generation.created_at,
+            func.substr(Generation.input_data, 1, 100).label("input_summary")
+        )
         .where(Generation.user_id == user.id)
-        .order_by(Generation.created_at.desc())
-        .limit(limit)
+    )
+    
+    # Keyset em (created_at, id): custo constante independente da profundidade
+    if cursor:
+        try:
+            last_created_at, last_id = decode_cursor(cursor)
+            last_created_at = datetime.fromisoformat(last_created_at)
+            if type(last_id) is not int:
+                raise ValueError("cursor inválido")
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+        stmt = stmt.where(or_(
+            Generation.created_at < last_created_at,
+            and_(Generation.created_at == last_created_at, Generation.id < last_id)
+        ))
+    
+    rows = db.execute(
+        stmt.order_by(Generation.created_at.desc(), Generation.id.desc()).limit(limit + 1)
     ).all()
     
-    return [
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at.isoformat(), rows[-1].id)
+    
+    items = [
         GenerationHistory(
-            id=g.id,
-            type=g.type,
-            created_at=g.created_at,
-            input_summary=g.input_data[:100] if g.input_data else ""
+            id=r.id,
+            type=r.type,
+            created_at=r.created_at,
+            input_summary=r.input_summary or ""
         )
-        for g in generations
+        for r in rows
     ]
+    return GenerationHistoryPage(items=items, next_cursor=next_cursor)
+
+@app.get("/history/{generation_id}", response_model=GenerationDetail, tags=["History"])
+def get_history_item(
+    generation_id: int,
+    user: AuthenticatedUser = Depends(get_current_user_flexible),
+    db: Session = Depends(get_read_db)
+):
+    """Retorna uma geração completa, com entrada e saída"""
+    
+    generation = db.scalar(
+        select(Generation)
+        .where(Generation.id == generation_id)
+        .where(Generation.user_id == user.id)
+    )
+    if not generation:
+        raise HTTPException(status_code=404, detail="Geração não encontrada")
+    
+    return GenerationDetail(
+        id=generation.id,
+        type=generation.type,
+        created_at=generation.created_at,
+        input_data=json.loads(generation.input_data) if generation.input_data else None,
+        output_data=json.loads(generation.output_data) if generation.output_data else None
+    )
 
 # ==================== LEGACY V1 ENDPOINTS ====================
 
@@ -413,7 +846,7 @@ def templates():
 @app.post("/generate", response_model=GenerateResponse, tags=["Legacy V1"])
 def generate_v1(
     req: GenerateRequest,
-    user: User = Depends(get_current_user_flexible),
+    user: AuthenticatedUser = Depends(get_current_user_flexible),
     db: Session = Depends(get_db)
 ):
     """[DEPRECATED] Use /v2/generate/complete"""
@@ -435,29 +868,120 @@ def generate_v1(
 
 # ==================== LINK SHORTENER ====================
 
-@app.post("/links/shorten", response_model=ShortenResponse, tags=["Links"])
-def shorten(req: ShortenRequest, db: Session = Depends(get_db)):
-    code = gen_code()
+def _target_url(req: ShortenRequest) -> str:
     sep = "&" if "?" in str(req.url) else "?"
-    target = f"{req.url}{sep}utm_source={req.utm_source}&utm_medium={req.utm_medium}&utm_campaign={req.utm_campaign}"
-    link = Link(code=code, url=str(target),
+    return f"{req.url}{sep}utm_source={req.utm_source}&utm_medium={req.utm_medium}&utm_campaign={req.utm_campaign}"
+
+@app.post("/links/shorten", response_model=ShortenResponse, tags=["Links"])
+def shorten(
+    req: ShortenRequest,
+    user: Optional[AuthenticatedUser] = Depends(get_current_user_optional),
+    db: Session = Depends(get_db)
+):
+    code = short_codes.next_code()
+    link = Link(code=code, url=_target_url(req), user_id=user.id if user else None,
                 utm_source=req.utm_source, utm_medium=req.utm_medium, utm_campaign=req.utm_campaign)
     db.add(link)
     db.commit()
     db.refresh(link)
+    cache_link(link)
     return ShortenResponse(code=code, short_url=f"{APP_URL}/r/{code}", target_url=link.url, clicks=link.clicks)
 
+@app.post("/links/shorten/batch", response_model=ShortenBatchResponse, tags=["Links"])
+def shorten_batch(
+    req: ShortenBatchRequest,
+    user: Optional[AuthenticatedUser] = Depends(get_current_user_optional),
+    db: Session = Depends(get_db)
+):
+    """Encurta vários links de uma vez (um único INSERT em lote); resposta na ordem do pedido"""
+    if len(req.links) > LINK_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=422, detail=f"Máximo de {LINK_BATCH_MAX_SIZE} links por lote")
+    
+    codes = short_codes.allocate(len(req.links))
+    user_id = user.id if user else None
+    rows = [
+        {
+            "code": code, "url": _target_url(item), "user_id": user_id,
+            "utm_source": item.utm_source, "utm_medium": item.utm_medium, "utm_campaign": item.utm_campaign,
+            "clicks": 0
+        }
+        for code, item in zip(codes, req.links)
+    ]
+    db.execute(insert(Link), rows)
+    db.commit()
+    cache_links(rows)
+    
+    return ShortenBatchResponse(links=[
+        ShortenResponse(code=row["code"], short_url=f"{APP_URL}/r/{row['code']}", target_url=row["url"], clicks=0)
+        for row in rows
+    ])
+
 @app.get("/r/{code}", tags=["Links"])
-def redirect(code: str, db: Session = Depends(get_db)):
-    link = db.scalar(select(Link).where(Link.code == code))
-    if not link:
+async def redirect(code: str, request: Request, db: AsyncSession = Depends(get_async_db)):
+    link = await resolve_link(code, db)
+    if link is None:
         raise HTTPException(status_code=404, detail="Link not found")
-    link.clicks += 1
-    db.add(link)
-    db.commit()
+    record_click(code)
+    await record_click_event(code, link, request.headers.get("referer"), request.headers.get("user-agent"))
     return RedirectResponse(link.url, status_code=302)
 
-@app.get("/analytics/links", response_model=List[LinkAnalytics], tags=["Links"])
-def analytics(db: Session = Depends(get_db)):
-    rows = db.scalars(select(Link)).all()
-    return [LinkAnalytics(code=r.code, url=r.url, clicks=r.clicks) for r in rows]
+@app.get("/analytics/links", response_model=LinkAnalyticsPage, tags=["Links"])
+def analytics(
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    order: str = Query("recent", pattern="^(recent|clicks)$"),
+    utm_campaign: Optional[str] = None,
+    utm_source: Optional[str] = None,
+    user: AuthenticatedUser = Depends(get_current_user_flexible),
+    db: Session = Depends(get_read_db)
+):
+    """Links do usuário atual, paginados por cursor"""
+    try:
+        rows, next_cursor = list_links(db, user.id, limit, cursor, order, utm_campaign, utm_source)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    
+    items = [
+        LinkAnalytics(
+            code=r.code, url=r.url, clicks=r.clicks,
+            utm_source=r.utm_source, utm_medium=r.utm_medium, utm_campaign=r.utm_campaign,
+            created_at=r.created_at
+        )
+        for r in rows
+    ]
+    return LinkAnalyticsPage(items=items, next_cursor=next_cursor)
+
+@app.get("/analytics/campaigns", response_model=List[CampaignTotals], tags=["Links"])
+def analytics_campaigns(
+    utm_source: Optional[str] = None,
+    user: AuthenticatedUser = Depends(get_current_user_flexible),
+    db: Session = Depends(get_read_db)
+):
+    """Total de links e cliques por campanha do usuário atual"""
+    return [
+        CampaignTotals(utm_campaign=r.utm_campaign, links=r.links, clicks=r.clicks)
+        for r in campaign_totals(db, user.id, utm_source)
+    ]
+
+@app.get("/analytics/links/{code}/timeseries", response_model=LinkTimeseries, tags=["Links"])
+def link_timeseries(
+    code: str,
+    granularity: str = Query("hour", pattern="^(minute|hour|day)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    user: AuthenticatedUser = Depends(get_current_user_flexible),
+    db: Session = Depends(get_read_db)
+):
+    """Série temporal de cliques do link a partir dos agregados por minuto/hora/dia"""
+    if not owns_link(db, user.id, code):
+        raise HTTPException(status_code=404, detail="Link not found")
+    start, end, rows = get_click_timeseries(db, code, granularity, start, end)
+    points = [LinkTimeseriesPoint(bucket_start=bucket_start, clicks=clicks) for bucket_start, clicks in rows]
+    return LinkTimeseries(
+        code=code,
+        granularity=granularity,
+        start=start,
+        end=end,
+        total_clicks=sum(p.clicks for p in points),
+        points=points
+    )
@@ -1,15 +1,19 @@
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, Optional, Set
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import select, update, bindparam
 import os
 import secrets
+import threading
+import time
 
-from db import get_db
+from cache import MemoryCache
+import hashing
+from db import get_db, SessionLocal
 from models import User, ApiKey
 
 # Configurações
@@ -17,18 +21,28 @@ SECRET_KEY = os.getenv("SECRET_KEY", secrets.token_urlsafe(32))
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 dias
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Cache de autenticação por API key
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", "60"))  # segundos
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "100000"))
+# Intervalo de gravação em lote do last_used das API keys
+API_KEY_LAST_USED_FLUSH_SECONDS = int(os.getenv("API_KEY_LAST_USED_FLUSH_SECONDS", "30"))
+# Tokens JWT: claims assinadas de plano/status e intervalo de checagem de revogação
+JWT_EMBED_CLAIMS = os.getenv("JWT_EMBED_CLAIMS", "true").lower() == "true"
+JWT_REVOCATION_CHECK_SECONDS = int(os.getenv("JWT_REVOCATION_CHECK_SECONDS", "60"))
+JWT_CACHE_MAX_ENTRIES = int(os.getenv("JWT_CACHE_MAX_ENTRIES", "100000"))
+
+pwd_context = hashing.pwd_context
 security = HTTPBearer()
 
 # ==================== PASSWORD HASHING ====================
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verifica se a senha está correta"""
-    return pwd_context.verify(plain_password, hashed_password)
+    """Verifica se a senha está correta (no pool de processos de hashing)"""
+    return hashing.verify_password(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
-    """Gera hash da senha"""
-    return pwd_context.hash(password)
+    """Gera hash da senha (no pool de processos de hashing)"""
+    return hashing.hash_password(password)
 
 # ==================== JWT TOKEN ====================
 
@@ -43,6 +57,14 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def build_token_claims(user: User) -> dict:
+    """Claims do token de acesso; com JWT_EMBED_CLAIMS inclui plano e status assinados"""
+    claims = {"sub": str(user.id)}
+    if JWT_EMBED_CLAIMS:
+        claims["active"] = user.is_active
+        claims["plan"] = user.subscription.plan_type.value if user.subscription else None
+    return claims
+
 def decode_token(token: str) -> dict:
     """Decodifica um token JWT"""
     try:
@@ -73,7 +95,7 @@ def get_current_user(
     """Obtém o usuário atual a partir do token JWT"""
     token = credentials.credentials
     payload = decode_token(token)
-    user_id: int = payload.get("sub")
+    user_id = _token_user_id(payload)
     if user_id is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -101,27 +123,94 @@ def generate_api_key() -> str:
     """Gera uma nova API key"""
     return f"hk_{secrets.token_urlsafe(32)}"
 
-def get_user_by_api_key(api_key: str, db: Session) -> Optional[User]:
-    """Obtém usuário a partir de uma API key"""
-    key_obj = db.scalar(
-        select(ApiKey)
+@dataclass(frozen=True)
+class AuthenticatedUser:
+    """Usuário autenticado, resolvido sem carregar o ORM (cacheável)"""
+    id: int
+    is_active: bool = True
+    plan: Optional[str] = None  # claim do token, informativa; o plano efetivo vem de quota.get_user_plan_async
+
+@dataclass(frozen=True)
+class _CachedApiKey:
+    key_id: int
+    user_id: int
+    is_active: bool
+
+# API key -> dono da chave (ativo ou não)
+_api_key_cache = MemoryCache(max_entries=AUTH_CACHE_MAX_ENTRIES, ttl=AUTH_CACHE_TTL)
+
+# api_key.id -> último uso, gravado em lote por flush_api_key_last_used
+_pending_last_used: Dict[int, datetime] = {}
+_last_used_lock = threading.Lock()
+
+def get_cached_api_key_user(api_key: str) -> Optional[AuthenticatedUser]:
+    """Resolve a API key só pela memória; None se não estiver no cache"""
+    entry = _api_key_cache.get(api_key)
+    if entry is None:
+        return None
+    _touch_api_key(entry.key_id)
+    return AuthenticatedUser(id=entry.user_id, is_active=entry.is_active)
+
+def get_user_by_api_key(api_key: str, db: Session) -> Optional[AuthenticatedUser]:
+    """Obtém usuário a partir de uma API key (cache em memória, banco no miss)"""
+    cached = get_cached_api_key_user(api_key)
+    if cached:
+        return cached
+    
+    row = db.execute(
+        select(ApiKey.id, ApiKey.user_id, User.is_active)
+        .join(User, User.id == ApiKey.user_id)
         .where(ApiKey.key == api_key)
         .where(ApiKey.is_active == True)
-    )
+    ).first()
     
-    if not key_obj:
+    if not row:
         return None
     
-    # Atualiza last_used
-    key_obj.last_used = datetime.utcnow()
+    _api_key_cache.set(api_key, _CachedApiKey(key_id=row.id, user_id=row.user_id, is_active=row.is_active))
+    _touch_api_key(row.id)
+    return AuthenticatedUser(id=row.user_id, is_active=row.is_active)
+
+def invalidate_api_key(api_key: str):
+    """Remove a chave do cache (ex.: após revogação)"""
+    _api_key_cache.delete(api_key)
+
+def revoke_api_key(db: Session, user_id: int, key_id: int) -> bool:
+    """Desativa uma API key do usuário e a invalida no cache"""
+    key_obj = db.scalar(select(ApiKey).where(ApiKey.id == key_id).where(ApiKey.user_id == user_id))
+    if not key_obj:
+        return False
+    key_obj.is_active = False
     db.commit()
+    invalidate_api_key(key_obj.key)
+    return True
+
+def _touch_api_key(key_id: int):
+    # Só registra em memória; o UPDATE acontece em lote
+    with _last_used_lock:
+        _pending_last_used[key_id] = datetime.utcnow()
+
+def flush_api_key_last_used() -> int:
+    """Grava em um único executemany os last_used acumulados; retorna quantas chaves"""
+    global _pending_last_used
+    with _last_used_lock:
+        pending, _pending_last_used = _pending_last_used, {}
+    if not pending:
+        return 0
     
-    return key_obj.user
+    table = ApiKey.__table__
+    with SessionLocal() as db:
+        db.execute(
+            update(table).where(table.c.id == bindparam("key_id")).values(last_used=bindparam("ts")),
+            [{"key_id": key_id, "ts": ts} for key_id, ts in pending.items()]
+        )
+        db.commit()
+    return len(pending)
 
 async def get_current_user_api_key(
     api_key: str = Depends(lambda: None),  # Será sobrescrito
     db: Session = Depends(get_db)
-) -> User:
+) -> AuthenticatedUser:
     """Obtém usuário atual via API key (para compatibilidade)"""
     # Esta função será usada em endpoints que aceitam API key no header
     if not api_key:
@@ -144,3 +233,87 @@ async def get_current_user_api_key(
         )
     
     return user
+
+# ==================== JWT CACHE ====================
+
+@dataclass(frozen=True)
+class _CachedToken:
+    token: str
+    user: AuthenticatedUser
+    expires_at: float
+
+# Assinatura do token -> usuário já verificado; a entrada expira no intervalo de revogação
+_token_cache = MemoryCache(max_entries=JWT_CACHE_MAX_ENTRIES, ttl=JWT_REVOCATION_CHECK_SECONDS)
+
+# Usuários desativados, recarregados a cada JWT_REVOCATION_CHECK_SECONDS
+_inactive_users: Set[int] = set()
+
+def _token_user_id(payload: dict) -> Optional[int]:
+    # Tokens antigos trazem o sub como inteiro; os novos, como string
+    try:
+        return int(payload.get("sub"))
+    except (TypeError, ValueError):
+        return None
+
+def get_cached_token_user(token: str) -> Optional[AuthenticatedUser]:
+    """
+    Resolve o Bearer token sem tocar no banco: usa o cache de tokens verificados
+    ou, se o token trouxer a claim assinada `active`, só valida a assinatura.
+    Retorna None quando é preciso consultar o banco (token sem claims).
+    """
+    signature = token.rpartition(".")[2]
+    entry = _token_cache.get(signature)
+    if entry is not None and entry.token == token and entry.expires_at > time.time():
+        if entry.user.id in _inactive_users:
+            return AuthenticatedUser(id=entry.user.id, is_active=False, plan=entry.user.plan)
+        return entry.user
+    
+    payload = decode_token(token)
+    user_id = _token_user_id(payload)
+    if user_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token inválido",
+        )
+    if "active" not in payload:
+        return None
+    
+    # A claim de plano é só informativa (pode estar defasada após upgrade); plano e quota sempre vêm do banco
+    user = AuthenticatedUser(
+        id=user_id,
+        is_active=bool(payload["active"]) and user_id not in _inactive_users,
+        plan=payload.get("plan")
+    )
+    _token_cache.set(signature, _CachedToken(token=token, user=user, expires_at=payload.get("exp", 0)))
+    return user
+
+def get_user_by_token(token: str, db: Session) -> Optional[AuthenticatedUser]:
+    """Obtém usuário a partir do Bearer token (cache em memória, banco só para tokens sem claims)"""
+    cached = get_cached_token_user(token)
+    if cached:
+        return cached
+    
+    payload = decode_token(token)
+    user_id = _token_user_id(payload)
+    is_active = db.scalar(select(User.is_active).where(User.id == user_id))
+    if is_active is None:
+        return None
+    
+    user = AuthenticatedUser(id=user_id, is_active=is_active)
+    _token_cache.set(token.rpartition(".")[2], _CachedToken(token=token, user=user, expires_at=payload.get("exp", 0)))
+    return user
+
+def refresh_inactive_users() -> int:
+    """
+    Recarrega do banco a lista de usuários desativados (checagem periódica de
+    revogação) e descarta as API keys e os tokens em cache de quem mudou de status
+    """
+    global _inactive_users
+    with SessionLocal() as db:
+        inactive = set(db.scalars(select(User.id).where(User.is_active == False)))
+    changed = inactive ^ _inactive_users
+    _inactive_users = inactive
+    if changed:
+        _api_key_cache.delete_where(lambda entry: entry.user_id in changed)
+        _token_cache.delete_where(lambda entry: entry.user.id in changed)
+    return len(inactive)
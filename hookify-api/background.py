@@ -0,0 +1,139 @@
+"""
+Escrita em lote em segundo plano (write-behind)
+Fila limitada drenada por uma thread que grava a cada N ms ou M itens
+"""
+
+from typing import Callable, List, Any
+import asyncio
+import queue
+import threading
+import time
+
+_STOP = object()
+
+class BatchWriter:
+    """
+    Fila em memória com backpressure: quando cheia, o produtor espera até
+    `enqueue_timeout` segundos e, se ainda não houver espaço, o item é
+    descartado e contabilizado. Uma thread junta os itens e chama
+    `flush_fn(lote)` a cada `flush_interval` segundos ou `batch_size` itens.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        flush_fn: Callable[[List[Any]], None],
+        batch_size: int = 500,
+        flush_interval: float = 0.2,
+        max_queue: int = 10000,
+        enqueue_timeout: float = 0.05
+    ):
+        self.name = name
+        self.flush_fn = flush_fn
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._counters = {"submitted": 0, "written": 0, "dropped": 0, "batches": 0, "failed": 0}
+
+    # ---------- ciclo de vida ----------
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Grava o que restou na fila e encerra a thread (usado no shutdown)"""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    # ---------- produtores ----------
+
+    def submit(self, item: Any) -> bool:
+        """Enfileira esperando no máximo enqueue_timeout; retorna False se descartou"""
+        self.start()
+        try:
+            self._queue.put(item, timeout=self.enqueue_timeout)
+        except queue.Full:
+            self._counters["dropped"] += 1
+            return False
+        self._counters["submitted"] += 1
+        return True
+
+    async def submit_async(self, item: Any) -> bool:
+        """Como submit, mas a espera por espaço na fila não bloqueia o event loop"""
+        self.start()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            return await asyncio.to_thread(self.submit, item)
+        self._counters["submitted"] += 1
+        return True
+
+    # ---------- consumidor ----------
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+
+        # Shutdown: drena o que ainda estiver na fila
+        leftover = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                leftover.append(item)
+        for i in range(0, len(leftover), self.batch_size):
+            self._flush(leftover[i:i + self.batch_size])
+
+    def _flush(self, batch: List[Any]):
+        try:
+            self.flush_fn(batch)
+            self._counters["written"] += len(batch)
+            self._counters["batches"] += 1
+        except Exception as e:
+            self._counters["failed"] += len(batch)
+            print(f"Erro ao gravar lote de {self.name}: {e}")
+
+    # ---------- métricas ----------
+
+    def stats(self) -> dict:
+        offered = self._counters["submitted"] + self._counters["dropped"]
+        return {
+            **self._counters,
+            "queue_depth": self._queue.qsize(),
+            "drop_rate": round(self._counters["dropped"] / offered, 4) if offered else 0.0
+        }
@@ -0,0 +1,137 @@
+"""
+Geração em lote: muitos tópicos em um único request
+Os itens rodam com concorrência limitada contra o modelo, vários tópicos por
+chamada quando o tipo permite; a quota é reservada uma vez para o lote inteiro
+e o histórico é gravado em uma única transação
+"""
+
+from typing import AsyncIterator, List
+from ai_generation import (
+    generate_hooks, generate_captions, generate_hashtags, generate_complete, analyze_emotion, track_fallbacks,
+    generate_pack, pack_groups
+)
+from db import AsyncSessionLocal
+from history import record_generations_async
+from models import GenerationType
+from quota import QuotaReservation, refund_reservation_async
+import asyncio
+import os
+
+# Configurações (podem ser alteradas via env)
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))  # chamadas simultâneas ao modelo por lote
+
+# Acertos de quota/histórico em andamento (aguardados no shutdown)
+_settling = set()
+
+# ==================== GERAÇÃO ====================
+
+# Tipos gerados em pacotes de vários tópicos por chamada -> chave no output_data
+_PACKED_TYPES = {GenerationType.HOOK: "hooks", GenerationType.CAPTION: "captions", GenerationType.HASHTAG: "hashtags"}
+
+async def generate_item(generation_type: GenerationType, spec: dict, use_cache: bool = True) -> dict:
+    """
+    Gera um item a partir do pedido (campos dos *GenerateRequest; os ausentes
+    usam o padrão do endpoint). Retorna o mesmo output_data do endpoint individual.
+    """
+    if generation_type == GenerationType.HOOK:
+        hooks = await generate_hooks(
+            spec["niche"], spec["topic"], spec.get("tone", "direto"), spec.get("platform", "tiktok"),
+            variants=spec.get("variants", 3), use_cache=use_cache
+        )
+        return {"hooks": hooks}
+    if generation_type == GenerationType.CAPTION:
+        captions = await generate_captions(
+            spec["niche"], spec["topic"], spec.get("tone", "direto"), spec.get("product_name"), spec.get("call_to_action"),
+            max_length=spec.get("max_length", 150), variants=spec.get("variants", 3), use_cache=use_cache
+        )
+        return {"captions": captions}
+    if generation_type == GenerationType.HASHTAG:
+        hashtags = await generate_hashtags(
+            spec["niche"], spec["topic"], spec.get("platform", "tiktok"),
+            count=spec.get("count", 10), include_trending=spec.get("include_trending", True), use_cache=use_cache
+        )
+        return {"hashtags": hashtags}
+    if generation_type == GenerationType.EMOTION:
+        return await analyze_emotion(spec["text"], spec.get("context"), use_cache=use_cache)
+    hooks, captions, hashtags, emotion = await generate_complete(
+        spec["niche"], spec["topic"], spec.get("tone", "direto"), spec.get("platform", "tiktok"),
+        spec.get("product_name"), spec.get("call_to_action"),
+        analyze_emotion_flag=spec.get("analyze_emotion", False), use_cache=use_cache
+    )
+    return {"hooks": hooks, "captions": captions, "hashtags": hashtags, "emotion": emotion}
+
+async def _settle(reservation: QuotaReservation, generation_type: GenerationType, history: list, charged: int):
+    """Grava o histórico dos itens prontos e devolve a quota dos que não foram cobrados"""
+    try:
+        await record_generations_async(reservation.user_id, generation_type, history)
+    finally:
+        if reservation.amount > charged:
+            async with AsyncSessionLocal() as db:
+                await refund_reservation_async(db, reservation, reservation.amount - charged)
+
+async def run_batch(
+    reservation: QuotaReservation,
+    generation_type: GenerationType,
+    specs: List[dict],
+    use_cache: bool = True
+) -> AsyncIterator[dict]:
+    """
+    Gera os itens com no máximo BATCH_CONCURRENCY chamadas simultâneas e emite
+    {"index", "status", "output"} de cada um assim que fica pronto. Hooks,
+    legendas e hashtags vão em pacotes de tópicos do mesmo grupo; os tópicos que
+    faltarem na resposta empacotada são gerados individualmente.
+    Itens em fallback ou com erro não são cobrados. Ao terminar, ou se o
+    consumidor desistir, o histórico dos itens prontos vai em uma transação
+    e a quota dos demais volta para o usuário.
+    """
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    
+    async def run_one(index: int, spec: dict) -> dict:
+        async with semaphore:
+            with track_fallbacks() as fallbacks:
+                try:
+                    output = await generate_item(generation_type, spec, use_cache)
+                except Exception as e:
+                    print(f"Erro no item {index} do lote: {e}")
+                    return {"index": index, "status": "error", "output": None}
+            return {"index": index, "status": "fallback" if fallbacks else "ok", "output": output}
+    
+    kind = _PACKED_TYPES.get(generation_type)
+    
+    async def run_unit(indexes: List[int]) -> List[dict]:
+        results = {}
+        if len(indexes) > 1:
+            async with semaphore:
+                packed = await generate_pack(kind, [specs[i] for i in indexes], use_cache)
+            for index, value in zip(indexes, packed):
+                if value is not None:
+                    results[index] = {"index": index, "status": "ok", "output": {kind: value}}
+        missing = [index for index in indexes if index not in results]
+        for result in await asyncio.gather(*(run_one(index, specs[index]) for index in missing)):
+            results[result["index"]] = result
+        return [results[index] for index in indexes]
+    
+    units = pack_groups(kind, specs) if kind else [[index] for index in range(len(specs))]
+    tasks = [asyncio.create_task(run_unit(indexes)) for indexes in units]
+    history = []
+    charged = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            for result in await next_done:
+                if result["status"] != "error":
+                    history.append((specs[result["index"]], result["output"]))
+                    charged += result["status"] == "ok"
+                yield result
+    finally:
+        for task in tasks:
+            task.cancel()
+        # shield: o acerto termina mesmo se o request for cancelado
+        settle = asyncio.ensure_future(_settle(reservation, generation_type, history, charged))
+        _settling.add(settle)
+        settle.add_done_callback(_settling.discard)
+        await asyncio.shield(settle)
+
+async def wait_batch_settlements():
+    """Shutdown: espera o acerto de quota e histórico dos lotes interrompidos"""
+    await asyncio.gather(*list(_settling), return_exceptions=True)
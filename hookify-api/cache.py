@@ -0,0 +1,178 @@
+"""
+Cache de respostas do modelo endereçado por conteúdo
+Tier em memória (LRU com TTL) e tier compartilhado opcional em SQLite
+"""
+
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Configurações (podem ser alteradas via env)
+AI_CACHE_ENABLED = os.getenv("AI_CACHE_ENABLED", "true").lower() == "true"
+AI_CACHE_TTL = int(os.getenv("AI_CACHE_TTL", "3600"))  # segundos
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "10000"))
+AI_CACHE_SQLITE_PATH = os.getenv("AI_CACHE_SQLITE_PATH", "")  # vazio = sem tier compartilhado
+AI_CACHE_SQLITE_PURGE_EVERY = int(os.getenv("AI_CACHE_SQLITE_PURGE_EVERY", "1000"))  # escritas entre limpezas
+
+def make_key(**parts) -> str:
+    """Gera a chave canônica (SHA-256) a partir dos parâmetros da chamada"""
+    canonical = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+# ==================== TIERS ====================
+
+class CacheBackend(ABC):
+    """Interface mínima de um tier de cache"""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: str) -> None:
+        ...
+
+class MemoryCache(CacheBackend):
+    """LRU em memória com expiração por TTL"""
+
+    def __init__(self, max_entries: int = AI_CACHE_MAX_ENTRIES, ttl: int = AI_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_where(self, predicate) -> int:
+        """Remove as entradas cujo valor satisfaz o predicado; retorna quantas"""
+        with self._lock:
+            keys = [k for k, (value, _) in self._data.items() if predicate(value)]
+            for k in keys:
+                del self._data[k]
+        return len(keys)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+class SQLiteCache(CacheBackend):
+    """Tier compartilhado entre workers, persistido em um arquivo SQLite local"""
+
+    def __init__(self, path: str, ttl: int = AI_CACHE_TTL, purge_every: int = AI_CACHE_SQLITE_PURGE_EVERY):
+        self.ttl = ttl
+        self.purge_every = max(purge_every, 1)
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ai_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_ai_cache_expires ON ai_cache (expires_at)")
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM ai_cache WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ai_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, now + self.ttl)
+            )
+            # Expiradas já não são lidas (get filtra); a limpeza só controla o tamanho do arquivo
+            self._writes += 1
+            if self._writes % self.purge_every == 0:
+                self._purge_expired(now)
+
+    def purge(self) -> int:
+        """Apaga as entradas expiradas; retorna quantas"""
+        with self._lock:
+            return self._purge_expired(time.time())
+
+    def _purge_expired(self, now: float) -> int:
+        # Usa o índice de expires_at: não varre a tabela inteira
+        return self._conn.execute("DELETE FROM ai_cache WHERE expires_at <= ?", (now,)).rowcount
+
+# ==================== CACHE EM CAMADAS ====================
+
+class TieredCache:
+    """Consulta a memória primeiro e depois o tier compartilhado, com métricas de hit/miss"""
+
+    def __init__(self, memory: CacheBackend, shared: Optional[CacheBackend] = None):
+        self.memory = memory
+        self.shared = shared
+        self._counters = {"memory_hits": 0, "shared_hits": 0, "misses": 0, "stores": 0, "bypasses": 0}
+
+    async def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is not None:
+            self._counters["memory_hits"] += 1
+            return value
+
+        if self.shared is not None:
+            value = await asyncio.to_thread(self.shared.get, key)
+            if value is not None:
+                self._counters["shared_hits"] += 1
+                self.memory.set(key, value)
+                return value
+
+        self._counters["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: str) -> None:
+        self.memory.set(key, value)
+        if self.shared is not None:
+            await asyncio.to_thread(self.shared.set, key, value)
+        self._counters["stores"] += 1
+
+    def record_bypass(self) -> None:
+        self._counters["bypasses"] += 1
+
+    def stats(self) -> dict:
+        hits = self._counters["memory_hits"] + self._counters["shared_hits"]
+        lookups = hits + self._counters["misses"]
+        return {
+            **self._counters,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self.memory) if hasattr(self.memory, "__len__") else None,
+            "shared_enabled": self.shared is not None
+        }
+
+def build_response_cache() -> Optional[TieredCache]:
+    """Monta o cache padrão a partir das variáveis de ambiente"""
+    if not AI_CACHE_ENABLED:
+        return None
+    shared = SQLiteCache(AI_CACHE_SQLITE_PATH) if AI_CACHE_SQLITE_PATH else None
+    return TieredCache(MemoryCache(), shared)
@@ -0,0 +1,147 @@
+"""
+Log de eventos de clique e agregados por minuto/hora/dia
+Os eventos saem do caminho do redirecionamento e são gravados em lote,
+já somando os cliques nas tabelas de rollup na mesma transação
+"""
+
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import List, Optional
+from urllib.parse import urlparse
+from sqlalchemy import select, insert, delete
+from sqlalchemy.orm import Session
+from background import BatchWriter
+from db import SessionLocal, upsert_insert
+from links import CachedLink
+from models import ClickEvent, ClickRollupMinute, ClickRollupHour, ClickRollupDay
+import os
+
+# Configurações (podem ser alteradas via env)
+CLICK_EVENTS_ENABLED = os.getenv("CLICK_EVENTS_ENABLED", "true").lower() == "true"
+CLICK_EVENTS_BATCH_SIZE = int(os.getenv("CLICK_EVENTS_BATCH_SIZE", "1000"))
+CLICK_EVENTS_FLUSH_INTERVAL_MS = int(os.getenv("CLICK_EVENTS_FLUSH_INTERVAL_MS", "500"))
+CLICK_EVENTS_QUEUE_SIZE = int(os.getenv("CLICK_EVENTS_QUEUE_SIZE", "50000"))
+CLICK_EVENTS_ENQUEUE_TIMEOUT_MS = int(os.getenv("CLICK_EVENTS_ENQUEUE_TIMEOUT_MS", "10"))
+CLICK_EVENTS_RETENTION_DAYS = int(os.getenv("CLICK_EVENTS_RETENTION_DAYS", "30"))
+CLICK_MINUTE_ROLLUP_RETENTION_DAYS = int(os.getenv("CLICK_MINUTE_ROLLUP_RETENTION_DAYS", "7"))
+CLICK_PRUNE_INTERVAL_SECONDS = int(os.getenv("CLICK_PRUNE_INTERVAL_SECONDS", "3600"))
+
+# granularidade -> (tabela de rollup, truncamento do horário, janela padrão da consulta)
+ROLLUPS = {
+    "minute": (ClickRollupMinute, lambda dt: dt.replace(second=0, microsecond=0), timedelta(hours=2)),
+    "hour": (ClickRollupHour, lambda dt: dt.replace(minute=0, second=0, microsecond=0), timedelta(days=7)),
+    "day": (ClickRollupDay, lambda dt: dt.replace(hour=0, minute=0, second=0, microsecond=0), timedelta(days=90)),
+}
+
+# ==================== CLASSIFICAÇÃO ====================
+
+_BOT_MARKERS = ("bot", "crawler", "spider", "preview", "facebookexternalhit", "slurp", "curl", "wget")
+
+def classify_user_agent(user_agent: Optional[str]) -> str:
+    """Classe grosseira do user-agent: bot, tablet, mobile, desktop ou other"""
+    if not user_agent:
+        return "other"
+    ua = user_agent.lower()
+    if any(marker in ua for marker in _BOT_MARKERS):
+        return "bot"
+    if "ipad" in ua or "tablet" in ua:
+        return "tablet"
+    if "mobi" in ua or "android" in ua or "iphone" in ua:
+        return "mobile"
+    if "windows" in ua or "macintosh" in ua or "linux" in ua or "cros" in ua:
+        return "desktop"
+    return "other"
+
+def _referrer_host(referrer: Optional[str]) -> Optional[str]:
+    if not referrer:
+        return None
+    return (urlparse(referrer).netloc or referrer)[:255]
+
+# ==================== INGESTÃO ====================
+
+def _upsert_rollups(db: Session, model, counts: Counter):
+    """Soma os cliques nos buckets existentes (INSERT ... ON CONFLICT DO UPDATE)"""
+    table = model.__table__
+    stmt = upsert_insert(db.bind, table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.code, table.c.bucket_start],
+        set_={"clicks": table.c.clicks + stmt.excluded.clicks}
+    )
+    db.execute(stmt, [
+        {"code": code, "bucket_start": bucket_start, "clicks": n}
+        for (code, bucket_start), n in counts.items()
+    ])
+
+def _write_click_events(batch: List[dict]):
+    """Grava os eventos e atualiza os três rollups em uma única transação"""
+    with SessionLocal() as db:
+        db.execute(insert(ClickEvent), batch)
+        for model, truncate, _ in ROLLUPS.values():
+            counts = Counter((event["code"], truncate(event["clicked_at"])) for event in batch)
+            _upsert_rollups(db, model, counts)
+        db.commit()
+
+click_writer = BatchWriter(
+    "click-writer",
+    _write_click_events,
+    batch_size=CLICK_EVENTS_BATCH_SIZE,
+    flush_interval=CLICK_EVENTS_FLUSH_INTERVAL_MS / 1000,
+    max_queue=CLICK_EVENTS_QUEUE_SIZE,
+    enqueue_timeout=CLICK_EVENTS_ENQUEUE_TIMEOUT_MS / 1000
+)
+
+async def record_click_event(
+    code: str,
+    link: CachedLink,
+    referrer: Optional[str] = None,
+    user_agent: Optional[str] = None
+):
+    """Enfileira o evento de clique para gravação em lote"""
+    if not CLICK_EVENTS_ENABLED:
+        return
+    await click_writer.submit_async({
+        "code": code,
+        "clicked_at": datetime.utcnow(),
+        "referrer": _referrer_host(referrer),
+        "ua_class": classify_user_agent(user_agent),
+        "utm_source": link.utm_source,
+        "utm_medium": link.utm_medium,
+        "utm_campaign": link.utm_campaign
+    })
+
+# ==================== CONSULTAS ====================
+
+def get_click_timeseries(
+    db: Session,
+    code: str,
+    granularity: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> tuple:
+    """Lê os buckets pré-computados do período; retorna (start, end, [(bucket_start, clicks)])"""
+    model, truncate, window = ROLLUPS[granularity]
+    end = end or datetime.utcnow()
+    start = truncate(start or end - window)
+    rows = db.execute(
+        select(model.bucket_start, model.clicks)
+        .where(model.code == code)
+        .where(model.bucket_start >= start)
+        .where(model.bucket_start <= end)
+        .order_by(model.bucket_start)
+    ).all()
+    return start, end, rows
+
+def prune_click_data() -> int:
+    """Remove eventos brutos e buckets por minuto fora da retenção; retorna quantas linhas"""
+    now = datetime.utcnow()
+    with SessionLocal() as db:
+        removed = db.execute(
+            delete(ClickEvent).where(ClickEvent.clicked_at < now - timedelta(days=CLICK_EVENTS_RETENTION_DAYS))
+        ).rowcount
+        removed += db.execute(
+            delete(ClickRollupMinute).where(
+                ClickRollupMinute.bucket_start < now - timedelta(days=CLICK_MINUTE_ROLLUP_RETENTION_DAYS)
+            )
+        ).rowcount
+        db.commit()
+    return removed
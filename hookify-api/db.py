@@ -1,15 +1,222 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+"""
+Engines e sessões do banco, configurados por variáveis de ambiente
+SQLite (padrão) com WAL e pragmas aplicados em cada conexão, ou PostgreSQL via psycopg 3
+Leituras podem ir para réplicas (ou conexões somente leitura no SQLite) via get_read_db
+"""
 
-engine = create_engine("sqlite:///./growthkit.db", connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+from typing import Dict, Optional
+from fastapi import Request
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker, DeclarativeBase, Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
+import functools
+import itertools
+import os
+import threading
+import time
+
+# Configurações (podem ser alteradas via env)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./growthkit.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))  # segundos esperando uma conexão livre
+# Só para servidores (Postgres); no SQLite não há conexão remota para cair
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # segundos
+# SQLite
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # bytes
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))  # por conexão
+# Réplicas de leitura (separadas por vírgula); vazio no SQLite = conexões somente leitura no mesmo arquivo
+DATABASE_READ_URLS = [u.strip() for u in os.getenv("DATABASE_READ_URLS", "").split(",") if u.strip()]
+SQLITE_READ_ONLY_REPLICA = os.getenv("SQLITE_READ_ONLY_REPLICA", "true").lower() == "true"
+# Depois de um commit, as leituras da mesma credencial vão ao primário por esse tempo
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+# Postgres: execuções de um mesmo SQL antes de virar prepared statement no servidor (0 = sempre)
+PG_PREPARE_THRESHOLD = int(os.getenv("PG_PREPARE_THRESHOLD", "5"))
+
+def _normalize_url(url: str) -> str:
+    # Postgres sempre via psycopg 3, que serve tanto o engine síncrono quanto o assíncrono
+    scheme, sep, rest = url.partition("://")
+    if scheme in ("postgres", "postgresql") or scheme.startswith("postgresql+"):
+        return f"postgresql+psycopg://{rest}"
+    return url
+
+def _async_url(url: str) -> str:
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    return url
+
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+def _is_sqlite_memory(url: str) -> bool:
+    # sqlite://, sqlite:///:memory: ou URI com mode=memory
+    return _is_sqlite(url) and (url.split("://", 1)[1] in ("", "/") or ":memory:" in url or "mode=memory" in url)
+
+def _sqlite_read_only_url(url: str) -> str:
+    # sqlite:///./x.db -> sqlite:///file:./x.db?mode=ro&uri=true
+    path = url.split(":///", 1)[1]
+    return f"sqlite:///file:{path}?mode=ro&uri=true"
+
+def _engine_options(url: str, is_async: bool = False) -> dict:
+    if _is_sqlite_memory(url):
+        # Banco em memória só existe na própria conexão: uma única, compartilhada entre threads
+        # (o engine síncrono e o assíncrono enxergam bancos distintos)
+        return {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}}
+    options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+    }
+    if _is_sqlite(url):
+        if is_async:
+            # O aiosqlite usa NullPool por padrão: uma conexão (e os pragmas) por sessão
+            options["poolclass"] = AsyncAdaptedQueuePool
+        else:
+            options["connect_args"] = {"check_same_thread": False}
+    else:
+        options["pool_pre_ping"] = DB_POOL_PRE_PING
+        options["pool_recycle"] = DB_POOL_RECYCLE
+        options["connect_args"] = {"prepare_threshold": PG_PREPARE_THRESHOLD}
+    return options
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record, read_only: bool = False):
+    """Aplicado em cada conexão nova: WAL deixa leitores e o escritor trabalharem em paralelo"""
+    cursor = dbapi_connection.cursor()
+    if read_only:
+        cursor.execute("PRAGMA query_only=1")
+    else:
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.close()
+
+def build_engines(url: str = DATABASE_URL):
+    """Cria o par (engine síncrono, engine assíncrono) para a URL"""
+    url = _normalize_url(url)
+    sync_engine = create_engine(url, **_engine_options(url))
+    async_engine = create_async_engine(_async_url(url), **_engine_options(url, is_async=True))
+    if _is_sqlite(url):
+        event.listen(sync_engine, "connect", _apply_sqlite_pragmas)
+        event.listen(async_engine.sync_engine, "connect", _apply_sqlite_pragmas)
+    return sync_engine, async_engine
+
+def build_read_engines(url: str = DATABASE_URL, read_urls: list = DATABASE_READ_URLS) -> list:
+    """Engines de leitura: as réplicas configuradas ou, no SQLite, conexões somente leitura"""
+    engines = []
+    for read_url in read_urls:
+        read_url = _normalize_url(read_url)
+        read_engine = create_engine(read_url, **_engine_options(read_url))
+        if _is_sqlite(read_url):
+            event.listen(read_engine, "connect", functools.partial(_apply_sqlite_pragmas, read_only=True))
+        engines.append(read_engine)
+    if not engines and _is_sqlite(url) and SQLITE_READ_ONLY_REPLICA and not _is_sqlite_memory(url):
+        read_engine = create_engine(_sqlite_read_only_url(url), **_engine_options(url))
+        event.listen(read_engine, "connect", functools.partial(_apply_sqlite_pragmas, read_only=True))
+        engines.append(read_engine)
+    return engines
+
+class PrimarySession(Session):
+    """Sessões no primário; só elas alimentam o read-your-writes"""
+
+# Engine síncrono e, sobre o mesmo banco, o assíncrono usado pelos endpoints /v2
+engine, async_engine = build_engines()
+SessionLocal = sessionmaker(bind=engine, class_=PrimarySession, autoflush=False, autocommit=False)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, sync_session_class=PrimarySession, autoflush=False, expire_on_commit=False
+)
+
+read_engines = build_read_engines()
+ReadSessionLocals = [sessionmaker(bind=e, autoflush=False, autocommit=False) for e in read_engines]
+_next_read_session = itertools.cycle(ReadSessionLocals or [SessionLocal])
 
 class Base(DeclarativeBase):
     pass
 
-def get_db():
+def upsert_insert(bind, table):
+    """INSERT com suporte a ON CONFLICT no dialeto do banco (SQLite ou Postgres)"""
+    dialect_insert = postgresql.insert if bind.dialect.name == "postgresql" else sqlite.insert
+    return dialect_insert(table)
+
+# ==================== READ-YOUR-WRITES ====================
+
+# hash da credencial -> instante do último commit feito por ela
+_recent_writes: Dict[int, float] = {}
+_recent_writes_lock = threading.Lock()
+
+def _credential_key(request: Optional[Request]) -> Optional[int]:
+    if request is None:
+        return None
+    credential = request.headers.get("x-api-key") or request.headers.get("authorization")
+    return hash(credential) if credential else None
+
+def note_write(key: Optional[int]):
+    if key is None:
+        return
+    now = time.monotonic()
+    with _recent_writes_lock:
+        _recent_writes[key] = now
+        if len(_recent_writes) > 10000:
+            for k in [k for k, ts in _recent_writes.items() if now - ts > READ_YOUR_WRITES_SECONDS]:
+                del _recent_writes[k]
+
+def wrote_recently(key: Optional[int]) -> bool:
+    ts = _recent_writes.get(key) if key is not None else None
+    return ts is not None and time.monotonic() - ts < READ_YOUR_WRITES_SECONDS
+
+# Commits que só encerram leituras (ex.: get_current_user_async) não contam como escrita
+@event.listens_for(PrimarySession, "after_flush")
+def _track_flush(session, flush_context):
+    session.info["wrote"] = True
+
+@event.listens_for(PrimarySession, "do_orm_execute")
+def _track_dml(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["wrote"] = True
+
+@event.listens_for(PrimarySession, "after_commit")
+def _track_commit(session):
+    if session.info.pop("wrote", False):
+        note_write(session.info.get("credential"))
+
+@event.listens_for(PrimarySession, "after_rollback")
+def _reset_write(session):
+    session.info.pop("wrote", None)
+
+# ==================== DEPENDÊNCIAS ====================
+
+def get_db(request: Request = None):
     db = SessionLocal()
+    db.info["credential"] = _credential_key(request)
     try:
         yield db
     finally:
         db.close()
+
+def get_read_db(request: Request = None):
+    """
+    Sessão para handlers somente leitura: usa uma réplica (round-robin), exceto
+    quando a mesma credencial fez commit há pouco ou o cliente pede
+    X-Read-Consistency: primary, casos em que lê do primário.
+    """
+    key = _credential_key(request)
+    use_primary = not ReadSessionLocals or wrote_recently(key) or (
+        request is not None and request.headers.get("x-read-consistency") == "primary"
+    )
+    db = SessionLocal() if use_primary else next(_next_read_session)()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_db(request: Request = None):
+    async with AsyncSessionLocal() as db:
+        db.sync_session.info["credential"] = _credential_key(request)
+        yield db
@@ -0,0 +1,79 @@
+"""
+Hash de senhas (bcrypt) fora do processo da API
+Pool de processos com fila limitada; quando saturado responde 503 com Retry-After
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+import multiprocessing
+import os
+import threading
+
+# Configurações (podem ser alteradas via env)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))  # fator de trabalho
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS") or os.cpu_count() or 1)  # 0 = no próprio processo
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING") or max(1, PASSWORD_HASH_WORKERS) * 4)
+PASSWORD_HASH_QUEUE_TIMEOUT_MS = int(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT_MS", "100"))
+PASSWORD_HASH_RETRY_AFTER = int(os.getenv("PASSWORD_HASH_RETRY_AFTER", "1"))  # segundos
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+class HashingBusy(HTTPException):
+    """Exceção para pool de hash saturado"""
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Servidor ocupado. Tente novamente em instantes.",
+            headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER)}
+        )
+
+# Limita quantos hashes podem estar em execução ou na fila ao mesmo tempo
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_MAX_PENDING)
+_executor = None
+_executor_lock = threading.Lock()
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: não herda threads/conexões do processo da API
+            _executor = ProcessPoolExecutor(
+                max_workers=PASSWORD_HASH_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+def _run(fn, *args):
+    """Executa no pool respeitando o limite de pendências"""
+    if PASSWORD_HASH_WORKERS <= 0:
+        return fn(*args)
+
+    if not _slots.acquire(timeout=PASSWORD_HASH_QUEUE_TIMEOUT_MS / 1000):
+        raise HashingBusy()
+    try:
+        return _get_executor().submit(fn, *args).result()
+    finally:
+        _slots.release()
+
+def hash_password(password: str) -> str:
+    """Gera o hash bcrypt em um processo do pool"""
+    return _run(_hash, password)
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verifica a senha em um processo do pool"""
+    return _run(_verify, plain_password, hashed_password)
+
+def shutdown_hashing():
+    """Encerra o pool de processos (usado no shutdown da aplicação)"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True, cancel_futures=True)
+            _executor = None
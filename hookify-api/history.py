@@ -0,0 +1,98 @@
+"""
+Gravação do histórico de gerações fora do caminho da resposta
+"""
+
+from datetime import datetime
+from sqlalchemy import insert
+from db import SessionLocal
+from models import Generation, GenerationType
+from background import BatchWriter
+from usage import add_usage_counts
+import asyncio
+import json
+import os
+
+# Configurações (podem ser alteradas via env)
+HISTORY_WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", "true").lower() == "true"
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "500"))
+HISTORY_FLUSH_INTERVAL_MS = int(os.getenv("HISTORY_FLUSH_INTERVAL_MS", "200"))
+HISTORY_QUEUE_SIZE = int(os.getenv("HISTORY_QUEUE_SIZE", "10000"))
+HISTORY_ENQUEUE_TIMEOUT_MS = int(os.getenv("HISTORY_ENQUEUE_TIMEOUT_MS", "50"))
+
+def _generation_row(
+    user_id: int,
+    generation_type: GenerationType,
+    input_data: dict = None,
+    output_data: dict = None,
+    created_at: datetime = None
+) -> dict:
+    return {
+        "user_id": user_id,
+        "type": generation_type,
+        "input_data": json.dumps(input_data, ensure_ascii=False) if input_data else None,
+        "output_data": json.dumps(output_data, ensure_ascii=False) if output_data else None,
+        "tokens_used": 0,  # Pode ser atualizado depois se necessário
+        "created_at": created_at or datetime.utcnow()
+    }
+
+def _write_generations(batch: list):
+    """Insere o lote inteiro com executemany e atualiza os contadores de uso na mesma transação"""
+    rows = [_generation_row(**item) for item in batch]
+    with SessionLocal() as db:
+        db.execute(insert(Generation), rows)
+        add_usage_counts(db, rows)
+        db.commit()
+
+history_writer = BatchWriter(
+    "history-writer",
+    _write_generations,
+    batch_size=HISTORY_BATCH_SIZE,
+    flush_interval=HISTORY_FLUSH_INTERVAL_MS / 1000,
+    max_queue=HISTORY_QUEUE_SIZE,
+    enqueue_timeout=HISTORY_ENQUEUE_TIMEOUT_MS / 1000
+)
+
+def record_generation(
+    user_id: int,
+    generation_type: GenerationType,
+    input_data: dict = None,
+    output_data: dict = None
+):
+    """Registra a geração no histórico (em lote, em segundo plano, quando habilitado)"""
+    item = _history_item(user_id, generation_type, input_data, output_data)
+    if HISTORY_WRITE_BEHIND:
+        history_writer.submit(item)
+    else:
+        _write_generations([item])
+
+async def record_generation_async(
+    user_id: int,
+    generation_type: GenerationType,
+    input_data: dict = None,
+    output_data: dict = None
+):
+    """Versão de record_generation para os endpoints assíncronos"""
+    item = _history_item(user_id, generation_type, input_data, output_data)
+    if HISTORY_WRITE_BEHIND:
+        await history_writer.submit_async(item)
+    else:
+        await asyncio.to_thread(_write_generations, [item])
+
+async def record_generations_async(user_id: int, generation_type: GenerationType, items: list):
+    """
+    Registra várias gerações [(input_data, output_data), ...] em uma única
+    transação, sem passar pela fila (usado pelo /v2/generate/batch)
+    """
+    if not items:
+        return
+    batch = [_history_item(user_id, generation_type, input_data, output_data) for input_data, output_data in items]
+    await asyncio.to_thread(_write_generations, batch)
+
+def _history_item(user_id, generation_type, input_data, output_data) -> dict:
+    return {
+        "user_id": user_id,
+        "generation_type": generation_type,
+        "input_data": input_data,
+        "output_data": output_data,
+        "created_at": datetime.utcnow()
+    }
@@ -0,0 +1,375 @@
+"""
+Fila persistente de jobs de geração (tabela jobs)
+A API só enfileira e responde; workers assíncronos (neste processo ou em outros
+apontando para o mesmo banco) consomem a fila por prioridade de plano, com
+retentativas com backoff, cancelamento e expiração dos resultados
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy import select, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from ai_generation import model_plan, track_fallbacks
+from auth import AuthenticatedUser
+from batch import generate_item, run_batch
+from db import SessionLocal, AsyncSessionLocal
+from models import Job, JobStatus, GenerationType, PlanType
+from quota import QuotaReservation, commit_reservation_async, refund_reservation, refund_reservation_async, get_user_plan_async
+from schemas import TRANSPORT_FIELDS
+import asyncio
+import json
+import os
+import random
+import uuid
+
+# Configurações (podem ser alteradas via env)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))  # 0 = este processo só enfileira
+JOB_POLL_INTERVAL_MS = int(os.getenv("JOB_POLL_INTERVAL_MS", "1000"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "5"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "300"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "60"))  # sem renovação nesse tempo, o job volta para a fila
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "5"))
+JOB_RESULT_TTL_SECONDS = int(os.getenv("JOB_RESULT_TTL_SECONDS", "86400"))
+JOB_MAINTENANCE_INTERVAL_SECONDS = int(os.getenv("JOB_MAINTENANCE_INTERVAL_SECONDS", "60"))
+
+# Menor = sai antes da fila
+JOB_PLAN_PRIORITY = {PlanType.PREMIUM: 0, PlanType.PRO: 1, PlanType.BASIC: 2, PlanType.FREE: 3}
+_PRIORITY_PLAN = {priority: plan for plan, priority in JOB_PLAN_PRIORITY.items()}
+
+FINISHED = (JobStatus.DONE, JobStatus.FAILED, JobStatus.CANCELLED)
+
+class RetryJob(Exception):
+    """O job deve ser tentado de novo mais tarde (ex.: modelo indisponível)"""
+
+@dataclass
+class ClaimedJob:
+    """Job retirado da fila por um worker"""
+    id: str
+    user_id: int
+    kind: str
+    type: GenerationType
+    payload: dict
+    attempts: int
+    max_attempts: int
+    quota_reserved: int
+    quota_remaining: int
+    plan: PlanType = PlanType.FREE
+    progress: int = 0
+    cancel_requested: bool = False
+    reservation: QuotaReservation = field(init=False)
+
+    def __post_init__(self):
+        self.reservation = QuotaReservation(self.user_id, self.quota_reserved, self.quota_remaining)
+
+# ==================== ENFILEIRAMENTO ====================
+
+_wakeup = asyncio.Event()
+
+async def plan_priority(db: AsyncSession, user: AuthenticatedUser) -> int:
+    """Prioridade na fila a partir do plano da assinatura"""
+    return JOB_PLAN_PRIORITY[await get_user_plan_async(db, user)]
+
+def _insert_job(values: dict):
+    with SessionLocal() as db:
+        db.add(Job(**values))
+        db.commit()
+
+async def submit_job(
+    user_id: int,
+    kind: str,
+    generation_type: GenerationType,
+    payload: dict,
+    priority: int,
+    reservation: QuotaReservation,
+    max_attempts: int = JOB_MAX_ATTEMPTS
+) -> str:
+    """Grava o job na fila (com a quota já reservada) e acorda os workers; retorna o id"""
+    now = datetime.utcnow()
+    job_id = uuid.uuid4().hex
+    await asyncio.to_thread(_insert_job, {
+        "id": job_id,
+        "user_id": user_id,
+        "kind": kind,
+        "type": generation_type,
+        "payload": json.dumps(payload, ensure_ascii=False),
+        "status": JobStatus.QUEUED,
+        "priority": priority,
+        "max_attempts": max_attempts,
+        "quota_reserved": reservation.amount,
+        "quota_remaining": reservation.remaining,
+        "run_after": now,
+        "created_at": now
+    })
+    _wakeup.set()
+    return job_id
+
+def get_job(db, job_id: str, user_id: int) -> Optional[Job]:
+    """Job do usuário, ou None se não existir, for de outro usuário ou já tiver expirado"""
+    job = db.get(Job, job_id)
+    if job is None or job.user_id != user_id:
+        return None
+    if job.expires_at is not None and job.expires_at < datetime.utcnow():
+        return None
+    return job
+
+def _finish_values(status: JobStatus, **values) -> dict:
+    now = datetime.utcnow()
+    return {
+        "status": status,
+        "finished_at": now,
+        "expires_at": now + timedelta(seconds=JOB_RESULT_TTL_SECONDS),
+        "lease_until": None,
+        **values
+    }
+
+def _refund_sync(db, user_id: int, amount: int):
+    if amount:
+        refund_reservation(db, QuotaReservation(user_id=user_id, amount=amount, remaining=0))
+
+def cancel_job(job_id: str, user_id: int) -> Optional[JobStatus]:
+    """
+    Cancela o job: na fila, sai na hora e a quota volta; rodando, é marcado e
+    o worker que o executa o interrompe. Retorna o status resultante (None se não existir).
+    """
+    with SessionLocal() as db:
+        row = db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.user_id == user_id, Job.status == JobStatus.QUEUED)
+            .values(**_finish_values(JobStatus.CANCELLED))
+            .returning(Job.quota_reserved)
+        ).first()
+        if row is not None:
+            db.commit()
+            _refund_sync(db, user_id, row.quota_reserved)
+            return JobStatus.CANCELLED
+
+        db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.user_id == user_id, Job.status == JobStatus.RUNNING)
+            .values(status=JobStatus.CANCELLING)
+        )
+        db.commit()
+        status = db.scalar(select(Job.status).where(Job.id == job_id, Job.user_id == user_id))
+
+    running = _running.get(job_id)
+    if running is not None and status == JobStatus.CANCELLING:
+        job, task = running
+        job.cancel_requested = True
+        task.get_loop().call_soon_threadsafe(task.cancel)
+    return status
+
+# ==================== EXECUÇÃO ====================
+
+async def _run_generation(job: ClaimedJob) -> dict:
+    """Uma geração de /v2; cair no fallback de templates conta como falha enquanto houver tentativas"""
+    use_cache = not job.payload.get("no_cache")
+    with track_fallbacks() as fallbacks:
+        output = await generate_item(job.type, job.payload, use_cache)
+    if fallbacks:
+        if job.attempts < job.max_attempts:
+            raise RetryJob(f"modelo indisponível ({', '.join(fallbacks)})")
+        await _refund(job)
+    input_data = {key: value for key, value in job.payload.items() if key not in TRANSPORT_FIELDS}
+    remaining = await commit_reservation_async(job.reservation, job.type, input_data=input_data, output_data=output)
+    return {"output": output, "quota_remaining": remaining}
+
+async def _run_batch(job: ClaimedJob) -> dict:
+    """Um lote de /v2/generate/batch; o próprio run_batch grava o histórico e acerta a quota"""
+    results = []
+    async for result in run_batch(job.reservation, job.type, job.payload["items"], not job.payload.get("no_cache")):
+        results.append(result)
+        job.progress = len(results)
+    return {"results": sorted(results, key=lambda result: result["index"]), "quota_remaining": job.reservation.remaining}
+
+JOB_HANDLERS = {
+    "generate": _run_generation,
+    "batch": _run_batch,
+}
+
+# Tipos cujo handler acerta a quota por conta própria depois de começar
+_SELF_SETTLING = {"batch"}
+
+async def _refund(job: ClaimedJob):
+    async with AsyncSessionLocal() as session:
+        await refund_reservation_async(session, job.reservation)
+
+def _claim_next_job() -> Optional[ClaimedJob]:
+    """Retira o próximo job da fila (menor prioridade, depois o mais antigo) de forma atômica"""
+    now = datetime.utcnow()
+    next_id = (
+        select(Job.id)
+        .where(Job.status == JobStatus.QUEUED, Job.run_after <= now)
+        .order_by(Job.priority, Job.created_at)
+        .limit(1)
+        .scalar_subquery()
+    )
+    with SessionLocal() as db:
+        row = db.execute(
+            update(Job)
+            .where(Job.id == next_id, Job.status == JobStatus.QUEUED)
+            .values(
+                status=JobStatus.RUNNING,
+                attempts=Job.attempts + 1,
+                started_at=now,
+                lease_until=now + timedelta(seconds=JOB_LEASE_SECONDS)
+            )
+            .returning(
+                Job.id, Job.user_id, Job.kind, Job.type, Job.payload, Job.priority,
+                Job.attempts, Job.max_attempts, Job.quota_reserved, Job.quota_remaining
+            )
+        ).first()
+        db.commit()
+    if row is None:
+        return None
+    return ClaimedJob(
+        id=row.id, user_id=row.user_id, kind=row.kind, type=row.type, payload=json.loads(row.payload),
+        attempts=row.attempts, max_attempts=row.max_attempts,
+        quota_reserved=row.quota_reserved, quota_remaining=row.quota_remaining or 0,
+        plan=_PRIORITY_PLAN.get(row.priority, PlanType.FREE)
+    )
+
+def _update_job(job_id: str, only_active: bool = True, **values) -> Optional[JobStatus]:
+    """Atualiza o job; retorna o status atual (None se ele já saiu de running/cancelling)"""
+    with SessionLocal() as db:
+        stmt = update(Job).where(Job.id == job_id)
+        if only_active:
+            stmt = stmt.where(Job.status.in_((JobStatus.RUNNING, JobStatus.CANCELLING)))
+        row = db.execute(stmt.values(**values).returning(Job.status)).first()
+        db.commit()
+    return row.status if row else None
+
+def _retry_delay(attempts: int) -> float:
+    # Backoff exponencial com jitter
+    delay = min(JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1), JOB_RETRY_MAX_SECONDS)
+    return delay * random.uniform(0.5, 1.0)
+
+async def _heartbeat(job: ClaimedJob, runner: asyncio.Task):
+    """Renova o lease, salva o progresso e interrompe o job se o cancelamento foi pedido em outro processo"""
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+        status = await asyncio.to_thread(
+            _update_job, job.id,
+            lease_until=datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS),
+            progress=job.progress
+        )
+        if status == JobStatus.CANCELLING:
+            job.cancel_requested = True
+            runner.cancel()
+
+# job_id -> (job, task) dos jobs rodando neste processo
+_running: Dict[str, tuple] = {}
+
+async def _execute(job: ClaimedJob):
+    # A task herda o plano do job para a fila do model_scheduler
+    with model_plan(job.plan.value):
+        runner = asyncio.create_task(JOB_HANDLERS[job.kind](job))
+    _running[job.id] = (job, runner)
+    heartbeat = asyncio.create_task(_heartbeat(job, runner))
+    try:
+        result = await runner
+    except asyncio.CancelledError:
+        if not job.cancel_requested or asyncio.current_task().cancelling():
+            # Shutdown: geração simples volta para a fila; lote já acertou o que fez.
+            # shield: a escrita termina mesmo que o shutdown cancele de novo
+            if job.kind in _SELF_SETTLING:
+                values = _finish_values(JobStatus.FAILED, error="interrompido no shutdown")
+            else:
+                values = {"status": JobStatus.QUEUED, "attempts": job.attempts - 1, "lease_until": None}
+            await asyncio.shield(asyncio.to_thread(_update_job, job.id, **values))
+            raise
+        if job.kind not in _SELF_SETTLING:
+            await _refund(job)
+        await asyncio.to_thread(_update_job, job.id, **_finish_values(JobStatus.CANCELLED, progress=job.progress))
+    except Exception as e:
+        print(f"Erro no job {job.id} (tentativa {job.attempts}/{job.max_attempts}): {e}")
+        if job.attempts < job.max_attempts and job.kind not in _SELF_SETTLING:
+            await asyncio.to_thread(
+                _update_job, job.id,
+                status=JobStatus.QUEUED,
+                lease_until=None,
+                error=str(e)[:1024],
+                run_after=datetime.utcnow() + timedelta(seconds=_retry_delay(job.attempts))
+            )
+        else:
+            if job.kind not in _SELF_SETTLING:
+                await _refund(job)
+            await asyncio.to_thread(_update_job, job.id, **_finish_values(JobStatus.FAILED, error=str(e)[:1024]))
+    else:
+        await asyncio.to_thread(
+            _update_job, job.id,
+            **_finish_values(
+                JobStatus.DONE,
+                result=json.dumps(result, ensure_ascii=False),
+                quota_remaining=result.get("quota_remaining"),
+                progress=job.progress,
+                error=None
+            )
+        )
+    finally:
+        heartbeat.cancel()
+        _running.pop(job.id, None)
+
+async def _worker():
+    while True:
+        _wakeup.clear()
+        job = await asyncio.to_thread(_claim_next_job)
+        if job is None:
+            try:
+                await asyncio.wait_for(_wakeup.wait(), JOB_POLL_INTERVAL_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        await _execute(job)
+
+_workers: List[asyncio.Task] = []
+
+def start_job_workers(count: int = JOB_WORKERS):
+    for _ in range(count):
+        _workers.append(asyncio.create_task(_worker()))
+
+async def stop_job_workers():
+    """Shutdown: interrompe os workers; gerações em andamento voltam para a fila"""
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+
+# ==================== MANUTENÇÃO ====================
+
+def maintain_jobs() -> int:
+    """
+    Job periódico: devolve à fila os jobs cujo worker parou de renovar o lease
+    (ou os encerra, se acabaram as tentativas, devolvendo a quota) e apaga os
+    resultados expirados. Retorna quantos jobs foram tocados.
+    """
+    now = datetime.utcnow()
+    touched = 0
+    with SessionLocal() as db:
+        stale = db.execute(
+            select(Job.id, Job.user_id, Job.kind, Job.status, Job.attempts, Job.max_attempts, Job.quota_reserved)
+            .where(Job.status.in_((JobStatus.RUNNING, JobStatus.CANCELLING)), Job.lease_until < now)
+        ).all()
+        for job in stale:
+            if job.status == JobStatus.RUNNING and job.attempts < job.max_attempts and job.kind not in _SELF_SETTLING:
+                values = {"status": JobStatus.QUEUED, "lease_until": None, "run_after": now}
+            else:
+                status = JobStatus.CANCELLED if job.status == JobStatus.CANCELLING else JobStatus.FAILED
+                values = _finish_values(status, error="worker parou de responder")
+            claimed = db.execute(
+                update(Job).where(Job.id == job.id, Job.status == job.status, Job.lease_until < now).values(**values)
+            ).rowcount
+            db.commit()
+            if claimed and values["status"] != JobStatus.QUEUED:
+                _refund_sync(db, job.user_id, job.quota_reserved)
+            touched += claimed
+
+        touched += db.execute(delete(Job).where(Job.expires_at < now)).rowcount
+        db.commit()
+    return touched
+
+if __name__ == "__main__":
+    # Processo só de workers; ver lifecycle.run_workers
+    from lifecycle import run_workers
+    asyncio.run(run_workers())
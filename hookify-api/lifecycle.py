@@ -0,0 +1,100 @@
+"""
+Ciclo de vida dos processos: tarefas periódicas e sequência de shutdown
+Compartilhado entre a API (lifespan do app.py) e o processo só de workers
+de jobs (python jobs.py), para que os dois gravem e devolvam o mesmo estado
+em memória (quota, cliques, histórico, last_used das API keys)
+"""
+
+from typing import List
+from auth import flush_api_key_last_used, refresh_inactive_users, API_KEY_LAST_USED_FLUSH_SECONDS, JWT_REVOCATION_CHECK_SECONDS
+from batch import wait_batch_settlements
+from clicks import click_writer, prune_click_data, CLICK_PRUNE_INTERVAL_SECONDS
+from db import Base, engine
+from hashing import shutdown_hashing
+from history import history_writer
+from jobs import start_job_workers, stop_job_workers, maintain_jobs, JOB_WORKERS, JOB_MAINTENANCE_INTERVAL_SECONDS
+from links import flush_clicks, warm_link_cache, CLICK_FLUSH_SECONDS
+from migrations import run_migrations
+from quota import quota_buckets, release_quota_leases, QUOTA_LEASE_IDLE_SECONDS
+from usage import reconcile_recent_usage, USAGE_RECONCILE_INTERVAL_SECONDS
+import asyncio
+import signal
+
+async def run_periodically(fn, interval: float):
+    """Executa `fn` (síncrona) em uma thread a cada `interval` segundos"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(fn)
+        except Exception as e:
+            print(f"Erro na tarefa periódica {fn.__name__}: {e}")
+
+async def start_background(job_workers: int = JOB_WORKERS) -> List[asyncio.Task]:
+    """Inicia writers, tarefas periódicas e workers de jobs; retorna as tarefas periódicas"""
+    history_writer.start()
+    click_writer.start()
+    await asyncio.to_thread(refresh_inactive_users)
+    await asyncio.to_thread(warm_link_cache)
+    tasks = [
+        asyncio.create_task(run_periodically(flush_api_key_last_used, API_KEY_LAST_USED_FLUSH_SECONDS)),
+        asyncio.create_task(run_periodically(refresh_inactive_users, JWT_REVOCATION_CHECK_SECONDS)),
+        asyncio.create_task(run_periodically(flush_clicks, CLICK_FLUSH_SECONDS)),
+        asyncio.create_task(run_periodically(prune_click_data, CLICK_PRUNE_INTERVAL_SECONDS)),
+        asyncio.create_task(run_periodically(reconcile_recent_usage, USAGE_RECONCILE_INTERVAL_SECONDS)),
+        asyncio.create_task(run_periodically(maintain_jobs, JOB_MAINTENANCE_INTERVAL_SECONDS))
+    ]
+    start_job_workers(job_workers)
+    if quota_buckets:
+        tasks.append(asyncio.create_task(run_periodically(release_quota_leases, QUOTA_LEASE_IDLE_SECONDS)))
+    return tasks
+
+async def _shutdown_step(name: str, fn, *args):
+    """Um passo do shutdown: a falha de um não pode impedir os seguintes de gravar o que é deles"""
+    try:
+        if asyncio.iscoroutinefunction(fn):
+            await fn(*args)
+        else:
+            await asyncio.to_thread(fn, *args)
+    except Exception as e:
+        print(f"Erro no shutdown ({name}): {e}")
+
+async def stop_background(tasks: List[asyncio.Task]):
+    """Shutdown: grava o que estiver pendente em memória antes de encerrar"""
+    for task in tasks:
+        task.cancel()
+    await _shutdown_step("workers de jobs", stop_job_workers)
+    await _shutdown_step("acerto dos lotes", wait_batch_settlements)
+    await _shutdown_step("leases de quota", release_quota_leases, False)
+    await _shutdown_step("last_used das API keys", flush_api_key_last_used)
+    await _shutdown_step("cliques", flush_clicks)
+    await _shutdown_step("histórico", history_writer.stop)
+    await _shutdown_step("eventos de clique", click_writer.stop)
+    await _shutdown_step("hashing", shutdown_hashing)
+
+async def run_workers(count: int = JOB_WORKERS):
+    """
+    Processo só de workers (python jobs.py): consome a fila sem servir HTTP,
+    para escalar separado da API, que então pode rodar com JOB_WORKERS=0.
+    Roda as mesmas tarefas periódicas da API e, em SIGINT/SIGTERM, o mesmo
+    shutdown (gerações em andamento voltam para a fila).
+    """
+    if count < 1:
+        print("JOB_WORKERS=0: nenhum worker para iniciar")
+        return
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass  # Windows: Ctrl+C cancela a task principal (asyncio.run)
+
+    tasks = await start_background(count)
+    print(f"{count} workers de jobs rodando (Ctrl+C para encerrar)")
+    try:
+        await stop.wait()
+    finally:
+        await stop_background(tasks)
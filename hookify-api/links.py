@@ -0,0 +1,218 @@
+"""
+Motor de redirecionamento dos links encurtados
+Cache code -> destino (URL e UTMs) em memória e contadores de cliques em shards gravados em lote
+"""
+
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from sqlalchemy import select, update, bindparam, func, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from cache import MemoryCache
+from db import SessionLocal
+from models import Link
+from utils import encode_cursor, decode_cursor
+import os
+import threading
+import zlib
+
+# Configurações (podem ser alteradas via env)
+LINK_CACHE_MAX_ENTRIES = int(os.getenv("LINK_CACHE_MAX_ENTRIES", "100000"))
+LINK_CACHE_TTL = int(os.getenv("LINK_CACHE_TTL", "86400"))  # segundos; o destino de um código não muda
+LINK_BATCH_MAX_SIZE = int(os.getenv("LINK_BATCH_MAX_SIZE", "10000"))  # links por chamada de /links/shorten/batch
+LINK_CACHE_WARM_LIMIT = int(os.getenv("LINK_CACHE_WARM_LIMIT", "10000"))  # links mais clicados carregados no startup
+CLICK_COUNTER_SHARDS = int(os.getenv("CLICK_COUNTER_SHARDS", "16"))
+CLICK_FLUSH_SECONDS = float(os.getenv("CLICK_FLUSH_SECONDS", "2"))
+
+# ==================== CACHE DE LINKS ====================
+
+class CachedLink(NamedTuple):
+    url: str
+    utm_source: Optional[str] = None
+    utm_medium: Optional[str] = None
+    utm_campaign: Optional[str] = None
+
+_LINK_COLUMNS = (Link.url, Link.utm_source, Link.utm_medium, Link.utm_campaign)
+
+_link_cache = MemoryCache(max_entries=LINK_CACHE_MAX_ENTRIES, ttl=LINK_CACHE_TTL)
+
+def cache_link(link: Link):
+    """Coloca (ou substitui) o destino do código no cache; chamado ao criar o link"""
+    _link_cache.set(link.code, CachedLink(link.url, link.utm_source, link.utm_medium, link.utm_campaign))
+
+def cache_links(rows: List[dict]):
+    """Versão em lote de cache_link para linhas recém-inseridas (dicts com as colunas do Link)"""
+    for row in rows:
+        _link_cache.set(row["code"], CachedLink(row["url"], row["utm_source"], row["utm_medium"], row["utm_campaign"]))
+
+def warm_link_cache(limit: int = LINK_CACHE_WARM_LIMIT) -> int:
+    """Carrega os links mais clicados no cache (usado no startup)"""
+    if limit <= 0:
+        return 0
+    with SessionLocal() as db:
+        rows = db.execute(select(Link.code, *_LINK_COLUMNS).order_by(Link.clicks.desc()).limit(limit)).all()
+    for code, *columns in rows:
+        _link_cache.set(code, CachedLink(*columns))
+    return len(rows)
+
+async def resolve_link(code: str, db: AsyncSession) -> Optional[CachedLink]:
+    """Retorna o destino do código (memória primeiro, banco no miss)"""
+    link = _link_cache.get(code)
+    if link is not None:
+        return link
+    row = (await db.execute(select(*_LINK_COLUMNS).where(Link.code == code))).first()
+    if row is None:
+        return None
+    link = CachedLink(*row)
+    _link_cache.set(code, link)
+    return link
+
+# ==================== CONTADORES DE CLIQUES ====================
+
+class ClickCounters:
+    """
+    Contadores em memória divididos em shards (um lock por shard) para que
+    redirecionamentos concorrentes não disputem o mesmo lock. `drain` troca
+    os shards e devolve o acumulado para ser gravado em lote.
+    """
+
+    def __init__(self, shards: int = CLICK_COUNTER_SHARDS):
+        self._shards = [({}, threading.Lock()) for _ in range(max(1, shards))]
+        self._counters = {"clicks": 0, "flushed": 0, "flushes": 0, "failed_flushes": 0}
+
+    def _shard(self, code: str):
+        return self._shards[zlib.crc32(code.encode()) % len(self._shards)]
+
+    def add(self, code: str, n: int = 1):
+        counts, lock = self._shard(code)
+        with lock:
+            counts[code] = counts.get(code, 0) + n
+
+    def drain(self) -> Dict[str, int]:
+        drained: Dict[str, int] = {}
+        for counts, lock in self._shards:
+            # Copia e limpa sob o lock: um add concorrente cai antes ou depois, nunca se perde
+            with lock:
+                if not counts:
+                    continue
+                snapshot = dict(counts)
+                counts.clear()
+            drained.update(snapshot)
+        return drained
+
+    def pending(self) -> int:
+        return sum(sum(counts.values()) for counts, _ in self._shards)
+
+click_counters = ClickCounters()
+
+def record_click(code: str):
+    """Contabiliza o clique só em memória; o UPDATE acontece em flush_clicks"""
+    click_counters.add(code)
+    click_counters._counters["clicks"] += 1
+
+def flush_clicks() -> int:
+    """Grava os cliques acumulados com um único executemany; retorna quantos cliques"""
+    pending = click_counters.drain()
+    if not pending:
+        return 0
+
+    table = Link.__table__
+    try:
+        with SessionLocal() as db:
+            db.execute(
+                update(table)
+                .where(table.c.code == bindparam("link_code"))
+                .values(clicks=table.c.clicks + bindparam("n")),
+                [{"link_code": code, "n": n} for code, n in pending.items()]
+            )
+            db.commit()
+    except Exception:
+        # Devolve os cliques aos contadores para a próxima tentativa
+        for code, n in pending.items():
+            click_counters.add(code, n)
+        click_counters._counters["failed_flushes"] += 1
+        raise
+
+    total = sum(pending.values())
+    click_counters._counters["flushed"] += total
+    click_counters._counters["flushes"] += 1
+    return total
+
+def link_stats() -> dict:
+    return {
+        **click_counters._counters,
+        "pending_clicks": click_counters.pending(),
+        "cached_links": len(_link_cache)
+    }
+
+# ==================== ANALYTICS ====================
+
+_ANALYTICS_COLUMNS = (
+    Link.id, Link.code, Link.url, Link.clicks,
+    Link.utm_source, Link.utm_medium, Link.utm_campaign, Link.created_at
+)
+
+def _int_cursor(cursor: str, arity: int) -> list:
+    """Cursor de list_links: exatamente `arity` inteiros; ValueError se não for"""
+    values = decode_cursor(cursor)
+    if len(values) != arity or not all(type(value) is int for value in values):
+        raise ValueError("cursor inválido")
+    return values
+
+def list_links(
+    db: Session,
+    user_id: int,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    order: str = "recent",
+    utm_campaign: Optional[str] = None,
+    utm_source: Optional[str] = None
+) -> Tuple[List, Optional[str]]:
+    """
+    Página de links do usuário com paginação por keyset (só colunas, sem ORM).
+    order="recent" usa o id (crescente como o created_at); order="clicks" usa (clicks, id).
+    Retorna (linhas, próximo cursor). ValueError se o cursor for inválido.
+    """
+    stmt = select(*_ANALYTICS_COLUMNS).where(Link.user_id == user_id)
+    if utm_campaign is not None:
+        stmt = stmt.where(Link.utm_campaign == utm_campaign)
+    if utm_source is not None:
+        stmt = stmt.where(Link.utm_source == utm_source)
+
+    if order == "clicks":
+        if cursor:
+            last_clicks, last_id = _int_cursor(cursor, 2)
+            stmt = stmt.where(or_(
+                Link.clicks < last_clicks,
+                and_(Link.clicks == last_clicks, Link.id < last_id)
+            ))
+        stmt = stmt.order_by(Link.clicks.desc(), Link.id.desc())
+    else:
+        if cursor:
+            (last_id,) = _int_cursor(cursor, 1)
+            stmt = stmt.where(Link.id < last_id)
+        stmt = stmt.order_by(Link.id.desc())
+
+    # Busca um a mais para saber se existe próxima página
+    rows = db.execute(stmt.limit(limit + 1)).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    next_cursor = encode_cursor(last.clicks, last.id) if order == "clicks" else encode_cursor(last.id)
+    return rows, next_cursor
+
+def campaign_totals(db: Session, user_id: int, utm_source: Optional[str] = None) -> List:
+    """Total de links e cliques por utm_campaign do usuário"""
+    total_clicks = func.coalesce(func.sum(Link.clicks), 0)
+    stmt = (
+        select(Link.utm_campaign, func.count(Link.id).label("links"), total_clicks.label("clicks"))
+        .where(Link.user_id == user_id)
+        .group_by(Link.utm_campaign)
+        .order_by(total_clicks.desc())
+    )
+    if utm_source is not None:
+        stmt = stmt.where(Link.utm_source == utm_source)
+    return db.execute(stmt).all()
+
+def owns_link(db: Session, user_id: int, code: str) -> bool:
+    return db.scalar(select(Link.id).where(Link.code == code).where(Link.user_id == user_id)) is not None
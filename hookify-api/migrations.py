@@ -0,0 +1,75 @@
+"""
+Migrações do schema, aplicadas no startup depois do create_all
+O create_all só cria tabelas novas; colunas e índices em tabelas existentes
+entram aqui como passos numerados, registrados em schema_migrations
+"""
+
+from datetime import datetime
+from sqlalchemy import Table, Column, Integer, String, DateTime, MetaData, inspect, insert, select, text
+from sqlalchemy.exc import IntegrityError
+from db import engine
+from models import Generation, Link
+from usage import reconcile_usage_counters
+
+_metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations", _metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(128), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+# ==================== PASSOS ====================
+# Cada passo deve ser idempotente: o create_all de um banco novo já cria tudo
+
+def _links_user_id(conn):
+    """Dono do link (links.user_id)"""
+    inspector = inspect(conn)
+    if not inspector.has_table("links"):
+        return
+    columns = {c["name"] for c in inspector.get_columns("links")}
+    if "user_id" not in columns:
+        conn.execute(text("ALTER TABLE links ADD COLUMN user_id INTEGER REFERENCES users(id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_links_user_id ON links (user_id)"))
+
+def _composite_indexes(conn):
+    """Índices compostos de /history, /subscription/usage e /analytics/links"""
+    inspector = inspect(conn)
+    for table in (Generation.__table__, Link.__table__):
+        if not inspector.has_table(table.name):
+            continue
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+def _backfill_usage_counters(conn):
+    """Preenche usage_counters a partir do histórico existente"""
+    reconcile_usage_counters(conn)
+
+MIGRATIONS = [
+    (1, "links_user_id", _links_user_id),
+    (2, "composite_indexes", _composite_indexes),
+    (3, "usage_counters_backfill", _backfill_usage_counters),
+]
+
+def run_migrations(bind=engine) -> list:
+    """Aplica, em ordem, os passos ainda não registrados; retorna as versões aplicadas"""
+    _metadata.create_all(bind)
+    with bind.connect() as conn:
+        applied = set(conn.scalars(select(schema_migrations.c.version)))
+
+    done = []
+    for version, name, step in MIGRATIONS:
+        if version in applied:
+            continue
+        try:
+            with bind.begin() as conn:
+                step(conn)
+                conn.execute(insert(schema_migrations).values(
+                    version=version, name=name, applied_at=datetime.utcnow()
+                ))
+        except IntegrityError:
+            # Outro worker aplicou o mesmo passo ao mesmo tempo
+            continue
+        done.append(version)
+    return done
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Enum, func
+from sqlalchemy import Column, Integer, BigInteger, String, Text, Date, DateTime, Boolean, ForeignKey, Enum, Index, UniqueConstraint, func
 from sqlalchemy.orm import relationship
 from db import Base
 import enum
@@ -16,6 +16,14 @@ class GenerationType(str, enum.Enum):
     EMOTION = "emotion"
     COMPLETE = "complete"
 
+class JobStatus(str, enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    CANCELLING = "cancelling"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
 # Quotas mensais por plano
 PLAN_QUOTAS = {
     PlanType.FREE: 10,
@@ -93,6 +101,10 @@ class ApiKey(Base):
 
 class Generation(Base):
     __tablename__ = "generations"
+    __table_args__ = (
+        Index("ix_generations_user_created", "user_id", "created_at"),  # /history e contagem do mês
+        Index("ix_generations_user_type_created", "user_id", "type", "created_at"),  # tipo mais usado
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -105,10 +117,25 @@ class Generation(Base):
     # Relacionamento
     user = relationship("User", back_populates="generations")
 
+class UsageCounter(Base):
+    """Gerações por usuário, dia e tipo (mantido pelo gravador do histórico)"""
+    __tablename__ = "usage_counters"
+    __table_args__ = (UniqueConstraint("user_id", "day", "type"),)
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    day = Column(Date, nullable=False)
+    type = Column(Enum(GenerationType), nullable=False)
+    count = Column(Integer, default=0, nullable=False)
+
 class Link(Base):
     __tablename__ = "links"
+    __table_args__ = (
+        Index("ix_links_user_clicks", "user_id", "clicks"),  # /analytics/links?order=clicks
+    )
     
     id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)  # None = link anônimo
     code = Column(String(16), unique=True, index=True, nullable=False)
     url = Column(String(2048), nullable=False)
     utm_source = Column(String(64))
@@ -116,3 +143,81 @@ class Link(Base):
     utm_campaign = Column(String(64))
     clicks = Column(Integer, default=0, nullable=False)
     created_at = Column(DateTime, server_default=func.now())
+
+class IdSequence(Base):
+    """Contador reservado em blocos (ex.: alocação de códigos curtos)"""
+    __tablename__ = "id_sequences"
+    
+    name = Column(String(64), primary_key=True)
+    next_value = Column(BigInteger, default=0, nullable=False)
+
+class ClickEvent(Base):
+    """Evento bruto de clique (append-only)"""
+    __tablename__ = "click_events"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    code = Column(String(16), index=True, nullable=False)
+    clicked_at = Column(DateTime, nullable=False, index=True)
+    referrer = Column(String(255))  # apenas o host
+    ua_class = Column(String(16))  # mobile, tablet, desktop, bot, other
+    utm_source = Column(String(64))
+    utm_medium = Column(String(64))
+    utm_campaign = Column(String(64))
+
+# Agregados de cliques por link e janela de tempo (atualizados incrementalmente)
+
+class ClickRollupMinute(Base):
+    __tablename__ = "click_rollups_minute"
+    __table_args__ = (UniqueConstraint("code", "bucket_start"),)
+    
+    id = Column(Integer, primary_key=True)
+    code = Column(String(16), nullable=False)
+    bucket_start = Column(DateTime, nullable=False)
+    clicks = Column(Integer, default=0, nullable=False)
+
+class ClickRollupHour(Base):
+    __tablename__ = "click_rollups_hour"
+    __table_args__ = (UniqueConstraint("code", "bucket_start"),)
+    
+    id = Column(Integer, primary_key=True)
+    code = Column(String(16), nullable=False)
+    bucket_start = Column(DateTime, nullable=False)
+    clicks = Column(Integer, default=0, nullable=False)
+
+class ClickRollupDay(Base):
+    __tablename__ = "click_rollups_day"
+    __table_args__ = (UniqueConstraint("code", "bucket_start"),)
+    
+    id = Column(Integer, primary_key=True)
+    code = Column(String(16), nullable=False)
+    bucket_start = Column(DateTime, nullable=False)
+    clicks = Column(Integer, default=0, nullable=False)
+
+class Job(Base):
+    """Geração em segundo plano: fila persistente consumida pelos workers de jobs.py"""
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_queue", "status", "priority", "created_at"),  # próximo job da fila
+        Index("ix_jobs_expires", "expires_at"),  # limpeza dos resultados expirados
+    )
+    
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    kind = Column(String(16), nullable=False)  # generate | batch
+    type = Column(Enum(GenerationType), nullable=False)
+    payload = Column(Text, nullable=False)  # JSON do pedido
+    status = Column(Enum(JobStatus), default=JobStatus.QUEUED, nullable=False)
+    priority = Column(Integer, default=0, nullable=False)  # menor = sai antes
+    attempts = Column(Integer, default=0, nullable=False)
+    max_attempts = Column(Integer, default=1, nullable=False)
+    quota_reserved = Column(Integer, default=0, nullable=False)
+    quota_remaining = Column(Integer)
+    progress = Column(Integer, default=0, nullable=False)  # itens prontos (lotes)
+    run_after = Column(DateTime, nullable=False)  # backoff entre tentativas
+    lease_until = Column(DateTime)  # renovado pelo worker enquanto o job roda
+    result = Column(Text)  # JSON
+    error = Column(String(1024))
+    created_at = Column(DateTime, nullable=False)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    expires_at = Column(DateTime)
@@ -3,10 +3,29 @@ Sistema de quota e rate limiting por plano
 """
 
 from fastapi import HTTPException, status
+from sqlalchemy import select, update, case, or_, and_, bindparam
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from models import User, Subscription, Generation, GenerationType, PLAN_QUOTAS
-import json
+from typing import Dict, Optional
+from auth import AuthenticatedUser
+from cache import MemoryCache
+from db import SessionLocal
+from history import record_generation, record_generation_async
+from models import User, Subscription, GenerationType, PlanType, PLAN_QUOTAS
+import os
+import threading
+import time
+
+# Tamanho do lote de quota reservado por worker na frente em memória (0 = desativada)
+QUOTA_LEASE_SIZE = int(os.getenv("QUOTA_LEASE_SIZE", "0"))
+# Após quantos segundos sem uso as sobras de um lote voltam para o banco
+QUOTA_LEASE_IDLE_SECONDS = int(os.getenv("QUOTA_LEASE_IDLE_SECONDS", "30"))
+# Por quantos segundos um usuário sem quota é recusado com uma leitura, sem tentar o UPDATE
+QUOTA_EXHAUSTED_TTL = int(os.getenv("QUOTA_EXHAUSTED_TTL", "60"))
+# Por quantos segundos o plano de um usuário fica em memória (atraso máximo de um upgrade feito em outro worker)
+PLAN_CACHE_TTL = int(os.getenv("PLAN_CACHE_TTL", "60"))
 
 class QuotaExceeded(HTTPException):
     """Exceção customizada para quota excedida"""
@@ -32,38 +51,258 @@ def check_and_update_quota(
         QuotaExceeded: Se a quota mensal foi excedida
     """
     
-    subscription = user.subscription
+    remaining = consume_quota(db, user.id)
+    record_generation(user.id, generation_type, input_data, output_data)
+    return remaining
+
+# ==================== RESERVA / COMMIT / ESTORNO ====================
+
+@dataclass
+class QuotaReservation:
+    """Quota reservada antes da chamada ao modelo"""
+    user_id: int
+    amount: int
+    remaining: int
+    refunded: bool = False
+
+def reserve_quota(db: Session, user_id: int, amount: int = 1) -> QuotaReservation:
+    """
+    Reserva quota antes de qualquer trabalho no modelo.
+    Usuários já sem quota são recusados com uma leitura, sem disputar escrita.
     
-    if not subscription:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Usuário sem assinatura ativa"
+    Raises:
+        QuotaExceeded: Se a quota mensal foi excedida
+    """
+    remaining = consume_quota(db, user_id, amount)
+    return QuotaReservation(user_id=user_id, amount=amount, remaining=remaining)
+
+def commit_reservation(
+    reservation: QuotaReservation,
+    generation_type: GenerationType,
+    input_data: dict = None,
+    output_data: dict = None
+) -> int:
+    """Confirma a reserva registrando a geração; retorna a quota restante"""
+    record_generation(reservation.user_id, generation_type, input_data, output_data)
+    return reservation.remaining
+
+def refund_reservation(db: Session, reservation: QuotaReservation, amount: Optional[int] = None):
+    """Devolve a quota reservada, ou só `amount` dela (geração falhou ou caiu no fallback)"""
+    amount = reservation.amount if amount is None else min(amount, reservation.amount)
+    if reservation.refunded or amount <= 0:
+        return
+    
+    if quota_buckets:
+        # O lote já está debitado no banco: a devolução volta para o lote local
+        quota_buckets.add(reservation.user_id, amount, None)
+    else:
+        db.execute(
+            update(Subscription)
+            .where(Subscription.user_id == reservation.user_id)
+            .where(Subscription.used_quota >= amount)
+            .values(used_quota=Subscription.used_quota - amount)
+            .execution_options(synchronize_session=False)
         )
+        db.commit()
     
-    # Verifica se precisa resetar a quota (novo mês)
-    if should_reset_quota(subscription):
-        reset_monthly_quota(subscription, db)
+    _exhausted.pop(reservation.user_id, None)
+    reservation.amount -= amount
+    reservation.remaining += amount
+    reservation.refunded = reservation.amount == 0
+
+async def reserve_quota_async(db: AsyncSession, user_id: int, amount: int = 1) -> QuotaReservation:
+    """Versão assíncrona de reserve_quota"""
+    return await db.run_sync(lambda session: reserve_quota(session, user_id, amount))
+
+async def commit_reservation_async(
+    reservation: QuotaReservation,
+    generation_type: GenerationType,
+    input_data: dict = None,
+    output_data: dict = None
+) -> int:
+    await record_generation_async(reservation.user_id, generation_type, input_data, output_data)
+    return reservation.remaining
+
+async def refund_reservation_async(db: AsyncSession, reservation: QuotaReservation, amount: Optional[int] = None):
+    await db.run_sync(lambda session: refund_reservation(session, reservation, amount))
+
+# ==================== CONSUMO ATÔMICO ====================
+
+# Usuários recém-recusados por quota: user_id -> instante (monotonic) até quando
+# conferir com uma leitura antes do UPDATE. A marca é só local; a decisão vem do
+# banco, então upgrades e estornos feitos em outro worker valem na hora.
+_exhausted: Dict[int, float] = {}
+
+def is_quota_exhausted(user_id: int) -> bool:
+    """Verificação em memória de usuários recém-recusados por quota"""
+    until = _exhausted.get(user_id)
+    if until is None:
+        return False
+    if until < time.monotonic():
+        _exhausted.pop(user_id, None)
+        return False
+    return True
+
+def clear_quota_exhausted(user_id: int):
+    _exhausted.pop(user_id, None)
+
+def _still_exhausted(db: Session, user_id: int, amount: int) -> bool:
+    """Leitura (sem lock de escrita) que confirma que `amount` ainda não cabe na quota"""
+    row = db.execute(
+        select(Subscription.monthly_quota, Subscription.used_quota, Subscription.last_reset)
+        .where(Subscription.user_id == user_id)
+    ).first()
+    if row is None:
+        return False
+    reset_due = row.last_reset is None or row.last_reset < datetime.utcnow() - timedelta(days=30)
+    used = 0 if reset_due else row.used_quota
+    return used + amount > row.monthly_quota
+
+def consume_quota(db: Session, user_id: int, amount: int = 1) -> int:
+    """
+    Consome `amount` unidades de quota sem ler-e-escrever em Python.
+    Usa a frente em memória quando habilitada; senão, um UPDATE condicional.
+    Retorna a quota restante.
+    
+    Raises:
+        QuotaExceeded: Se a quota mensal foi excedida
+    """
+    
+    if is_quota_exhausted(user_id):
+        if _still_exhausted(db, user_id, amount):
+            raise QuotaExceeded()
+        clear_quota_exhausted(user_id)
+    
+    if quota_buckets:
+        remaining = quota_buckets.take(user_id, amount)
+        if remaining is not None:
+            return remaining
+        
+        # Reserva um lote novo; perto do fim da quota cai para o consumo unitário
+        lease = max(quota_buckets.lease_size, amount)
+        remaining_db = _try_consume(db, user_id, lease)
+        if remaining_db is not None:
+            db.commit()
+            return quota_buckets.add(user_id, lease - amount, remaining_db)
     
-    # Verifica se ainda tem quota
-    if not subscription.can_generate():
+    remaining = _try_consume(db, user_id, amount)
+    db.commit()
+    
+    if remaining is None:
+        if db.scalar(select(Subscription.id).where(Subscription.user_id == user_id)) is None:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Usuário sem assinatura ativa"
+            )
+        _exhausted[user_id] = time.monotonic() + QUOTA_EXHAUSTED_TTL
         raise QuotaExceeded()
     
-    # Incrementa o uso
-    subscription.used_quota += 1
+    return remaining
+
+def _try_consume(db: Session, user_id: int, amount: int) -> Optional[int]:
+    """
+    UPDATE ... SET used_quota = used_quota + :amount WHERE cabe na quota RETURNING restante.
+    Também reseta a quota no mesmo comando quando o ciclo de 30 dias venceu.
+    Retorna None se não havia quota suficiente (ou assinatura).
+    """
+    now = datetime.utcnow()
+    reset_due = or_(
+        Subscription.last_reset.is_(None),
+        Subscription.last_reset < now - timedelta(days=30)
+    )
     
-    # Registra a geração no histórico
-    generation = Generation(
-        user_id=user.id,
-        type=generation_type,
-        input_data=json.dumps(input_data, ensure_ascii=False) if input_data else None,
-        output_data=json.dumps(output_data, ensure_ascii=False) if output_data else None,
-        tokens_used=0  # Pode ser atualizado depois se necessário
+    stmt = (
+        update(Subscription)
+        .where(Subscription.user_id == user_id)
+        .where(or_(
+            Subscription.used_quota + amount <= Subscription.monthly_quota,
+            and_(reset_due, Subscription.monthly_quota >= amount)
+        ))
+        .values(
+            used_quota=case((reset_due, amount), else_=Subscription.used_quota + amount),
+            last_reset=case((reset_due, now), else_=Subscription.last_reset)
+        )
+        .returning(Subscription.monthly_quota - Subscription.used_quota)
+        .execution_options(synchronize_session=False)
     )
-    db.add(generation)
-    db.commit()
-    db.refresh(subscription)
+    return db.execute(stmt).scalar_one_or_none()
+
+# ==================== FRENTE EM MEMÓRIA (TOKEN BUCKET) ====================
+
+class QuotaBuckets:
+    """
+    Cada worker reserva lotes de quota no banco com o UPDATE atômico e
+    consome localmente, sem ida ao banco. Como o lote já foi debitado,
+    a quota nunca é ultrapassada; sobras de usuários ociosos voltam ao
+    banco em lote via release_quota_leases.
+    """
+    
+    def __init__(self, lease_size: int, idle_seconds: int):
+        self.lease_size = lease_size
+        self.idle_seconds = idle_seconds
+        # user_id -> [tokens locais, restante no banco, último uso]
+        self._buckets: Dict[int, list] = {}
+        self._lock = threading.Lock()
+    
+    def take(self, user_id: int, amount: int) -> Optional[int]:
+        """Consome do lote local; retorna a quota restante estimada ou None se não houver tokens"""
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None or bucket[0] < amount:
+                return None
+            bucket[0] -= amount
+            bucket[2] = time.monotonic()
+            return bucket[0] + bucket[1]
+    
+    def add(self, user_id: int, tokens: int, remaining_db: Optional[int]) -> int:
+        """Adiciona tokens de um lote recém-reservado ou devolvidos por um estorno"""
+        with self._lock:
+            bucket = self._buckets.setdefault(user_id, [0, 0, 0.0])
+            bucket[0] += tokens
+            if remaining_db is not None:
+                bucket[1] = remaining_db
+            bucket[2] = time.monotonic()
+            return bucket[0] + bucket[1]
     
-    return subscription.remaining_quota()
+    def drain(self, idle_only: bool = True) -> Dict[int, int]:
+        """Remove os lotes (ociosos ou todos) e retorna as sobras por usuário"""
+        now = time.monotonic()
+        leftovers = {}
+        with self._lock:
+            for user_id, bucket in list(self._buckets.items()):
+                if idle_only and now - bucket[2] < self.idle_seconds:
+                    continue
+                if bucket[0]:
+                    leftovers[user_id] = bucket[0]
+                del self._buckets[user_id]
+        return leftovers
+
+quota_buckets: Optional[QuotaBuckets] = (
+    QuotaBuckets(QUOTA_LEASE_SIZE, QUOTA_LEASE_IDLE_SECONDS) if QUOTA_LEASE_SIZE > 0 else None
+)
+
+def release_quota_leases(idle_only: bool = True) -> int:
+    """Devolve ao banco, em um único executemany, as sobras dos lotes em memória"""
+    if not quota_buckets:
+        return 0
+    
+    leftovers = quota_buckets.drain(idle_only)
+    if not leftovers:
+        return 0
+    
+    table = Subscription.__table__
+    stmt = (
+        update(table)
+        .where(table.c.user_id == bindparam("uid"))
+        .values(used_quota=case(
+            (table.c.used_quota > bindparam("n"), table.c.used_quota - bindparam("n")),
+            else_=0
+        ))
+    )
+    with SessionLocal() as db:
+        db.execute(stmt, [{"uid": user_id, "n": n} for user_id, n in leftovers.items()])
+        db.commit()
+    return len(leftovers)
 
 def should_reset_quota(subscription: Subscription) -> bool:
     """Verifica se a quota deve ser resetada (novo mês)"""
@@ -118,9 +357,29 @@ def get_quota_info(user: User) -> dict:
         "last_reset": subscription.last_reset.isoformat() if subscription.last_reset else None
     }
 
+# ==================== PLANO ====================
+
+_plan_cache = MemoryCache(max_entries=100000, ttl=PLAN_CACHE_TTL)
+
+async def get_user_plan_async(db: AsyncSession, user: AuthenticatedUser) -> PlanType:
+    """
+    Plano do usuário a partir da assinatura (com cache curto). A claim do token
+    não é usada: ela vale por dias e ficaria defasada após upgrade ou downgrade.
+    """
+    plan = _plan_cache.get(str(user.id))
+    if plan is None:
+        plan = await db.scalar(select(Subscription.plan_type).where(Subscription.user_id == user.id))
+        # Encerra a transação de leitura antes da próxima escrita
+        await db.commit()
+        plan = plan.value if isinstance(plan, PlanType) else plan or PlanType.FREE.value
+        _plan_cache.set(str(user.id), plan)
+    try:
+        return PlanType(plan)
+    except ValueError:
+        return PlanType.FREE
+
 def upgrade_plan(user: User, new_plan: str, db: Session) -> Subscription:
     """Faz upgrade do plano do usuário"""
-    from models import PlanType
     
     subscription = user.subscription
     
@@ -150,5 +409,7 @@ def upgrade_plan(user: User, new_plan: str, db: Session) -> Subscription:
     
     db.commit()
     db.refresh(subscription)
+    clear_quota_exhausted(user.id)
+    _plan_cache.delete(str(user.id))
     
     return subscription
@@ -0,0 +1,256 @@
+"""
+Admissão das chamadas ao modelo
+Vagas de concorrência por plano, fila justa ponderada (WFQ) entre planos
+quando as vagas acabam e um orçamento global de tokens por minuto, ajustado
+pelos headers de rate limit das respostas do provedor
+"""
+
+from collections import Counter, defaultdict, deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional
+import asyncio
+import os
+import re
+import time
+
+def _plan_map(raw: str, cast) -> Dict[str, float]:
+    # "FREE=8,PREMIUM=64" -> {"FREE": 8, "PREMIUM": 64}
+    pairs = (item.split("=", 1) for item in raw.split(",") if "=" in item)
+    return {plan.strip().upper(): cast(value) for plan, value in pairs}
+
+# Configurações (podem ser alteradas via env)
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "64"))  # chamadas simultâneas ao modelo, todos os planos
+AI_PLAN_SLOTS = _plan_map(os.getenv("AI_PLAN_SLOTS", "FREE=8,BASIC=16,PRO=32,PREMIUM=64"), int)
+AI_PLAN_WEIGHTS = _plan_map(os.getenv("AI_PLAN_WEIGHTS", "FREE=1,BASIC=2,PRO=4,PREMIUM=8"), float)
+AI_TPM_LIMIT = int(os.getenv("AI_TPM_LIMIT", "0"))  # 0 = aprende pelo header x-ratelimit-limit-tokens
+AI_QUEUE_TIMEOUT_SECONDS = float(os.getenv("AI_QUEUE_TIMEOUT_SECONDS", "30"))
+
+DEFAULT_PLAN = "FREE"
+
+class SchedulerBusy(Exception):
+    """A chamada esperou mais que AI_QUEUE_TIMEOUT_SECONDS por uma vaga"""
+
+def parse_reset(value: Optional[str]) -> float:
+    """Duração dos headers x-ratelimit-reset-* ("1.5s", "6m0s", "20ms") em segundos"""
+    if not value:
+        return 0.0
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(n) * units[unit] for n, unit in re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value))
+
+@dataclass
+class Ticket:
+    """Vaga concedida a uma chamada; devolvida com ModelScheduler.release"""
+    plan: str
+    tokens: int
+    queued_at: float
+
+@dataclass
+class _Waiter:
+    ticket: Ticket
+    start: float
+    finish: float
+    future: asyncio.Future
+
+class ModelScheduler:
+    """
+    Chamadas sem vaga esperam em uma fila por plano; a próxima a sair é a de
+    menor tag de término virtual (custo em tokens / peso do plano), de modo que
+    sob disputa cada plano recebe vazão proporcional ao peso, sem que um plano
+    fique sem vez. Além das vagas, cada chamada reserva os tokens estimados de
+    um balde com capacidade de um minuto de TPM, reabastecido continuamente.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = AI_MAX_CONCURRENCY,
+        plan_slots: Dict[str, int] = AI_PLAN_SLOTS,
+        plan_weights: Dict[str, float] = AI_PLAN_WEIGHTS,
+        tpm_limit: int = AI_TPM_LIMIT,
+        queue_timeout: float = AI_QUEUE_TIMEOUT_SECONDS
+    ):
+        self.max_concurrency = max_concurrency
+        self.plan_slots = plan_slots
+        self.plan_weights = plan_weights
+        self.queue_timeout = queue_timeout
+        self.tpm_limit = tpm_limit
+        self._configured_tpm = tpm_limit
+        self._tokens = float(tpm_limit)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+        self._queues: Dict[str, Deque[_Waiter]] = defaultdict(deque)
+        self._in_flight = 0
+        self._plan_in_flight: Counter = Counter()
+        self._virtual_time = 0.0
+        self._last_finish: Dict[str, float] = defaultdict(float)
+        self._counters = {"admitted": Counter(), "queued": Counter(), "timeouts": Counter(), "rate_limited": 0}
+        self._wait_seconds: Counter = Counter()
+
+    # ---------- orçamento de tokens ----------
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.tpm_limit:
+            self._tokens = min(self.tpm_limit, self._tokens + (now - self._refilled_at) * self.tpm_limit / 60)
+        self._refilled_at = now
+
+    def _budget_wait(self, tokens: int) -> float:
+        """Segundos até caber `tokens` no orçamento (0 = cabe agora)"""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        if not self.tpm_limit:
+            return 0.0
+        # Chamadas maiores que o balde inteiro passam quando ele está cheio
+        missing = min(tokens, self.tpm_limit) - self._tokens
+        return max(0.0, missing * 60 / self.tpm_limit)
+
+    def _apply_headers(self, headers):
+        limit = headers.get("x-ratelimit-limit-tokens")
+        remaining = headers.get("x-ratelimit-remaining-tokens")
+        if limit and limit.isdigit():
+            # O limite configurado, se houver, serve de teto abaixo do limite do provedor
+            provider = int(limit)
+            new_limit = min(provider, self._configured_tpm) if self._configured_tpm else provider
+            if not self.tpm_limit:
+                self._tokens = float(new_limit)
+            self.tpm_limit = new_limit
+        if remaining and remaining.isdigit() and self.tpm_limit:
+            self._tokens = min(self._tokens, float(remaining))
+
+    # ---------- vagas e fila ----------
+
+    def _slots(self, plan: str) -> int:
+        return self.plan_slots.get(plan, self.plan_slots.get(DEFAULT_PLAN, self.max_concurrency))
+
+    def _weight(self, plan: str) -> float:
+        return self.plan_weights.get(plan, self.plan_weights.get(DEFAULT_PLAN, 1.0))
+
+    def _dispatch(self):
+        """Libera os próximos da fila enquanto houver vaga e orçamento"""
+        self._refill()
+        while self._in_flight < self.max_concurrency:
+            best = None
+            for plan, queue in self._queues.items():
+                if queue and self._plan_in_flight[plan] < self._slots(plan):
+                    if best is None or queue[0].finish < best.finish:
+                        best = queue[0]
+            if best is None:
+                return
+            wait = self._budget_wait(best.ticket.tokens)
+            if wait > 0:
+                self._schedule_wakeup(wait)
+                return
+            self._queues[best.ticket.plan].popleft()
+            self._virtual_time = max(self._virtual_time, best.start)
+            self._take(best.ticket)
+            best.future.set_result(True)
+
+    def _schedule_wakeup(self, delay: float):
+        if self._wakeup is not None:
+            return
+
+        def wake():
+            self._wakeup = None
+            self._dispatch()
+
+        self._wakeup = asyncio.get_running_loop().call_later(delay, wake)
+
+    def _take(self, ticket: Ticket):
+        self._in_flight += 1
+        self._plan_in_flight[ticket.plan] += 1
+        if self.tpm_limit:
+            self._tokens -= ticket.tokens
+        self._counters["admitted"][ticket.plan] += 1
+        self._wait_seconds[ticket.plan] += time.monotonic() - ticket.queued_at
+
+    def _abandon(self, waiter: _Waiter):
+        """
+        Tira da fila quem desistiu antes da vaga e desfaz o avanço da tag de
+        término do plano: quem está atrás (e as próximas chamadas) não paga
+        por uma chamada que não aconteceu.
+        """
+        queue = self._queues[waiter.ticket.plan]
+        cost = waiter.finish - waiter.start
+        behind = False
+        for other in queue:
+            if other is waiter:
+                behind = True
+            elif behind:
+                other.start -= cost
+                other.finish -= cost
+        queue.remove(waiter)
+        self._last_finish[waiter.ticket.plan] -= cost
+        waiter.future.cancel()
+
+    async def acquire(self, plan: Optional[str], tokens: int) -> Ticket:
+        """
+        Espera uma vaga para uma chamada de ~`tokens` tokens do plano.
+
+        Raises:
+            SchedulerBusy: Se a espera passar de queue_timeout
+        """
+        plan = (plan or DEFAULT_PLAN).upper()
+        ticket = Ticket(plan=plan, tokens=tokens, queued_at=time.monotonic())
+        start = max(self._virtual_time, self._last_finish[plan])
+        finish = start + tokens / self._weight(plan)
+        self._last_finish[plan] = finish
+        waiter = _Waiter(ticket, start, finish, asyncio.get_running_loop().create_future())
+        self._queues[plan].append(waiter)
+        self._dispatch()
+        if waiter.future.done():
+            return ticket
+
+        self._counters["queued"][plan] += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.future.done():
+                # Recebeu a vaga no mesmo instante em que desistiu
+                self.release(ticket)
+            else:
+                self._abandon(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self._counters["timeouts"][plan] += 1
+                raise SchedulerBusy(f"sem vaga para o modelo em {self.queue_timeout:g}s (plano {plan})")
+            raise
+        return ticket
+
+    def release(self, ticket: Ticket, used_tokens: Optional[int] = None, headers=None):
+        """Devolve a vaga; `used_tokens` corrige a estimativa e os headers ajustam o orçamento"""
+        self._in_flight -= 1
+        self._plan_in_flight[ticket.plan] -= 1
+        self._refill()
+        if used_tokens is not None and self.tpm_limit:
+            self._tokens = min(self.tpm_limit, self._tokens + ticket.tokens - used_tokens)
+        if headers is not None:
+            self._apply_headers(headers)
+        self._dispatch()
+
+    def rate_limited(self, headers=None):
+        """O provedor respondeu 429: esvazia o orçamento e pausa até o reset informado"""
+        self._counters["rate_limited"] += 1
+        self._refill()
+        self._tokens = min(self._tokens, 0.0)
+        reset = parse_reset(headers.get("x-ratelimit-reset-tokens") if headers is not None else None)
+        self._paused_until = time.monotonic() + (reset or 1.0)
+
+    def stats(self) -> Dict:
+        self._refill()
+        return {
+            "in_flight": self._in_flight,
+            "in_flight_by_plan": dict(self._plan_in_flight),
+            "waiting_by_plan": {plan: len(queue) for plan, queue in self._queues.items() if queue},
+            "admitted": dict(self._counters["admitted"]),
+            "queued": dict(self._counters["queued"]),
+            "timeouts": dict(self._counters["timeouts"]),
+            "rate_limited": self._counters["rate_limited"],
+            "avg_wait_ms": {
+                plan: round(1000 * self._wait_seconds[plan] / n, 1)
+                for plan, n in self._counters["admitted"].items() if n
+            },
+            "tpm_limit": self.tpm_limit,
+            "tokens_available": int(self._tokens) if self.tpm_limit else None,
+        }
+
+model_scheduler = ModelScheduler()
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, HttpUrl, EmailStr
-from typing import List, Optional
+from typing import List, Literal, Optional
 from datetime import datetime
 from models import PlanType, GenerationType
 
@@ -66,12 +66,17 @@ class GenerateResponse(BaseModel):
 
 # ==================== GENERATION SCHEMAS (V2 - AI Powered) ====================
 
+# Campos que controlam o transporte/cache e não fazem parte da entrada gravada no histórico
+TRANSPORT_FIELDS = {"stream", "no_cache"}
+
 class HookGenerateRequest(BaseModel):
     niche: str = Field(..., description="Nicho do conteúdo", examples=["fitness", "finanças"])
     topic: str = Field(..., description="Tópico específico", examples=["perder barriga", "investir em ações"])
     tone: str = Field("direto", description="Tom do hook", examples=["direto", "motivacional", "educativo", "storytelling"])
     platform: str = Field("tiktok", examples=["tiktok", "reels", "shorts"])
     variants: int = Field(3, ge=1, le=10, description="Número de variações")
+    no_cache: bool = Field(False, description="Ignora o cache e força novas variações")
+    stream: bool = Field(False, description="Responde em Server-Sent Events, um evento por item assim que fica pronto")
 
 class HookGenerateResponse(BaseModel):
     hooks: List[str]
@@ -85,6 +90,8 @@ class CaptionGenerateRequest(BaseModel):
     call_to_action: Optional[str] = Field(None, examples=["Comenta 'quero' para receber o guia"])
     max_length: int = Field(150, ge=50, le=300, description="Tamanho máximo em palavras")
     variants: int = Field(3, ge=1, le=10)
+    no_cache: bool = Field(False, description="Ignora o cache e força novas variações")
+    stream: bool = Field(False, description="Responde em Server-Sent Events, um evento por item assim que fica pronto")
 
 class CaptionGenerateResponse(BaseModel):
     captions: List[str]
@@ -96,6 +103,8 @@ class HashtagGenerateRequest(BaseModel):
     platform: str = Field("tiktok", examples=["tiktok", "instagram", "youtube"])
     count: int = Field(10, ge=5, le=30, description="Número de hashtags")
     include_trending: bool = Field(True, description="Incluir hashtags em alta")
+    no_cache: bool = Field(False, description="Ignora o cache e força novas variações")
+    stream: bool = Field(False, description="Responde em Server-Sent Events, um evento por item assim que fica pronto")
 
 class HashtagGenerateResponse(BaseModel):
     hashtags: List[str]
@@ -104,6 +113,7 @@ class HashtagGenerateResponse(BaseModel):
 class EmotionAnalyzeRequest(BaseModel):
     text: str = Field(..., description="Texto ou descrição do vídeo para análise")
     context: Optional[str] = Field(None, description="Contexto adicional")
+    no_cache: bool = Field(False, description="Ignora o cache e força novas variações")
 
 class EmotionAnalyzeResponse(BaseModel):
     primary_emotion: str = Field(..., description="Emoção predominante", examples=["alegria", "surpresa", "medo", "raiva", "tristeza", "neutro"])
@@ -120,6 +130,8 @@ class CompleteGenerateRequest(BaseModel):
     product_name: Optional[str] = None
     call_to_action: Optional[str] = None
     analyze_emotion: bool = Field(False, description="Incluir análise de emoção")
+    no_cache: bool = Field(False, description="Ignora o cache e força novas variações")
+    stream: bool = Field(False, description="Responde em Server-Sent Events, um evento por item assim que fica pronto")
 
 class CompleteGenerateResponse(BaseModel):
     hooks: List[str]
@@ -128,6 +140,61 @@ class CompleteGenerateResponse(BaseModel):
     emotion_analysis: Optional[EmotionAnalyzeResponse] = None
     quota_remaining: int
 
+class BatchTopic(BaseModel):
+    niche: str
+    topic: str
+    tone: str = "direto"
+    platform: str = "tiktok"
+    product_name: Optional[str] = None
+    call_to_action: Optional[str] = None
+    variants: int = Field(3, ge=1, le=10)
+    max_length: int = Field(150, ge=50, le=300, description="Legendas: tamanho máximo em palavras")
+    count: int = Field(10, ge=5, le=30, description="Hashtags: número de hashtags")
+    include_trending: bool = Field(True, description="Hashtags: incluir hashtags em alta")
+    analyze_emotion: bool = Field(False, description="Completo: incluir análise de emoção")
+
+class BatchGenerateRequest(BaseModel):
+    type: Literal["hook", "caption", "hashtag", "complete"] = Field("hook", description="Tipo de geração aplicado a todos os itens")
+    items: List[BatchTopic] = Field(..., min_length=1)
+    mode: Literal["stream", "job"] = Field("stream", description="stream: NDJSON conforme os itens ficam prontos; job: retorna um ID para consulta")
+    no_cache: bool = Field(False, description="Ignora o cache e força novas variações")
+
+class BatchItemResult(BaseModel):
+    index: int
+    status: str = Field(..., examples=["ok", "fallback", "error"])
+    output: Optional[dict] = None
+
+class BatchJobResponse(BaseModel):
+    job_id: str
+    status: str = Field(..., examples=["queued", "running", "done", "failed", "cancelled"])
+    total: int
+    completed: int
+    quota_remaining: Optional[int] = None
+    results: List[BatchItemResult] = []
+
+class JobSubmitRequest(BaseModel):
+    type: Literal["hook", "caption", "hashtag", "emotion", "complete"]
+    request: dict = Field(..., description="Corpo do endpoint /v2 correspondente ao tipo")
+
+class JobResponse(BaseModel):
+    job_id: str
+    kind: str = Field(..., examples=["generate", "batch"])
+    type: GenerationType
+    status: str = Field(..., examples=["queued", "running", "cancelling", "done", "failed", "cancelled"])
+    attempts: int
+    progress: int
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+
+class JobResult(BaseModel):
+    job_id: str
+    status: str
+    result: Optional[dict] = None
+    error: Optional[str] = None
+
 # ==================== HISTORY & ANALYTICS ====================
 
 class GenerationHistory(BaseModel):
@@ -139,6 +206,17 @@ class GenerationHistory(BaseModel):
     class Config:
         from_attributes = True
 
+class GenerationHistoryPage(BaseModel):
+    items: List[GenerationHistory]
+    next_cursor: Optional[str] = None
+
+class GenerationDetail(BaseModel):
+    id: int
+    type: GenerationType
+    created_at: datetime
+    input_data: Optional[dict] = None
+    output_data: Optional[dict] = None
+
 class UsageStats(BaseModel):
     current_plan: PlanType
     monthly_quota: int
@@ -161,7 +239,38 @@ class ShortenResponse(BaseModel):
     target_url: str
     clicks: int
 
+class ShortenBatchRequest(BaseModel):
+    links: List[ShortenRequest] = Field(..., min_length=1)
+
+class ShortenBatchResponse(BaseModel):
+    links: List[ShortenResponse]
+
 class LinkAnalytics(BaseModel):
     code: str
     url: str
     clicks: int
+    utm_source: Optional[str] = None
+    utm_medium: Optional[str] = None
+    utm_campaign: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+class LinkAnalyticsPage(BaseModel):
+    items: List[LinkAnalytics]
+    next_cursor: Optional[str] = None
+
+class CampaignTotals(BaseModel):
+    utm_campaign: Optional[str]
+    links: int
+    clicks: int
+
+class LinkTimeseriesPoint(BaseModel):
+    bucket_start: datetime
+    clicks: int
+
+class LinkTimeseries(BaseModel):
+    code: str
+    granularity: str
+    start: datetime
+    end: datetime
+    total_clicks: int
+    points: List[LinkTimeseriesPoint]
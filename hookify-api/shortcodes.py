@@ -0,0 +1,123 @@
+"""
+Alocação de códigos curtos sem colisão
+Contador no banco reservado em blocos por worker, embaralhado por uma
+permutação Feistel (bijeção) e codificado em base62
+"""
+
+from typing import List
+from sqlalchemy import update, insert
+from sqlalchemy.exc import IntegrityError
+from db import SessionLocal
+from models import IdSequence
+import hashlib
+import hmac
+import os
+import string
+import threading
+
+# Configurações (podem ser alteradas via env)
+SHORT_CODE_BLOCK_SIZE = int(os.getenv("SHORT_CODE_BLOCK_SIZE", "1000"))  # valores reservados por ida ao banco
+# Chave da permutação: NÃO alterar depois que houver links criados (mudaria o mapeamento)
+SHORT_CODE_SECRET = os.getenv("SHORT_CODE_SECRET", "hookify-short-codes").encode()
+
+SEQUENCE_NAME = "short_codes"
+ALPHABET = string.digits + string.ascii_letters
+BASE = len(ALPHABET)
+FEISTEL_ROUNDS = 4
+
+# Tamanhos usados em ordem; 6 fica de fora porque é o tamanho dos códigos
+# aleatórios legados e poderia colidir com eles
+CODE_LENGTHS = [4, 5] + list(range(7, 17))
+
+# ==================== CODIFICAÇÃO ====================
+
+def _encode(value: int, length: int) -> str:
+    chars = []
+    for _ in range(length):
+        value, rem = divmod(value, BASE)
+        chars.append(ALPHABET[rem])
+    return "".join(reversed(chars))
+
+def _round(key: bytes, round_index: int, value: int, bits: int) -> int:
+    digest = hmac.new(key, f"{round_index}:{value}".encode(), hashlib.sha256).digest()
+    return int.from_bytes(digest[:8], "big") & ((1 << bits) - 1)
+
+def _feistel(value: int, half_bits: int, key: bytes) -> int:
+    """Permutação Feistel balanceada sobre 2*half_bits bits"""
+    mask = (1 << half_bits) - 1
+    left, right = value >> half_bits, value & mask
+    for i in range(FEISTEL_ROUNDS):
+        left, right = right, left ^ _round(key, i, right, half_bits)
+    return (left << half_bits) | right
+
+def permute(index: int, domain: int, key: bytes = SHORT_CODE_SECRET) -> int:
+    """
+    Bijeção de [0, domain) nele mesmo: aplica a Feistel na menor potência de 2
+    com número par de bits que cobre o domínio e repete (cycle-walking) até
+    cair dentro do intervalo.
+    """
+    bits = max(2, (domain - 1).bit_length())
+    half_bits = (bits + 1) // 2
+    value = _feistel(index, half_bits, key)
+    while value >= domain:
+        value = _feistel(value, half_bits, key)
+    return value
+
+def code_for(sequence_value: int) -> str:
+    """Código curto do n-ésimo valor da sequência; o tamanho cresce quando a faixa esgota"""
+    offset = sequence_value
+    for length in CODE_LENGTHS:
+        domain = BASE ** length
+        if offset < domain:
+            return _encode(permute(offset, domain), length)
+        offset -= domain
+    raise OverflowError("sequência de códigos curtos esgotada")
+
+# ==================== RESERVA EM BLOCOS ====================
+
+def reserve_block(size: int) -> range:
+    """Reserva `size` valores da sequência com um UPDATE ... RETURNING atômico"""
+    table = IdSequence.__table__
+    stmt = (
+        update(table)
+        .where(table.c.name == SEQUENCE_NAME)
+        .values(next_value=table.c.next_value + size)
+        .returning(table.c.next_value)
+    )
+    with SessionLocal() as db:
+        end = db.execute(stmt).scalar()
+        if end is None:
+            # Primeira reserva: cria a sequência (outro worker pode ter criado antes)
+            try:
+                db.execute(insert(table).values(name=SEQUENCE_NAME, next_value=0))
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+            end = db.execute(stmt).scalar()
+        db.commit()
+    return range(end - size, end)
+
+class ShortCodeAllocator:
+    """Entrega códigos a partir de um bloco local; só vai ao banco quando o bloco acaba"""
+
+    def __init__(self, block_size: int = SHORT_CODE_BLOCK_SIZE):
+        self.block_size = block_size
+        self._block = iter(())
+        self._lock = threading.Lock()
+
+    def _next_value(self) -> int:
+        value = next(self._block, None)
+        if value is None:
+            self._block = iter(reserve_block(self.block_size))
+            value = next(self._block)
+        return value
+
+    def allocate(self, count: int = 1) -> List[str]:
+        with self._lock:
+            values = [self._next_value() for _ in range(count)]
+        return [code_for(v) for v in values]
+
+    def next_code(self) -> str:
+        return self.allocate(1)[0]
+
+short_codes = ShortCodeAllocator()
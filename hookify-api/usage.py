@@ -0,0 +1,95 @@
+"""
+Contadores de uso por usuário, dia e tipo
+Atualizados pelo gravador do histórico na mesma transação das gerações;
+/subscription/usage lê só estes contadores em vez de varrer o histórico.
+A reconciliação periódica só reconstrói dias já fechados, que não recebem
+mais gravações e por isso não disputam com o gravador.
+"""
+
+from collections import Counter
+from datetime import date, datetime, timedelta, time
+from typing import List, Optional, Tuple
+from sqlalchemy import select, insert, delete, func
+from sqlalchemy.orm import Session
+from db import SessionLocal, upsert_insert
+from models import Generation, GenerationType, UsageCounter
+import os
+
+# Configurações (podem ser alteradas via env)
+USAGE_RECONCILE_DAYS = int(os.getenv("USAGE_RECONCILE_DAYS", "35"))  # janela reconstruída a partir do histórico
+USAGE_RECONCILE_INTERVAL_SECONDS = int(os.getenv("USAGE_RECONCILE_INTERVAL_SECONDS", "86400"))
+# Um dia só é reconciliado depois de fechado há esse tempo (gravações em lote ainda a caminho)
+USAGE_RECONCILE_GRACE_SECONDS = int(os.getenv("USAGE_RECONCILE_GRACE_SECONDS", "3600"))
+
+def add_usage_counts(db: Session, rows: List[dict]):
+    """Soma as gerações do lote nos contadores (INSERT ... ON CONFLICT DO UPDATE)"""
+    counts = Counter((row["user_id"], row["created_at"].date(), row["type"]) for row in rows)
+    table = UsageCounter.__table__
+    stmt = upsert_insert(db.bind, table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.day, table.c.type],
+        set_={"count": table.c.count + stmt.excluded.count}
+    )
+    db.execute(stmt, [
+        {"user_id": user_id, "day": day, "type": generation_type, "count": n}
+        for (user_id, day, generation_type), n in counts.items()
+    ])
+
+def get_usage_summary(db: Session, user_id: int, days: int = 30) -> Tuple[int, Optional[GenerationType]]:
+    """Retorna (gerações nos últimos `days` dias, tipo mais usado) a partir dos contadores"""
+    since = (datetime.utcnow() - timedelta(days=days)).date()
+    rows = db.execute(
+        select(UsageCounter.type, func.sum(UsageCounter.count))
+        .where(UsageCounter.user_id == user_id)
+        .where(UsageCounter.day >= since)
+        .group_by(UsageCounter.type)
+    ).all()
+    if not rows:
+        return 0, None
+    most_used = max(rows, key=lambda row: row[1])
+    return sum(row[1] for row in rows), most_used[0]
+
+def reconcile_usage_counters(
+    db,
+    days: int = USAGE_RECONCILE_DAYS,
+    user_id: Optional[int] = None,
+    until: Optional[date] = None
+) -> int:
+    """
+    Reconstrói os contadores dos últimos `days` dias (só os anteriores a `until`,
+    se informado) a partir de `generations` (DELETE + INSERT ... SELECT agrupado).
+    Aceita Session ou Connection; não faz commit.
+    """
+    since = (datetime.utcnow() - timedelta(days=days)).date()
+    day = func.date(Generation.created_at)
+    source = (
+        select(Generation.user_id, day, Generation.type, func.count(Generation.id))
+        .where(Generation.created_at >= datetime.combine(since, time.min))
+        .group_by(Generation.user_id, day, Generation.type)
+    )
+    stale = delete(UsageCounter).where(UsageCounter.day >= since)
+    if until is not None:
+        source = source.where(Generation.created_at < datetime.combine(until, time.min))
+        stale = stale.where(UsageCounter.day < until)
+    if user_id is not None:
+        source = source.where(Generation.user_id == user_id)
+        stale = stale.where(UsageCounter.user_id == user_id)
+
+    db.execute(stale)
+    result = db.execute(
+        insert(UsageCounter).from_select(["user_id", "day", "type", "count"], source)
+    )
+    return result.rowcount
+
+def reconcile_recent_usage() -> int:
+    """
+    Job periódico: reconcilia a janela recente de todos os usuários. O dia
+    corrente fica de fora: o gravador do histórico ainda soma nele em outra
+    transação, e reconstruí-lo no meio disso contaria gerações em dobro ou
+    as perderia.
+    """
+    closed = (datetime.utcnow() - timedelta(seconds=USAGE_RECONCILE_GRACE_SECONDS)).date()
+    with SessionLocal() as db:
+        rows = reconcile_usage_counters(db, until=closed)
+        db.commit()
+    return rows
@@ -1,6 +1,62 @@
+import base64
+import json
 import random
 import string
+from typing import List
 
 def gen_code(n=6):
     alphabet = string.ascii_letters + string.digits
     return "".join(random.choice(alphabet) for _ in range(n))
+
+def encode_cursor(*values) -> str:
+    """Cursor opaco para paginação por keyset"""
+    raw = json.dumps(values, default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> list:
+    """Inverso de encode_cursor; ValueError se o cursor for inválido"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except Exception:
+        raise ValueError("cursor inválido")
+    if not isinstance(values, list):
+        raise ValueError("cursor inválido")
+    return values
+
+class JsonArrayStream:
+    """
+    Parser incremental de um array JSON de strings: feed() recebe pedaços do
+    texto (ex.: deltas do modelo) e devolve as strings que fecharam no pedaço.
+    Texto antes do '[' (como ```json) é ignorado.
+    """
+
+    def __init__(self):
+        self.items: List[str] = []
+        self.closed = False
+        self._started = False
+        self._in_string = False
+        self._escape = False
+        self._buffer: List[str] = []
+
+    def feed(self, chunk: str) -> List[str]:
+        done = []
+        for ch in chunk:
+            if self._in_string:
+                self._buffer.append(ch)
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    done.append(json.loads('"' + "".join(self._buffer)))
+                    self._buffer = []
+            elif not self._started:
+                self._started = ch == "["
+            elif ch == '"' and not self.closed:
+                self._in_string = True
+            elif ch == "]":
+                self.closed = True
+        self.items.extend(done)
+        return done
@@ -0,0 +1,58 @@
+"""
+Testes dos caches de autenticação (auth.py)
+Desativar ou reativar um usuário no banco chega às credenciais em cache na
+próxima checagem de revogação, sem esperar o TTL
+
+Uso: python -m pytest test_auth.py
+"""
+
+from sqlalchemy import update
+
+from auth import (
+    create_access_token, get_cached_api_key_user, get_user_by_api_key, get_user_by_token, refresh_inactive_users
+)
+from conftest import create_user
+from db import SessionLocal
+from models import ApiKey, User
+
+def _set_active(user_id: int, active: bool):
+    with SessionLocal() as db:
+        db.execute(update(User).where(User.id == user_id).values(is_active=active))
+        db.commit()
+
+def test_refresh_drops_cached_api_keys_of_changed_users():
+    user_id = create_user("auth-apikey@test.com")
+    other_id = create_user("auth-apikey-other@test.com")
+    with SessionLocal() as db:
+        db.add_all([ApiKey(user_id=user_id, key="hk_deactivate"), ApiKey(user_id=other_id, key="hk_other")])
+        db.commit()
+        assert get_user_by_api_key("hk_deactivate", db).is_active
+        assert get_user_by_api_key("hk_other", db).is_active
+    refresh_inactive_users()
+
+    _set_active(user_id, False)
+    assert get_cached_api_key_user("hk_deactivate").is_active  # ainda em cache
+    refresh_inactive_users()
+    assert get_cached_api_key_user("hk_deactivate") is None
+    assert get_cached_api_key_user("hk_other") is not None
+    with SessionLocal() as db:
+        assert not get_user_by_api_key("hk_deactivate", db).is_active
+
+    # Reativação também descarta a entrada (que guardava is_active=False)
+    _set_active(user_id, True)
+    refresh_inactive_users()
+    with SessionLocal() as db:
+        assert get_user_by_api_key("hk_deactivate", db).is_active
+
+def test_refresh_drops_cached_tokens_of_reactivated_users():
+    user_id = create_user("auth-token@test.com")
+    token = create_access_token({"sub": str(user_id)})  # sem claims: status vem do banco e fica em cache
+    _set_active(user_id, False)
+    refresh_inactive_users()
+    with SessionLocal() as db:
+        assert not get_user_by_token(token, db).is_active
+
+    _set_active(user_id, True)
+    refresh_inactive_users()
+    with SessionLocal() as db:
+        assert get_user_by_token(token, db).is_active
@@ -0,0 +1,173 @@
+"""
+Testes da geração em lote (batch.py)
+Opções por item chegam à geração, tópicos só dividem uma chamada quando o
+resto do prompt é igual, os que faltarem na resposta empacotada saem
+individualmente, só os itens cobrados ficam com a quota e o histórico/estorno
+é acertado mesmo quando o consumidor desiste no meio
+
+Uso: python -m pytest test_batch.py
+"""
+
+import asyncio
+import json
+
+from sqlalchemy import func, select
+
+from ai_generation import _record_fallback, generate_pack, pack_groups
+import ai_generation
+from conftest import create_user
+from db import SessionLocal
+from models import Generation, GenerationType, Subscription
+from quota import reserve_quota
+import batch
+
+def _reserve(email: str, amount: int):
+    user_id = create_user(email)
+    with SessionLocal() as db:
+        return reserve_quota(db, user_id, amount)
+
+def _used_quota(user_id: int) -> int:
+    with SessionLocal() as db:
+        return db.scalar(select(Subscription.used_quota).where(Subscription.user_id == user_id))
+
+def _history_rows(user_id: int) -> int:
+    with SessionLocal() as db:
+        return db.scalar(select(func.count(Generation.id)).where(Generation.user_id == user_id))
+
+async def _fake_item(generation_type, spec, use_cache=True):
+    topic = spec["topic"]
+    if topic == "erro":
+        raise RuntimeError("modelo fora do ar")
+    if topic == "fallback":
+        _record_fallback("complete")
+    if topic == "lento":
+        await asyncio.sleep(10)
+    return {"hooks": [topic]}
+
+def test_item_options_reach_the_generator(monkeypatch):
+    calls = []
+
+    async def fake_hashtags(niche, topic, platform, count=10, include_trending=True, use_cache=True):
+        calls.append((topic, platform, count, include_trending))
+        return []
+
+    monkeypatch.setattr(batch, "generate_hashtags", fake_hashtags)
+    spec = {"niche": "fitness", "topic": "abs", "platform": "instagram", "count": 20, "include_trending": False}
+    asyncio.run(batch.generate_item(GenerationType.HASHTAG, spec))
+    asyncio.run(batch.generate_item(GenerationType.HASHTAG, {"niche": "fitness", "topic": "core"}))
+    assert calls == [("abs", "instagram", 20, False), ("core", "tiktok", 10, True)]
+
+def test_partial_failure_refunds_only_uncharged_items(monkeypatch):
+    monkeypatch.setattr(batch, "generate_item", _fake_item)
+    specs = [{"niche": "n", "topic": topic} for topic in ("a", "erro", "b", "fallback")]
+    reservation = _reserve("batch-partial@test.com", len(specs))
+
+    async def run():
+        return [result async for result in batch.run_batch(reservation, GenerationType.COMPLETE, specs)]
+
+    results = sorted(asyncio.run(run()), key=lambda result: result["index"])
+    assert [result["status"] for result in results] == ["ok", "error", "ok", "fallback"]
+    # Erro e fallback voltam para a quota; o fallback entra no histórico, o erro não
+    assert _used_quota(reservation.user_id) == 2
+    assert reservation.amount == 2 and reservation.remaining == 8
+    assert _history_rows(reservation.user_id) == 3
+
+def test_abandoned_batch_settles_what_was_done(monkeypatch):
+    monkeypatch.setattr(batch, "generate_item", _fake_item)
+    specs = [{"niche": "n", "topic": topic} for topic in ("lento", "rápido", "lento")]
+    reservation = _reserve("batch-cancel@test.com", len(specs))
+
+    async def run():
+        results = batch.run_batch(reservation, GenerationType.COMPLETE, specs)
+        first = await results.__anext__()
+        await results.aclose()
+        return first
+
+    first = asyncio.run(run())
+    assert first["index"] == 1 and first["status"] == "ok"
+    assert _used_quota(reservation.user_id) == 1
+    assert _history_rows(reservation.user_id) == 1
+    assert not batch._settling
+
+def test_cancelled_request_still_settles(monkeypatch):
+    monkeypatch.setattr(batch, "generate_item", _fake_item)
+    specs = [{"niche": "n", "topic": topic} for topic in ("rápido", "lento")]
+    reservation = _reserve("batch-request-cancel@test.com", len(specs))
+    received = []
+
+    async def consume():
+        async for result in batch.run_batch(reservation, GenerationType.COMPLETE, specs):
+            received.append(result)
+
+    async def run():
+        task = asyncio.create_task(consume())
+        while not received:
+            await asyncio.sleep(0.01)
+        task.cancel()  # cliente desconectou
+        await asyncio.gather(task, return_exceptions=True)
+        await batch.wait_batch_settlements()
+
+    asyncio.run(run())
+    assert [result["index"] for result in received] == [0]
+    assert _used_quota(reservation.user_id) == 1
+    assert _history_rows(reservation.user_id) == 1
+
+def test_pack_groups_split_by_options_and_size():
+    specs = [
+        {"niche": "n", "topic": "t0"},
+        {"niche": "n", "topic": "t1", "count": 20},
+        {"niche": "n", "topic": "t2"},
+        {"niche": "n", "topic": "t3", "include_trending": False},
+        {"niche": "n", "topic": "t4", "count": 10, "platform": "tiktok"},  # = padrão: mesmo grupo de t0
+        {"niche": "outro", "topic": "t5"},
+        {"niche": "n", "topic": "t6"},
+    ]
+    units = pack_groups("hashtags", specs, pack_size=2)
+    assert units == [[0, 2], [4, 6], [1], [3], [5]]
+    assert sorted(index for unit in units for index in unit) == list(range(len(specs)))
+
+def test_generate_pack_maps_topics_and_flags_missing(monkeypatch):
+    prompts = []
+
+    async def fake_complete(system_prompt, user_prompt, temperature, max_tokens, use_cache=True):
+        prompts.append(user_prompt)
+        return json.dumps({"1": ["a", "#b", "c"], "2": "não é lista", "4": ["extra"]})
+
+    monkeypatch.setattr(ai_generation, "_complete", fake_complete)
+    specs = [{"niche": "n", "topic": topic, "count": 2} for topic in ("abs", "core", "glúteo")]
+    assert asyncio.run(generate_pack("hashtags", specs)) == [["#a", "#b"], None, None]
+    assert "1. abs" in prompts[0] and "3. glúteo" in prompts[0]
+
+def test_packed_batch_fills_missing_topics_individually(monkeypatch):
+    packs = []
+
+    async def fake_pack(kind, pack_specs, use_cache=True):
+        packs.append((kind, [spec["topic"] for spec in pack_specs]))
+        return [None if spec["topic"] in ("sumiu", "erro") else [f"#{spec['topic']}"] for spec in pack_specs]
+
+    async def fake_item(generation_type, spec, use_cache=True):
+        if spec["topic"] == "erro":
+            raise RuntimeError("modelo fora do ar")
+        return {"hashtags": [f"#{spec['topic']}-individual"]}
+
+    monkeypatch.setattr(batch, "generate_pack", fake_pack)
+    monkeypatch.setattr(batch, "generate_item", fake_item)
+    specs = [
+        {"niche": "n", "topic": "a"},
+        {"niche": "n", "topic": "sumiu"},
+        {"niche": "n", "topic": "b", "count": 20},  # outro grupo, sozinho: vai direto individual
+        {"niche": "n", "topic": "erro"},
+    ]
+    reservation = _reserve("batch-packed@test.com", len(specs))
+
+    async def run():
+        return [result async for result in batch.run_batch(reservation, GenerationType.HASHTAG, specs)]
+
+    results = {result["index"]: result for result in asyncio.run(run())}
+    assert packs == [("hashtags", ["a", "sumiu", "erro"])]
+    assert results[0]["output"] == {"hashtags": ["#a"]}
+    assert results[1]["output"] == {"hashtags": ["#sumiu-individual"]}
+    assert results[2]["output"] == {"hashtags": ["#b-individual"]}
+    assert results[3]["status"] == "error"
+    assert _used_quota(reservation.user_id) == 3
+    assert _history_rows(reservation.user_id) == 3
@@ -0,0 +1,38 @@
+"""
+Testes do tier compartilhado do cache de respostas (cache.SQLiteCache)
+A limpeza das expiradas usa o índice de expires_at e roda a cada N escritas
+
+Uso: python -m pytest test_cache.py
+"""
+
+import time
+
+from cache import SQLiteCache
+
+def _rows(cache: SQLiteCache) -> int:
+    return cache._conn.execute("SELECT COUNT(*) FROM ai_cache").fetchone()[0]
+
+def test_purge_runs_every_n_writes(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.db"), ttl=-1, purge_every=5)
+    for i in range(4):
+        cache.set(f"k{i}", "v")
+    # Expiradas ficam no arquivo até a limpeza, mas não são lidas
+    assert _rows(cache) == 4
+    assert cache.get("k0") is None
+
+    cache.set("k4", "v")
+    assert _rows(cache) == 0
+
+def test_purge_keeps_live_entries(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.db"), ttl=60)
+    cache.set("vivo", "v")
+    cache._conn.execute("INSERT INTO ai_cache VALUES ('velho', 'v', ?)", (time.time() - 1,))
+    assert cache.purge() == 1
+    assert cache.get("vivo") == "v"
+
+def test_purge_uses_expires_index(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.db"))
+    plan = " ".join(
+        row[-1] for row in cache._conn.execute("EXPLAIN QUERY PLAN DELETE FROM ai_cache WHERE expires_at <= 0")
+    )
+    assert "ix_ai_cache_expires" in plan
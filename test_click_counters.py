@@ -0,0 +1,56 @@
+"""
+Testes dos contadores de cliques em memória (links.ClickCounters)
+add e drain concorrentes, em várias threads, não podem perder cliques
+
+Uso: python -m pytest test_click_counters.py
+"""
+
+from collections import Counter
+import sys
+import threading
+
+from links import ClickCounters
+
+def test_concurrent_add_and_drain_lose_no_clicks():
+    counters = ClickCounters(shards=4)
+    codes = [f"code{i}" for i in range(8)]
+    adders, clicks_per_adder = 8, 5000
+    flushed = Counter()
+    done = threading.Event()
+
+    def add(worker: int):
+        for i in range(clicks_per_adder):
+            counters.add(codes[(worker + i) % len(codes)])
+
+    def drain():
+        while not done.is_set():
+            flushed.update(counters.drain())
+
+    # Troca de thread frequente para expor as corridas entre add e drain
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        drainer = threading.Thread(target=drain)
+        drainer.start()
+        threads = [threading.Thread(target=add, args=(w,)) for w in range(adders)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        done.set()
+        drainer.join()
+    finally:
+        sys.setswitchinterval(interval)
+    flushed.update(counters.drain())
+
+    assert sum(flushed.values()) == adders * clicks_per_adder
+    assert all(flushed[code] == adders * clicks_per_adder // len(codes) for code in codes)
+    assert counters.pending() == 0
+
+def test_drain_keeps_shards_usable():
+    counters = ClickCounters(shards=2)
+    counters.add("a", 3)
+    assert counters.drain() == {"a": 3}
+    assert counters.drain() == {}
+    counters.add("a")
+    assert counters.drain() == {"a": 1}
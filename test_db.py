@@ -0,0 +1,90 @@
+"""
+Testes da configuração do banco (db.py)
+Engines para SQLite em memória não recebem as opções de QueuePool e o
+read-your-writes manda ao primário só quem acabou de gravar
+
+Uso: python -m pytest test_db.py
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+from sqlalchemy import select, text, update
+from sqlalchemy.pool import StaticPool
+from starlette.requests import Request
+
+from conftest import API_DIR, create_user
+from db import build_engines, build_read_engines, engine, get_db, get_read_db, read_engines
+from models import User
+
+@pytest.mark.parametrize("url", ["sqlite://", "sqlite:///:memory:"])
+def test_in_memory_sqlite_engines(url):
+    sync_engine, async_engine = build_engines(url)
+    assert isinstance(sync_engine.pool, StaticPool)
+    with sync_engine.begin() as conn:
+        conn.execute(text("CREATE TABLE t (x INTEGER)"))
+        conn.execute(text("INSERT INTO t VALUES (1)"))
+    # Mesma conexão: a tabela continua lá
+    with sync_engine.connect() as conn:
+        assert conn.execute(text("SELECT x FROM t")).scalar() == 1
+    assert build_read_engines(url, []) == []
+
+def test_db_module_imports_with_in_memory_url():
+    env = {**os.environ, "DATABASE_URL": "sqlite:///:memory:"}
+    code = "import db; db.Base.metadata.create_all(db.engine)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=API_DIR, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+def _request(credential: str, **headers) -> Request:
+    raw = [(b"x-api-key", credential.encode())] + [(k.encode(), v.encode()) for k, v in headers.items()]
+    return Request({"type": "http", "headers": raw})
+
+def _read_bind(request: Request):
+    sessions = get_read_db(request)
+    db = next(sessions)
+    bind = db.get_bind()
+    sessions.close()
+    return bind
+
+def _use_db(request: Request, fn):
+    sessions = get_db(request)
+    fn(next(sessions))
+    sessions.close()
+
+def test_read_only_requests_use_the_replica():
+    assert read_engines, "SQLite em arquivo deve ter a réplica somente leitura"
+    request = _request("ryw-reader")
+    assert _read_bind(request) is read_engines[0]
+
+    # Commit que só encerra uma leitura não conta como escrita
+    def read_and_commit(db):
+        db.scalar(select(User.id).limit(1))
+        db.commit()
+
+    _use_db(request, read_and_commit)
+    assert _read_bind(request) is read_engines[0]
+    assert _read_bind(_request("ryw-reader", **{"x-read-consistency": "primary"})) is engine
+
+def test_reads_after_a_write_go_to_the_primary():
+    user_id = create_user("ryw@test.com")
+    writer, other = _request("ryw-writer"), _request("ryw-other")
+
+    def write(db):
+        db.execute(update(User).where(User.id == user_id).values(full_name="novo"))
+        db.commit()
+
+    _use_db(writer, write)
+    assert _read_bind(writer) is engine
+    assert _read_bind(other) is read_engines[0]
+
+    # Escrita desfeita também não conta
+    def write_and_rollback(db):
+        db.execute(update(User).where(User.id == user_id).values(full_name="outro"))
+        db.rollback()
+        db.commit()
+
+    rolled_back = _request("ryw-rollback")
+    _use_db(rolled_back, write_and_rollback)
+    assert _read_bind(rolled_back) is read_engines[0]
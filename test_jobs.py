@@ -0,0 +1,120 @@
+"""
+Testes da recuperação de jobs (jobs.py)
+O heartbeat renova o lease; sem ele, a manutenção devolve o job à fila ou o
+encerra com estorno quando as tentativas acabaram; no shutdown a geração em
+andamento volta para a fila
+
+Uso: python -m pytest test_jobs.py
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+
+from conftest import create_user
+from db import SessionLocal
+from models import GenerationType, Job, JobStatus, Subscription
+from quota import reserve_quota
+import jobs
+
+def _enqueue(email: str, max_attempts: int = 3) -> tuple:
+    user_id = create_user(email)
+    with SessionLocal() as db:
+        reservation = reserve_quota(db, user_id, 2)
+    job_id = asyncio.run(jobs.submit_job(
+        user_id, "generate", GenerationType.HOOK, {"topic": "x"}, priority=3,
+        reservation=reservation, max_attempts=max_attempts
+    ))
+    return user_id, job_id
+
+def _claim(job_id: str) -> jobs.ClaimedJob:
+    job = jobs._claim_next_job()
+    assert job is not None and job.id == job_id
+    return job
+
+def _expire_lease(job_id: str):
+    with SessionLocal() as db:
+        db.execute(update(Job).where(Job.id == job_id).values(lease_until=datetime.utcnow() - timedelta(seconds=1)))
+        db.commit()
+
+def _job(job_id: str) -> Job:
+    with SessionLocal() as db:
+        return db.get(Job, job_id)
+
+def _used_quota(user_id: int) -> int:
+    with SessionLocal() as db:
+        return db.scalar(select(Subscription.used_quota).where(Subscription.user_id == user_id))
+
+def test_expired_lease_goes_back_to_queue():
+    _, job_id = _enqueue("jobs-requeue@test.com")
+    _claim(job_id)
+    _expire_lease(job_id)
+
+    assert jobs.maintain_jobs() >= 1
+    job = _job(job_id)
+    assert job.status == JobStatus.QUEUED and job.lease_until is None
+
+    # Outro worker pega o job de novo, na segunda tentativa
+    assert _claim(job_id).attempts == 2
+
+def test_expired_lease_on_last_attempt_fails_and_refunds():
+    user_id, job_id = _enqueue("jobs-exhausted@test.com", max_attempts=1)
+    _claim(job_id)
+    _expire_lease(job_id)
+    assert _used_quota(user_id) == 2
+
+    jobs.maintain_jobs()
+    job = _job(job_id)
+    assert job.status == JobStatus.FAILED and job.error == "worker parou de responder"
+    assert _used_quota(user_id) == 0
+
+    # Rodar de novo não estorna duas vezes
+    jobs.maintain_jobs()
+    assert _used_quota(user_id) == 0
+
+def test_heartbeat_renews_lease(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_HEARTBEAT_SECONDS", 0.01)
+    _, job_id = _enqueue("jobs-heartbeat@test.com")
+    job = _claim(job_id)
+    _expire_lease(job_id)
+    job.progress = 7
+
+    async def run():
+        runner = asyncio.create_task(asyncio.sleep(10))
+        heartbeat = asyncio.create_task(jobs._heartbeat(job, runner))
+        await asyncio.sleep(0.2)
+        heartbeat.cancel()
+        runner.cancel()
+        await asyncio.gather(heartbeat, runner, return_exceptions=True)
+
+    asyncio.run(run())
+    renewed = _job(job_id)
+    assert renewed.lease_until > datetime.utcnow()
+    assert renewed.progress == 7
+
+    jobs.maintain_jobs()
+    assert _job(job_id).status == JobStatus.RUNNING
+
+def test_shutdown_requeues_running_generation(monkeypatch):
+    started = asyncio.Event()
+
+    async def slow_generation(job):
+        started.set()
+        await asyncio.sleep(10)
+
+    monkeypatch.setitem(jobs.JOB_HANDLERS, "generate", slow_generation)
+    user_id, job_id = _enqueue("jobs-shutdown@test.com")
+    job = _claim(job_id)
+
+    async def run():
+        task = asyncio.create_task(jobs._execute(job))
+        await started.wait()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
+    requeued = _job(job_id)
+    assert requeued.status == JobStatus.QUEUED and requeued.lease_until is None
+    assert requeued.attempts == 0
+    assert _used_quota(user_id) == 2  # a reserva continua com o job
@@ -0,0 +1,48 @@
+"""
+Testes do parser incremental de arrays JSON (utils.JsonArrayStream) usado
+no streaming das gerações: cada string sai assim que fecha, em qualquer
+divisão do texto em pedaços
+
+Uso: python -m pytest test_json_stream.py
+"""
+
+import json
+
+from utils import JsonArrayStream
+
+ITEMS = ["primeiro hook", 'com "aspas"', "barra \\ invertida", "emoji 🔥 e acentuação", "vírgula, ] e [ dentro"]
+
+def _feed_in_chunks(text: str, size: int):
+    parser = JsonArrayStream()
+    emitted = []
+    for i in range(0, len(text), size):
+        emitted.append(parser.feed(text[i:i + size]))
+    return parser, emitted
+
+def test_any_chunking_yields_the_same_items():
+    text = json.dumps(ITEMS, ensure_ascii=False)
+    for size in range(1, len(text) + 1):
+        parser, emitted = _feed_in_chunks(text, size)
+        assert [item for chunk in emitted for item in chunk] == ITEMS
+        assert parser.items == ITEMS
+        assert parser.closed
+
+def test_items_are_emitted_as_soon_as_they_close():
+    parser = JsonArrayStream()
+    assert parser.feed('["um", "do') == ["um"]
+    assert parser.feed('is"') == ["dois"]
+    assert parser.feed(", ") == []
+    assert not parser.closed
+    assert parser.feed('"tr\\u00eas"]') == ["três"]
+    assert parser.closed
+
+def test_text_around_the_array_is_ignored():
+    text = '```json\n["a", "b"]\n```\nTexto "solto" depois'
+    parser, _ = _feed_in_chunks(text, 3)
+    assert parser.items == ["a", "b"]
+
+def test_no_array_means_no_items():
+    parser = JsonArrayStream()
+    parser.feed('{"hooks": "não é array"}')
+    assert parser.items == []
+    assert not parser.closed
@@ -0,0 +1,46 @@
+"""
+Testes do shutdown compartilhado pela API e pelos workers (lifecycle.py)
+A falha de um passo não impede os seguintes de gravar o que está em memória
+
+Uso: python -m pytest test_lifecycle.py
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import lifecycle
+
+def test_failing_shutdown_step_does_not_skip_the_rest(monkeypatch, capsys):
+    called = []
+
+    def step(name, fail=False):
+        def run(*args):
+            called.append(name)
+            if fail:
+                raise RuntimeError("banco fora do ar")
+        return run
+
+    async def stop_job_workers():
+        called.append("workers")
+
+    monkeypatch.setattr(lifecycle, "stop_job_workers", stop_job_workers)
+    monkeypatch.setattr(lifecycle, "wait_batch_settlements", step("lotes", fail=True))
+    monkeypatch.setattr(lifecycle, "release_quota_leases", step("quota"))
+    monkeypatch.setattr(lifecycle, "flush_api_key_last_used", step("api_keys"))
+    monkeypatch.setattr(lifecycle, "flush_clicks", step("cliques", fail=True))
+    monkeypatch.setattr(lifecycle, "history_writer", SimpleNamespace(stop=step("histórico")))
+    monkeypatch.setattr(lifecycle, "click_writer", SimpleNamespace(stop=step("eventos")))
+    monkeypatch.setattr(lifecycle, "shutdown_hashing", step("hashing"))
+
+    async def run():
+        periodic = asyncio.create_task(asyncio.sleep(10))
+        await lifecycle.stop_background([periodic])
+        await asyncio.sleep(0)
+        return periodic
+
+    periodic = asyncio.run(run())
+    assert periodic.cancelled()
+    assert called == ["workers", "lotes", "quota", "api_keys", "cliques", "histórico", "eventos", "hashing"]
+    out = capsys.readouterr().out
+    assert "Erro no shutdown (cliques): banco fora do ar" in out
+    assert "Erro no shutdown (acerto dos lotes)" in out
@@ -0,0 +1,108 @@
+"""
+Testes da paginação por keyset (/analytics/links e /history)
+Páginas seguidas cobrem tudo, sem repetir nem pular, mesmo com empates na
+coluna de ordenação; cursores malformados ou de outro formato dão 400
+
+Uso: python -m pytest test_pagination.py
+"""
+
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+import pytest
+
+from app import app
+from conftest import create_user
+from db import SessionLocal
+from models import ApiKey, Generation, GenerationType, Link
+from utils import encode_cursor
+
+client = TestClient(app)
+
+def _user_with_key(email: str, key: str) -> int:
+    user_id = create_user(email)
+    with SessionLocal() as db:
+        db.add(ApiKey(user_id=user_id, key=key))
+        db.commit()
+    return user_id
+
+def _all_pages(path: str, key: str, **params) -> list:
+    items, cursor, pages = [], None, 0
+    while True:
+        query = {**params, **({"cursor": cursor} if cursor else {})}
+        response = client.get(path, params=query, headers={"X-API-Key": key})
+        assert response.status_code == 200, response.text
+        page = response.json()
+        items += page["items"]
+        pages += 1
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return items, pages
+
+def test_links_by_clicks_with_ties():
+    user_id = _user_with_key("pages-links@test.com", "hk_pages_links")
+    clicks = [5, 3, 5, 5, 0, 3, 5, 9]
+    with SessionLocal() as db:
+        db.execute(insert(Link), [
+            {"code": f"pg{i}", "url": "https://example.com", "user_id": user_id, "clicks": n}
+            for i, n in enumerate(clicks)
+        ])
+        db.commit()
+
+    items, pages = _all_pages("/analytics/links", "hk_pages_links", order="clicks", limit=2)
+    expected = sorted(range(len(clicks)), key=lambda i: (-clicks[i], -i))
+    assert [item["code"] for item in items] == [f"pg{i}" for i in expected]
+    assert pages == 4
+
+    items, _ = _all_pages("/analytics/links", "hk_pages_links", limit=3)
+    assert [item["code"] for item in items] == [f"pg{i}" for i in reversed(range(len(clicks)))]
+
+@pytest.fixture(scope="module")
+def bad_cursor_key():
+    _user_with_key("pages-bad-cursor@test.com", "hk_pages_bad_cursor")
+    return "hk_pages_bad_cursor"
+
+@pytest.mark.parametrize("order, cursor", [
+    ("recent", "!!!não é base64"),
+    ("recent", encode_cursor(5, 1)),
+    ("clicks", encode_cursor(5)),
+    ("clicks", encode_cursor("5", 1)),
+    ("recent", encode_cursor({"id": 1})),
+])
+def test_links_bad_cursor_is_400(bad_cursor_key, order, cursor):
+    response = client.get(
+        "/analytics/links", params={"order": order, "cursor": cursor}, headers={"X-API-Key": bad_cursor_key}
+    )
+    assert response.status_code == 400
+
+def test_history_with_tied_timestamps():
+    user_id = _user_with_key("pages-history@test.com", "hk_pages_history")
+    now = datetime.utcnow().replace(microsecond=0)
+    # Várias gerações no mesmo instante: o id desempata
+    stamps = [now, now, now - timedelta(seconds=1), now, now - timedelta(seconds=1), now - timedelta(seconds=2), now]
+    with SessionLocal() as db:
+        ids = [
+            db.execute(insert(Generation).values(
+                user_id=user_id, type=GenerationType.HOOK, input_data=f'{{"n": {i}}}', created_at=stamp
+            )).inserted_primary_key[0]
+            for i, stamp in enumerate(stamps)
+        ]
+        db.commit()
+
+    items, pages = _all_pages("/history", "hk_pages_history", limit=2)
+    expected = [ids[i] for i in sorted(range(len(stamps)), key=lambda i: (stamps[i], ids[i]), reverse=True)]
+    assert [item["id"] for item in items] == expected
+    assert pages == 4
+
+@pytest.mark.parametrize("cursor", [
+    "!!!não é base64",
+    encode_cursor(datetime.utcnow().isoformat()),
+    encode_cursor(datetime.utcnow().isoformat(), 1, 2),
+    encode_cursor("ontem", 1),
+    encode_cursor(5, 1),
+    encode_cursor(datetime.utcnow().isoformat(), "1"),
+])
+def test_history_bad_cursor_is_400(bad_cursor_key, cursor):
+    response = client.get("/history", params={"cursor": cursor}, headers={"X-API-Key": bad_cursor_key})
+    assert response.status_code == 400
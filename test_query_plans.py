@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Teste de regressão dos planos de consulta da Hookify API
+Popula um banco SQLite temporário e confere (EXPLAIN QUERY PLAN) que as
+consultas de /history, /subscription/usage e /analytics/links usam índices
+em vez de varrer as tabelas
+
+Uso: python test_query_plans.py   (também roda com pytest)
+Tamanho do banco: QUERY_PLAN_ROWS (padrão 200000 gerações)
+"""
+
+from datetime import datetime, timedelta
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hookify-api")
+ROWS = int(os.getenv("QUERY_PLAN_ROWS", "200000"))
+USERS = 100
+HOT_TABLES = ("generations", "usage_counters", "links", "click_rollups_minute", "click_rollups_hour", "click_rollups_day")
+
+_state = {}
+
+def print_section(title):
+    print(f"\n{'='*60}")
+    print(f"  {title}")
+    print('='*60)
+
+# ==================== SETUP ====================
+
+def setup_module(module=None):
+    """Cria o banco temporário com ROWS gerações e importa a API apontando para ele"""
+    _state["tmp"] = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_state['tmp'], 'plans.db')}"
+    os.environ.setdefault("OPENAI_API_KEY", "test")
+    sys.path.insert(0, API_DIR)
+
+    import app
+    from sqlalchemy import event, insert
+    from db import engine, SessionLocal
+    from models import User, Generation, Link, GenerationType
+    from usage import reconcile_usage_counters
+
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    types = list(GenerationType)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {"email": f"user{i}@test.com", "password_hash": "x"} for i in range(1, USERS + 1)
+        ])
+        for start in range(0, ROWS, 50000):
+            conn.execute(insert(Generation), [
+                {
+                    "user_id": rng.randint(1, USERS),
+                    "type": rng.choice(types),
+                    "input_data": '{"topic": "teste"}',
+                    "output_data": '{"hooks": []}',
+                    "created_at": now - timedelta(seconds=rng.randint(0, 90 * 86400))
+                }
+                for _ in range(start, min(start + 50000, ROWS))
+            ])
+        conn.execute(insert(Link), [
+            {
+                "code": f"c{i}", "url": "https://example.com", "user_id": rng.randint(1, USERS),
+                "utm_source": "tiktok", "utm_medium": "organic", "utm_campaign": f"camp{i % 20}",
+                "clicks": rng.randint(0, 10000)
+            }
+            for i in range(ROWS // 4)
+        ])
+        reconcile_usage_counters(conn, days=90)
+        conn.exec_driver_sql("ANALYZE")
+
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            captured.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    _state.update(app=app, engine=engine, SessionLocal=SessionLocal, captured=captured)
+
+def teardown_module(module=None):
+    _state["engine"].dispose()
+    shutil.rmtree(_state["tmp"], ignore_errors=True)
+
+# ==================== HELPERS ====================
+
+def _plans_for(fn):
+    """Executa `fn(db)` e devolve o EXPLAIN QUERY PLAN de cada SELECT emitido"""
+    captured = _state["captured"]
+    captured.clear()
+    with _state["SessionLocal"]() as db:
+        fn(db)
+    statements = list(captured)
+    captured.clear()
+
+    plans = []
+    with _state["engine"].connect() as conn:
+        for statement, parameters in statements:
+            rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+            plans.append((statement, [row[-1] for row in rows]))
+    return plans
+
+def _assert_indexed(plans, allow_temp_order=False):
+    for statement, details in plans:
+        for detail in details:
+            match = re.match(r"SCAN (\w+)", detail)
+            assert not (match and match.group(1) in HOT_TABLES), \
+                f"varredura completa em {match.group(1)}:\n{statement}\n{details}"
+            if not allow_temp_order:
+                assert "TEMP B-TREE FOR ORDER BY" not in detail, \
+                    f"ordenação sem índice:\n{statement}\n{details}"
+
+def _user():
+    from auth import AuthenticatedUser
+    return AuthenticatedUser(id=1)
+
+# ==================== TESTES ====================
+
+def test_history_pages_use_index():
+    app = _state["app"]
+    first = {}
+
+    def run(db):
+        page = app.get_history(limit=50, cursor=None, user=_user(), db=db)
+        first["cursor"] = page.next_cursor
+        app.get_history(limit=50, cursor=page.next_cursor, user=_user(), db=db)
+
+    plans = _plans_for(run)
+    assert first["cursor"], "esperava mais de uma página de histórico"
+    _assert_indexed(plans)
+
+def test_usage_uses_index():
+    app = _state["app"]
+    _assert_indexed(_plans_for(lambda db: app.get_usage(user=_user(), db=db)))
+
+def test_link_analytics_use_index():
+    from links import list_links, campaign_totals
+
+    def run(db):
+        for order in ("recent", "clicks"):
+            rows, cursor = list_links(db, 1, 50, None, order)
+            list_links(db, 1, 50, cursor, order)
+        list_links(db, 1, 50, None, "recent", utm_campaign="camp1")
+
+    _assert_indexed(_plans_for(run))
+    _assert_indexed(_plans_for(lambda db: campaign_totals(db, 1)), allow_temp_order=True)
+
+def test_click_timeseries_uses_index():
+    from clicks import get_click_timeseries, ROLLUPS
+
+    def run(db):
+        for granularity in ROLLUPS:
+            get_click_timeseries(db, "c1", granularity)
+
+    _assert_indexed(_plans_for(run))
+
+def main():
+    print_section(f"Planos de consulta ({ROWS} gerações)")
+    setup_module()
+    failures = 0
+    try:
+        for test in (
+            test_history_pages_use_index,
+            test_usage_uses_index,
+            test_link_analytics_use_index,
+            test_click_timeseries_uses_index,
+        ):
+            try:
+                test()
+                print(f"✓ {test.__name__}")
+            except AssertionError as e:
+                failures += 1
+                print(f"✗ {test.__name__}\n{e}")
+    finally:
+        teardown_module()
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
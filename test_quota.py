@@ -0,0 +1,146 @@
+"""
+Testes da reserva / commit / estorno de quota (quota.py)
+Requisições concorrentes não podem ultrapassar a quota nem resetar o ciclo
+de 30 dias mais de uma vez, estornos devolvem exatamente o reservado, a
+recusa rápida respeita mudanças feitas por outro worker e o plano vem da
+assinatura, não da claim do token
+
+Uso: python -m pytest test_quota.py
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+
+from auth import AuthenticatedUser
+from conftest import create_user
+from db import AsyncSessionLocal, SessionLocal
+from models import GenerationType, PlanType, Subscription, User
+from quota import (
+    QuotaExceeded, commit_reservation, consume_quota, get_user_plan_async, is_quota_exhausted,
+    refund_reservation, reserve_quota, upgrade_plan
+)
+
+def _used_quota(user_id: int) -> int:
+    with SessionLocal() as db:
+        return db.scalar(select(Subscription.used_quota).where(Subscription.user_id == user_id))
+
+def _try_reserve(user_id: int, amount: int = 1):
+    with SessionLocal() as db:
+        try:
+            return reserve_quota(db, user_id, amount)
+        except QuotaExceeded:
+            return None
+
+def test_concurrent_reservations_never_exceed_quota():
+    user_id = create_user("quota-race@test.com")  # FREE: 10
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(lambda _: _try_reserve(user_id), range(40)))
+
+    granted = [r for r in results if r is not None]
+    assert len(granted) == 10
+    assert sorted(r.remaining for r in granted) == list(range(10))
+    assert _used_quota(user_id) == 10
+
+def _try_consume(user_id: int, amount: int):
+    with SessionLocal() as db:
+        try:
+            return consume_quota(db, user_id, amount)
+        except QuotaExceeded:
+            return None
+
+def test_concurrent_consumers_stop_exactly_at_the_limit():
+    user_id = create_user("quota-consume@test.com")  # FREE: 10
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(lambda _: _try_consume(user_id, 3), range(32)))
+
+    granted = [r for r in results if r is not None]
+    assert sorted(granted) == [1, 4, 7]
+    assert _used_quota(user_id) == 9
+    # O 1 que sobrou ainda cabe
+    assert _try_consume(user_id, 1) == 0
+
+def test_cycle_reset_happens_once_under_concurrency():
+    user_id = create_user("quota-reset@test.com")
+    expired = datetime.utcnow() - timedelta(days=31)
+    with SessionLocal() as db:
+        db.execute(
+            update(Subscription).where(Subscription.user_id == user_id).values(used_quota=10, last_reset=expired)
+        )
+        db.commit()
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(lambda _: _try_consume(user_id, 1), range(40)))
+
+    # Um único reset: o ciclo novo rende exatamente a quota do plano
+    granted = [r for r in results if r is not None]
+    assert sorted(granted) == list(range(10))
+    assert _used_quota(user_id) == 10
+    with SessionLocal() as db:
+        last_reset = db.scalar(select(Subscription.last_reset).where(Subscription.user_id == user_id))
+    assert last_reset > expired + timedelta(days=30)
+
+def test_concurrent_refunds_return_exactly_what_was_reserved():
+    user_id = create_user("quota-refund@test.com")
+    reservations = [_try_reserve(user_id, 2) for _ in range(5)]
+    assert _used_quota(user_id) == 10
+
+    def refund(reservation):
+        with SessionLocal() as db:
+            refund_reservation(db, reservation)
+            # Estorno repetido não devolve de novo
+            refund_reservation(db, reservation)
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        list(pool.map(refund, reservations[:3]))
+    assert _used_quota(user_id) == 4
+
+    with SessionLocal() as db:
+        refund_reservation(db, reservations[3], amount=1)
+        refund_reservation(db, reservations[3], amount=5)  # limitado ao que sobrou
+    assert reservations[3].refunded and reservations[3].amount == 0
+    assert _used_quota(user_id) == 2
+
+def test_commit_keeps_quota_consumed():
+    user_id = create_user("quota-commit@test.com")
+    reservation = _try_reserve(user_id)
+    assert commit_reservation(reservation, GenerationType.HOOK, {"topic": "x"}, {"hooks": []}) == 9
+    assert _used_quota(user_id) == 1
+
+def test_fast_denial_sees_changes_from_other_workers():
+    user_id = create_user("quota-upgrade@test.com")
+    assert _try_reserve(user_id, 10) is not None
+    assert _try_reserve(user_id) is None
+    assert is_quota_exhausted(user_id)
+
+    # Upgrade feito por outro processo: a marca local deste não foi limpa
+    with SessionLocal() as db:
+        db.execute(update(Subscription).where(Subscription.user_id == user_id).values(monthly_quota=100))
+        db.commit()
+    assert is_quota_exhausted(user_id)
+
+    reservation = _try_reserve(user_id)
+    assert reservation is not None and reservation.remaining == 89
+    assert not is_quota_exhausted(user_id)
+
+def _plan_of(user: AuthenticatedUser) -> PlanType:
+    async def resolve():
+        async with AsyncSessionLocal() as db:
+            return await get_user_plan_async(db, user)
+    return asyncio.run(resolve())
+
+def test_plan_comes_from_subscription_not_token_claim():
+    user_id = create_user("quota-plan@test.com", PlanType.PREMIUM)
+    # Token emitido antes de um downgrade: a claim ainda diz PREMIUM
+    stale = AuthenticatedUser(id=user_id, plan=PlanType.PREMIUM.value)
+    with SessionLocal() as db:
+        upgrade_plan(db.get(User, user_id), PlanType.FREE.value, db)
+    assert _plan_of(stale) == PlanType.FREE
+
+    with SessionLocal() as db:
+        upgrade_plan(db.get(User, user_id), PlanType.PRO.value, db)
+    assert _plan_of(AuthenticatedUser(id=user_id, plan=PlanType.FREE.value)) == PlanType.PRO
@@ -0,0 +1,149 @@
+"""
+Testes da fila de chamadas ao modelo (scheduler.ModelScheduler)
+Ordem por peso do plano (WFQ), vagas por plano, orçamento de tokens por
+minuto, pausa após 429 e limpeza de quem desiste da fila
+
+Uso: python -m pytest test_scheduler.py
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from scheduler import ModelScheduler, SchedulerBusy, parse_reset
+
+def test_heavier_plan_jumps_ahead_of_queued_calls():
+    scheduler = ModelScheduler(
+        max_concurrency=2, plan_slots={"FREE": 2, "PREMIUM": 2},
+        plan_weights={"FREE": 1, "PREMIUM": 8}, tpm_limit=0, queue_timeout=5
+    )
+    order = []
+
+    async def call(plan: str, i: int):
+        ticket = await scheduler.acquire(plan, 100)
+        order.append(f"{plan[0]}{i}")
+        await asyncio.sleep(0.02)
+        scheduler.release(ticket, 80)
+
+    async def run():
+        free = [asyncio.create_task(call("FREE", i)) for i in range(10)]
+        await asyncio.sleep(0.005)
+        premium = [asyncio.create_task(call("PREMIUM", i)) for i in range(4)]
+        await asyncio.gather(*free, *premium)
+
+    asyncio.run(run())
+    # Os dois FREE já estavam rodando; o PREMIUM que chegou depois passa à frente dos FREE na fila
+    assert order[:2] == ["F0", "F1"]
+    assert order[2:6] == ["P0", "P1", "P2", "P3"]
+    assert order[6:] == [f"F{i}" for i in range(2, 10)]
+    stats = scheduler.stats()
+    assert stats["admitted"] == {"FREE": 10, "PREMIUM": 4}
+    assert stats["in_flight"] == 0 and stats["waiting_by_plan"] == {}
+
+def test_plan_slots_cap_concurrency_per_plan():
+    scheduler = ModelScheduler(
+        max_concurrency=10, plan_slots={"FREE": 1, "PREMIUM": 4},
+        plan_weights={"FREE": 1, "PREMIUM": 8}, tpm_limit=0, queue_timeout=5
+    )
+    current = {"FREE": 0, "PREMIUM": 0}
+    peak = {"FREE": 0, "PREMIUM": 0}
+
+    async def call(plan: str):
+        ticket = await scheduler.acquire(plan, 10)
+        current[plan] += 1
+        peak[plan] = max(peak[plan], current[plan])
+        await asyncio.sleep(0.02)
+        current[plan] -= 1
+        scheduler.release(ticket)
+
+    async def run():
+        await asyncio.gather(*[call("FREE") for _ in range(5)], *[call("PREMIUM") for _ in range(8)])
+
+    asyncio.run(run())
+    assert peak == {"FREE": 1, "PREMIUM": 4}
+
+def test_token_budget_and_rate_limit_pause():
+    scheduler = ModelScheduler(max_concurrency=10, plan_slots={}, plan_weights={}, tpm_limit=6000, queue_timeout=3)
+
+    async def run():
+        started = time.monotonic()
+        ticket = await scheduler.acquire("PRO", 5900)
+        scheduler.release(ticket, 5900, {"x-ratelimit-limit-tokens": "6000", "x-ratelimit-remaining-tokens": "100"})
+        # Faltam 100 tokens; o balde volta 100 por segundo
+        ticket = await scheduler.acquire("PRO", 200)
+        budget_wait = time.monotonic() - started
+        scheduler.release(ticket, 200)
+
+        scheduler.rate_limited({"x-ratelimit-reset-tokens": "300ms"})
+        started = time.monotonic()
+        ticket = await scheduler.acquire("PRO", 1)
+        pause = time.monotonic() - started
+        scheduler.release(ticket)
+        return budget_wait, pause
+
+    budget_wait, pause = asyncio.run(run())
+    assert 0.8 <= budget_wait <= 1.5
+    assert 0.25 <= pause <= 0.6
+    assert scheduler.stats()["rate_limited"] == 1
+
+def test_queue_timeout_and_cancel_free_the_queue():
+    scheduler = ModelScheduler(max_concurrency=1, plan_slots={}, plan_weights={}, tpm_limit=0, queue_timeout=0.1)
+
+    async def run():
+        ticket = await scheduler.acquire("FREE", 1)
+        with pytest.raises(SchedulerBusy):
+            await scheduler.acquire("FREE", 1)
+
+        waiter = asyncio.create_task(scheduler.acquire("FREE", 1))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        scheduler.release(ticket)
+
+        # A vaga liberada não ficou presa com quem desistiu
+        ticket = await scheduler.acquire("FREE", 1)
+        scheduler.release(ticket)
+
+    asyncio.run(run())
+    stats = scheduler.stats()
+    assert stats["timeouts"] == {"FREE": 1}
+    assert stats["in_flight"] == 0 and stats["waiting_by_plan"] == {}
+
+def test_abandoned_calls_do_not_push_back_their_plan():
+    scheduler = ModelScheduler(
+        max_concurrency=1, plan_slots={}, plan_weights={"FREE": 1, "PREMIUM": 2}, tpm_limit=0, queue_timeout=0.05
+    )
+    order = []
+
+    async def call(plan: str, tokens: int):
+        ticket = await scheduler.acquire(plan, tokens)
+        order.append(plan)
+        scheduler.release(ticket)
+
+    async def run():
+        holder = await scheduler.acquire("BASIC", 0)
+        # Cinco FREE desistem (timeout e cancelamento) sem chegar a rodar
+        for _ in range(3):
+            with pytest.raises(SchedulerBusy):
+                await scheduler.acquire("FREE", 100)
+        for _ in range(2):
+            waiter = asyncio.create_task(scheduler.acquire("FREE", 100))
+            await asyncio.sleep(0.01)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+
+        # Tags: FREE 100/1 = 100 contra PREMIUM 300/2 = 150; o FREE continua na frente
+        calls = [asyncio.create_task(call("FREE", 100)), asyncio.create_task(call("PREMIUM", 300))]
+        await asyncio.sleep(0.01)
+        scheduler.release(holder)
+        await asyncio.gather(*calls)
+
+    asyncio.run(run())
+    assert order == ["FREE", "PREMIUM"]
+
+def test_parse_reset():
+    assert parse_reset("6m0s") == 360
+    assert parse_reset("1.5s") == 1.5
+    assert parse_reset("20ms") == pytest.approx(0.02)
+    assert parse_reset(None) == 0
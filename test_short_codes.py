@@ -0,0 +1,48 @@
+"""
+Testes da alocação de códigos curtos (shortcodes.py)
+A permutação Feistel é uma bijeção do domínio, os tamanhos pulam o 6 dos
+códigos legados e blocos concorrentes não repetem códigos
+
+Uso: python -m pytest test_short_codes.py
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from shortcodes import ALPHABET, BASE, ShortCodeAllocator, code_for, permute
+
+def test_permute_is_a_bijection():
+    # Domínios que não são potência de 2 exercitam o cycle-walking
+    for domain in (2, 7, 100, 1000, 4097):
+        values = [permute(i, domain) for i in range(domain)]
+        assert sorted(values) == list(range(domain))
+
+def test_permute_depends_on_key():
+    a = [permute(i, 1000, key=b"a") for i in range(20)]
+    b = [permute(i, 1000, key=b"b") for i in range(20)]
+    assert a != b
+
+def test_code_lengths_skip_legacy_six():
+    four, five = BASE ** 4, BASE ** 5
+    assert len(code_for(0)) == 4
+    assert len(code_for(four - 1)) == 4
+    assert len(code_for(four)) == 5
+    assert len(code_for(four + five - 1)) == 5
+    assert len(code_for(four + five)) == 7
+    assert all(c in ALPHABET for c in code_for(four + five))
+
+def test_codes_are_unique_across_a_length_boundary():
+    four = BASE ** 4
+    values = list(range(four - 500, four + 500))
+    codes = [code_for(v) for v in values]
+    assert len(set(codes)) == len(codes)
+
+def test_concurrent_allocators_never_repeat():
+    allocators = [ShortCodeAllocator(block_size=50) for _ in range(4)]
+
+    def allocate(allocator):
+        return [code for _ in range(20) for code in allocator.allocate(10)]
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        codes = [code for batch in pool.map(allocate, allocators) for code in batch]
+    assert len(codes) == 800
+    assert len(set(codes)) == len(codes)
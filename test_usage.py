@@ -0,0 +1,83 @@
+"""
+Testes dos contadores de uso (usage.py)
+Depois de gravações concorrentes com a reconciliação, os contadores batem
+com COUNT(*) de generations; a reconciliação só reconstrói dias fechados
+
+Uso: python -m pytest test_usage.py
+"""
+
+from datetime import datetime, timedelta
+import threading
+
+from sqlalchemy import func, select, update
+
+from conftest import create_user
+from db import SessionLocal
+from history import _write_generations
+from models import Generation, GenerationType, UsageCounter
+from usage import reconcile_recent_usage
+
+def _item(user_id: int, created_at: datetime, generation_type: GenerationType = GenerationType.HOOK) -> dict:
+    return {
+        "user_id": user_id, "generation_type": generation_type,
+        "input_data": {"topic": "x"}, "output_data": {"hooks": []}, "created_at": created_at
+    }
+
+def _counters(user_id: int) -> dict:
+    with SessionLocal() as db:
+        rows = db.execute(
+            select(UsageCounter.day, UsageCounter.type, UsageCounter.count).where(UsageCounter.user_id == user_id)
+        ).all()
+    return {(day, generation_type): count for day, generation_type, count in rows if count}
+
+def _history_counts(user_id: int) -> dict:
+    day = func.date(Generation.created_at)
+    with SessionLocal() as db:
+        rows = db.execute(
+            select(day, Generation.type, func.count(Generation.id))
+            .where(Generation.user_id == user_id)
+            .group_by(day, Generation.type)
+        ).all()
+    return {(datetime.strptime(d, "%Y-%m-%d").date(), generation_type): n for d, generation_type, n in rows}
+
+def test_counters_match_history_after_concurrent_writes_and_reconcile():
+    user_id = create_user("usage-race@test.com")
+    now = datetime.utcnow()
+    _write_generations([_item(user_id, now - timedelta(days=d)) for d in (2, 3, 3)])
+    done = threading.Event()
+
+    def write():
+        types = list(GenerationType)
+        for i in range(200):
+            _write_generations([_item(user_id, datetime.utcnow(), types[i % len(types)]) for _ in range(3)])
+        done.set()
+
+    def reconcile():
+        while not done.is_set():
+            reconcile_recent_usage()
+
+    threads = [threading.Thread(target=write), threading.Thread(target=reconcile)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    reconcile_recent_usage()
+
+    assert sum(_counters(user_id).values()) == 3 + 600
+    assert _counters(user_id) == _history_counts(user_id)
+
+def test_reconcile_repairs_closed_days_only():
+    user_id = create_user("usage-drift@test.com")
+    now = datetime.utcnow()
+    _write_generations([_item(user_id, now - timedelta(days=5)), _item(user_id, now)])
+
+    # Contadores defasados nos dois dias
+    with SessionLocal() as db:
+        db.execute(update(UsageCounter).where(UsageCounter.user_id == user_id).values(count=UsageCounter.count + 10))
+        db.commit()
+    reconcile_recent_usage()
+
+    counters = _counters(user_id)
+    assert counters[((now - timedelta(days=5)).date(), GenerationType.HOOK)] == 1
+    # O dia corrente é só do gravador; a reconciliação não mexe nele
+    assert counters[(now.date(), GenerationType.HOOK)] == 11